@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+"""
+Benchmark of read-modify-write of a database value.
+
+A session marks messages as read, adding them to a set of user attribute
+``readmsgs`` already holding many messages, as formerly done, by reading
+and writing all attributes while holding a lock, and by
+:meth:`x84.bbs.dbproxy.DBProxy.set_add`, which sends only the messages
+added.  The "engine" is a thread of this process, see ``fake_session.py``.
+Reported is the time and number of requests of each update, of each
+storage backend.
+
+Usage::
+
+    python benchmarks/db_atomic.py
+"""
+from __future__ import print_function
+import tempfile
+import time
+
+import x84.bbs.ini
+import x84.bbs.session
+from x84.bbs.dbproxy import DBProxy
+
+from fake_session import FakeEngine
+
+#: storage backends of each run, see ini option ``db_backend``
+BACKENDS = ('sqlite', 'memory')
+
+#: number of messages already read
+READ = 5000
+
+#: number of messages marked read
+UPDATES = 500
+
+
+def lock_and_write(adb, idx):
+    """ Add ``idx`` to readmsgs, by reading and writing all attributes. """
+    with adb:
+        attrs = adb.get('biscuit', {})
+        attrs['readmsgs'] = attrs.get('readmsgs', set()) | set([idx])
+        adb['biscuit'] = attrs
+
+
+def set_add(adb, idx):
+    """ Add ``idx`` to readmsgs, atomically. """
+    adb.set_add('biscuit', [idx], subkey='readmsgs')
+
+
+def main():
+    """ Program entry point. """
+    x84.bbs.ini.CFG = x84.bbs.ini.init_bbs_ini()
+    x84.bbs.ini.CFG.set('session', 'db_cache', '')
+    print('{0:>8} {1:>14} {2:>10} {3:>10}'.format(
+        'backend', 'method', 'us/update', 'requests'))
+    for backend in BACKENDS:
+        x84.bbs.ini.CFG.set('system', 'datapath', tempfile.mkdtemp())
+        x84.bbs.ini.CFG.set('session', 'db_backend', backend)
+        x84.bbs.ini.reload_snapshot()
+        engine = FakeEngine()
+        x84.bbs.session.SESSION = engine.make_session()
+        adb = DBProxy('userbase', 'attrs')
+        for label, update in (('lock and write', lock_and_write),
+                              ('set_add', set_add)):
+            adb['biscuit'] = {'readmsgs': set(range(READ))}
+            requests, start = engine.requests, time.time()
+            for num in range(UPDATES):
+                update(adb, READ + num)
+            elapsed = time.time() - start
+            assert len(adb['biscuit']['readmsgs']) == READ + UPDATES
+            print('{0:>8} {1:>14} {2:>10.1f} {3:>10.1f}'.format(
+                backend, label, elapsed * 1e6 / UPDATES,
+                float(engine.requests - requests) / UPDATES))
+        engine.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+"""
+Benchmark of session database reads, with and without a session cache.
+
+A session reads user attributes as a menu loop would, by
+:class:`x84.bbs.dbproxy.DBProxy`, while another session occasionally
+writes them.  The "engine" is a thread of this process, serving requests
+by :class:`x84.db.DBWorkerPool`, see ``fake_session.py``.  Reported is the
+time of each read and the hits and misses of the session's
+:class:`x84.bbs.dbproxy.DBCache`, of each storage backend.
+
+Usage::
+
+    python benchmarks/db_cache.py
+"""
+from __future__ import print_function
+import tempfile
+import time
+
+import x84.bbs.ini
+import x84.bbs.session
+from x84.bbs.dbproxy import DBProxy
+
+from fake_session import FakeEngine
+
+#: storage backends of each run, see ini option ``db_backend``
+BACKENDS = ('sqlite', 'memory')
+
+#: number of reads by session
+READS = 20000
+
+#: number of distinct keys read
+KEYS = 50
+
+#: reads between each write by another session
+WRITE_EVERY = 100
+
+
+def run(reader, writer):
+    """ Return seconds per read. """
+    x84.bbs.session.SESSION = writer
+    attrs = DBProxy('userbase', 'attrs')
+    for num in range(KEYS):
+        attrs['user{0}'.format(num)] = {'calls': num}
+
+    start = time.time()
+    for num in range(READS):
+        x84.bbs.session.SESSION = reader
+        DBProxy('userbase', 'attrs').get('user{0}'.format(num % KEYS))
+        if num % WRITE_EVERY == 0:
+            x84.bbs.session.SESSION = writer
+            attrs['user{0}'.format(num % KEYS)] = {'calls': num}
+    return (time.time() - start) / READS
+
+
+def main():
+    """ Program entry point. """
+    x84.bbs.ini.CFG = x84.bbs.ini.init_bbs_ini()
+    # reads requested of the engine, see db_read.py for direct reads.
+    x84.bbs.ini.CFG.set('session', 'db_direct_read', 'no')
+    print('{0:>8} {1:>10} {2:>10} {3:>10} {4:>10}'.format(
+        'backend', 'cache', 'us/read', 'hits', 'misses'))
+    for backend in BACKENDS:
+        x84.bbs.ini.CFG.set('system', 'datapath', tempfile.mkdtemp())
+        x84.bbs.ini.CFG.set('session', 'db_backend', backend)
+        engine = FakeEngine()
+        for schemas in ('', 'userbase'):
+            x84.bbs.ini.CFG.set('session', 'db_cache', schemas)
+            x84.bbs.ini.reload_snapshot()
+            reader = engine.make_session()
+            elapsed = run(reader, engine.make_session())
+            cache = reader.get_db_cache('userbase')
+            print('{0:>8} {1:>10} {2:>10.1f} {3:>10} {4:>10}'.format(
+                backend, schemas or 'none', elapsed * 1e6,
+                cache.hits if cache else '-', cache.misses if cache else '-'))
+        engine.close()
+
+
+if __name__ == '__main__':
+    main()
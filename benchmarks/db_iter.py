@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+"""
+Benchmark of iterating a database by :class:`x84.bbs.dbproxy.DBProxy`.
+
+A session iterates all items of a msgbase-sized table, received in chunks
+of varying size, see ini options ``db_chunk_items`` and ``db_chunk_bytes``
+of section ``[session]``.  The "engine" is a thread of this process, see
+``fake_session.py``.  Reported is the rate of items, and the number of
+requests made by the session, of each storage backend: the engine holds
+at most one chunk of each session in memory.
+
+Usage::
+
+    python benchmarks/db_iter.py
+"""
+from __future__ import print_function
+import tempfile
+import time
+
+import x84.bbs.ini
+import x84.bbs.session
+from x84.bbs.dbproxy import DBProxy
+
+from fake_session import FakeEngine
+
+#: storage backends of each run, see ini option ``db_backend``
+BACKENDS = ('sqlite', 'memory')
+
+#: number of items of table
+ITEMS = 50000
+
+#: a message record of typical size
+BODY = u'Lorem ipsum dolor sit amet, consectetur adipiscing elit. ' * 16
+
+
+def main():
+    """ Program entry point. """
+    x84.bbs.ini.CFG = x84.bbs.ini.init_bbs_ini()
+    # reads requested of the engine, see db_read.py for direct reads.
+    x84.bbs.ini.CFG.set('session', 'db_direct_read', 'no')
+    print('{0:>8} {1:>10} {2:>10} {3:>10} {4:>10}'.format(
+        'backend', 'items', 'bytes', 'items/s', 'requests'))
+    for backend in BACKENDS:
+        x84.bbs.ini.CFG.set('system', 'datapath', tempfile.mkdtemp())
+        x84.bbs.ini.CFG.set('session', 'db_backend', backend)
+        x84.bbs.ini.reload_snapshot()
+        engine = FakeEngine()
+        x84.bbs.session.SESSION = engine.make_session()
+        msgdb = DBProxy('bench')
+        msgdb.set_many(('{0}'.format(idx), {'subject': u'test', 'body': BODY})
+                       for idx in range(ITEMS))
+        for items, max_bytes in ((64, 1 << 20), (512, 1 << 20),
+                                 (4096, 1 << 20), (4096, 65536)):
+            x84.bbs.ini.CFG.set('session', 'db_chunk_items', str(items))
+            x84.bbs.ini.CFG.set('session', 'db_chunk_bytes', str(max_bytes))
+            x84.bbs.ini.reload_snapshot()
+            requests = engine.requests
+            start = time.time()
+            assert sum(1 for _ in msgdb.iteritems()) == ITEMS
+            elapsed = time.time() - start
+            print('{0:>8} {1:>10} {2:>10} {3:>10.0f} {4:>10}'.format(
+                backend, items, max_bytes, ITEMS / elapsed,
+                engine.requests - requests))
+        engine.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+"""
+Benchmark of database requests served by the engine.
+
+Requests of several "sessions", as sent by :class:`x84.bbs.dbproxy.DBProxy`,
+are served as the engine once did, by a new thread and database connection
+for each request, and by the :class:`x84.db.DBWorkerPool` of long-lived
+threads and connections, of each storage backend.  Reported is the
+throughput and latency of requests, and the metrics of the pool.
+
+Usage::
+
+    python benchmarks/db_pool.py
+"""
+from __future__ import print_function
+import threading
+import tempfile
+import time
+
+import x84.bbs.ini
+from x84.db import DBHandler, DBWorkerPool, get_database
+from x84.framing import decode_event, encode_event
+
+#: number of requests for each session
+REQUESTS = 500
+
+#: number of sessions, each of a differing database schema by modulo.
+SESSIONS = 8
+SCHEMAS = ('userbase', 'msgbase', 'oneliner')
+
+#: storage backends of each run, see ini option ``db_backend``
+BACKENDS = ('sqlite', 'memory')
+
+
+class FakePipe(object):
+
+    """ A ``tty.master_write`` pipe, recording time of each reply. """
+
+    def __init__(self):
+        self.replies = []
+        self.done = threading.Event()
+
+    def send_bytes(self, buf):
+        event, data = decode_event(buf)
+        if event == 'exception':
+            raise data
+        self.replies.append(time.time())
+        if len(self.replies) == REQUESTS:
+            self.done.set()
+
+
+def requests(num):
+    """ Return list of ``(event, data)`` requests of session ``num``. """
+    schema = SCHEMAS[num % len(SCHEMAS)]
+    result = []
+    for idx in range(REQUESTS):
+        key = '{0}-{1}'.format(num, idx % 50)
+        if idx % 4 == 0:
+            args = (key, {'handle': key, 'idx': idx})
+            result.append(('db-' + schema, ('bench', '__setitem__', args)))
+        else:
+            result.append(('db-' + schema, ('bench', 'get', (key, None))))
+    # framed as by the session, arguments remain pickled.
+    return [decode_event(encode_event(event, data))
+            for event, data in result]
+
+
+def serve_thread(handler):
+    """ Serve request by a new thread and connection, as once done. """
+    def run():
+        dictdb = get_database(handler.filepath, handler.table)
+        try:
+            handler.run(dictdb)
+        finally:
+            dictdb.close()
+    thread = threading.Thread(target=run)
+    thread.start()
+
+
+def run(submit):
+    """ Return elapsed time and latencies of all sessions' requests. """
+    pipes = [FakePipe() for _ in range(SESSIONS)]
+    queued = []
+    start = time.time()
+    # interleave requests of all sessions, as received by the engine.
+    for batch in zip(*[requests(num) for num in range(SESSIONS)]):
+        for pipe, (event, data) in zip(pipes, batch):
+            queued.append(time.time())
+            submit(DBHandler(pipe, event, data))
+    for pipe in pipes:
+        pipe.done.wait()
+    elapsed = time.time() - start
+    replies = [reply for batch in zip(*[pipe.replies for pipe in pipes])
+               for reply in batch]
+    return elapsed, sorted(reply - sent for sent, reply
+                           in zip(queued, replies))
+
+
+def report(label, elapsed, latencies):
+    """ Display throughput and latency. """
+    print('{0:>10} {1:>10.0f} {2:>10.2f} {3:>10.2f}'.format(
+        label, len(latencies) / elapsed,
+        latencies[len(latencies) // 2] * 1e3,
+        latencies[int(len(latencies) * .99)] * 1e3))
+
+
+def main():
+    """ Program entry point. """
+    x84.bbs.ini.CFG = x84.bbs.ini.init_bbs_ini()
+    for backend in BACKENDS:
+        x84.bbs.ini.CFG.set('system', 'datapath', tempfile.mkdtemp())
+        x84.bbs.ini.CFG.set('session', 'db_backend', backend)
+        x84.bbs.ini.reload_snapshot()
+        print('{0}:'.format(backend))
+        print('{0:>10} {1:>10} {2:>10} {3:>10}'.format(
+            'method', 'req/s', 'p50 (ms)', 'p99 (ms)'))
+        report('thread', *run(serve_thread))
+        for num_workers in (1, 4):
+            pool = DBWorkerPool(num_workers)
+            report('pool({0})'.format(num_workers), *run(pool.submit))
+            print('{0:>10} {1}'.format('', ', '.join(
+                '{0}={1:.4g}'.format(key, value)
+                for key, value in sorted(pool.metrics().items()))))
+            pool.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+"""
+Benchmark of database reads of many session sub-processes.
+
+Each "session" is a forked sub-process reading values by
+:class:`x84.bbs.dbproxy.DBProxy`, of a schema that is not cached, while
+this process plays the part of the engine, see ``fake_session.py``.
+Reads are made by request of the engine, and directly by each session's
+read-only connection (ini option ``db_direct_read``).  Reported is the
+total throughput of reads of all sessions, and the number of requests
+received by the engine.
+
+Usage::
+
+    python benchmarks/db_read.py
+"""
+from __future__ import print_function
+from multiprocessing import Pipe
+import tempfile
+import time
+import os
+
+import x84.bbs.ini
+import x84.bbs.session
+from x84.bbs.dbproxy import DBProxy
+
+from fake_session import FakeEngine
+
+#: number of reads of each session
+READS = 5000
+
+#: number of distinct keys read
+KEYS = 1000
+
+#: numbers of concurrent sessions of each run
+SESSIONS = (1, 2, 4)
+
+
+def session(sess, writer):
+    """ Read ``READS`` values, sending elapsed time to ``writer``. """
+    x84.bbs.session.SESSION = sess
+    start = time.time()
+    for num in range(READS):
+        DBProxy('msgbase', 'bench').get(str(num % KEYS))
+    writer.send(time.time() - start)
+
+
+def run(engine, num_sessions):
+    """ Return reads per second of all sessions. """
+    results = []
+    pids = []
+    for _ in range(num_sessions):
+        sess = engine.make_session()
+        reader, writer = Pipe(duplex=False)
+        pid = os.fork()
+        if pid == 0:
+            session(sess, writer)
+            os._exit(0)
+        pids.append(pid)
+        results.append(reader)
+    elapsed = max(reader.recv() for reader in results)
+    for pid in pids:
+        os.waitpid(pid, 0)
+    return READS * num_sessions / elapsed
+
+
+def main():
+    """ Program entry point. """
+    x84.bbs.ini.CFG = x84.bbs.ini.init_bbs_ini()
+    x84.bbs.ini.CFG.set('system', 'datapath', tempfile.mkdtemp())
+    engine = FakeEngine()
+    x84.bbs.session.SESSION = engine.make_session()
+    DBProxy('msgbase', 'bench').set_many(
+        (str(num), {'subject': 'message {0}'.format(num), 'body': 'x' * 500})
+        for num in range(KEYS))
+
+    print('{0:>10} {1:>10} {2:>10} {3:>16}'.format(
+        'reads', 'sessions', 'reads/s', 'engine requests'))
+    for direct_read in ('no', 'yes'):
+        x84.bbs.ini.CFG.set('session', 'db_direct_read', direct_read)
+        for num_sessions in SESSIONS:
+            requests = engine.requests
+            rate = run(engine, num_sessions)
+            print('{0:>10} {1:>10} {2:>10.0f} {3:>16}'.format(
+                'direct' if direct_read == 'yes' else 'engine',
+                num_sessions, rate, engine.requests - requests))
+    engine.close()
+
+
+if __name__ == '__main__':
+    main()
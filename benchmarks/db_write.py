@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+"""
+Benchmark of concurrent database writes of many sessions.
+
+Each "session" is a thread that writes to the same schema, one request at
+a time, awaiting each reply as :class:`x84.bbs.dbproxy.DBProxy` would.
+Requests are served by :class:`x84.db.DBWorkerPool`, of each storage
+backend, for several journal modes and ``synchronous`` levels, with and
+without group commit.
+Reported is the throughput and latency of writes, and the number of
+transactions committed by groups.
+
+Usage::
+
+    python benchmarks/db_write.py
+"""
+from __future__ import print_function
+from multiprocessing import Pipe
+import threading
+import tempfile
+import time
+
+import x84.bbs.ini
+from x84.db import DBHandler, DBWorkerPool
+from x84.framing import recv_event
+
+#: number of sessions writing concurrently
+SESSIONS = 16
+
+#: number of writes of each session
+WRITES = 200
+
+#: ``(backend, journal_mode, synchronous, commit_delay)`` of each run,
+#: the journal mode is only of the sqlite backend.
+CONFIGS = (('sqlite', 'delete', 'off', 0),
+           ('sqlite', 'delete', 'full', 0),
+           ('sqlite', 'wal', 'normal', 0),
+           ('sqlite', 'wal', 'full', 0),
+           ('sqlite', 'wal', 'normal', 0.005),
+           ('sqlite', 'wal', 'full', 0.005),
+           ('memory', '-', 'normal', 0),
+           ('memory', '-', 'full', 0),
+           ('memory', '-', 'normal', 0.005),
+           ('memory', '-', 'full', 0.005))
+
+
+def session(pool, num, latencies):
+    """ Write ``WRITES`` values, one at a time. """
+    reader, writer = Pipe(duplex=False)
+    for idx in range(WRITES):
+        key = '{0}-{1}'.format(num, idx % 50)
+        start = time.time()
+        pool.submit(DBHandler(writer, 'db-msgbase', (
+            'bench', '__setitem__', (key, {'author': key, 'idx': idx}))))
+        event, data = recv_event(reader)
+        if event == 'exception':
+            raise data
+        latencies.append(time.time() - start)
+
+
+def run(pool):
+    """ Return elapsed time and latencies of all sessions' writes. """
+    latencies = []
+    threads = [threading.Thread(target=session, args=(pool, num, latencies))
+               for num in range(SESSIONS)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.time() - start, sorted(latencies)
+
+
+def main():
+    """ Program entry point. """
+    x84.bbs.ini.CFG = x84.bbs.ini.init_bbs_ini()
+    print('{0:>8} {1:>8} {2:>8} {3:>8} {4:>10} {5:>10} {6:>10} {7:>8}'
+          .format('backend', 'journal', 'sync', 'delay', 'writes/s',
+                  'p50 (ms)', 'p99 (ms)', 'commits'))
+    for backend, journal_mode, synchronous, commit_delay in CONFIGS:
+        x84.bbs.ini.CFG.set('system', 'datapath', tempfile.mkdtemp())
+        x84.bbs.ini.CFG.set('session', 'db_backend', backend)
+        if backend == 'sqlite':
+            x84.bbs.ini.CFG.set('session', 'db_journal_mode', journal_mode)
+        x84.bbs.ini.CFG.set('session', 'db_synchronous', synchronous)
+        x84.bbs.ini.reload_snapshot()
+        pool = DBWorkerPool(4, commit_delay=commit_delay)
+        elapsed, latencies = run(pool)
+        print('{0:>8} {1:>8} {2:>8} {3:>8} {4:>10.0f} {5:>10.2f} '
+              '{6:>10.2f} {7:>8}'.format(
+                  backend, journal_mode, synchronous, commit_delay or '-',
+                  len(latencies) / elapsed,
+                  latencies[len(latencies) // 2] * 1e3,
+                  latencies[int(len(latencies) * .99)] * 1e3,
+                  pool.metrics()['commits'] or '-'))
+        pool.close()
+
+
+if __name__ == '__main__':
+    main()
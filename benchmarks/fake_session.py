@@ -0,0 +1,85 @@
+"""
+Sessions served by threads of this process, playing the part of the engine.
+
+Used by benchmarks of :mod:`x84.bbs.dbproxy`, whose sessions' database
+requests are served by :class:`x84.db.DBWorkerPool` as by the engine.
+"""
+from multiprocessing import Pipe
+import threading
+import logging
+
+import x84.bbs.session
+import x84.terminal
+from x84.db import DBHandler, DBWorkerPool
+from x84.framing import recv_event, send_event
+
+
+class FakeTerminal(object):
+
+    """ A terminal whose output stream discards all output. """
+
+    class stream(object):
+
+        @staticmethod
+        def flush():
+            pass
+
+
+class FakeTTY(object):
+
+    """ A :class:`x84.terminal.TerminalProcess` of only its pipe. """
+
+    def __init__(self, master_write):
+        self.master_write = master_write
+
+
+class FakeEngine(object):
+
+    """ Database worker pool serving any number of sessions. """
+
+    def __init__(self, num_workers=4):
+        self.pool = DBWorkerPool(num_workers)
+        self.ttys = []
+        #: number of database and lock requests received of all sessions
+        self.requests = 0
+        x84.terminal.get_terminals = lambda: list(enumerate(self.ttys))
+
+    def make_session(self):
+        """ Return new session, served by a thread of this engine. """
+        session_read, master_write = Pipe(duplex=False)
+        master_read, session_write = Pipe(duplex=False)
+        session = x84.bbs.session.Session.__new__(x84.bbs.session.Session)
+        session.reader, session.writer = session_read, session_write
+        session.terminal = FakeTerminal()
+        session.log = logging.getLogger('bench')
+        # pylint: disable=W0212
+        #         Access to a protected member
+        session._buffer = dict()
+        session._db_caches = dict()
+        session._db_readers = dict()
+        self.ttys.append(FakeTTY(master_write))
+
+        def serve():
+            while True:
+                try:
+                    event, data = recv_event(master_read)
+                except EOFError:
+                    # session was discarded
+                    return
+                self.requests += 1
+                if event.startswith('lock-'):
+                    # locks are always granted, sessions of benchmarks
+                    # use them only one at a time.
+                    if data[0] in ('acquire', 'wait'):
+                        send_event(master_write, event, True)
+                    continue
+                self.pool.submit(DBHandler(master_write, event, data))
+
+        thread = threading.Thread(target=serve)
+        thread.daemon = True
+        thread.start()
+        return session
+
+    def close(self):
+        """ Stop worker pool. """
+        self.pool.close()
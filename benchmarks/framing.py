@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+"""
+Micro-benchmark of engine-side decoding of session events.
+
+Compares the cost of unpickling each event received by the engine, as
+done by ``multiprocessing.Connection.recv``, against decoding the binary
+frames of :mod:`x84.framing`.  For ``route`` and ``global`` events, the
+cost of encoding the event forwarded to the target session is included,
+and for ``output`` events, the cost of encoding text for the client, which
+is now done by the session.
+
+Usage::
+
+    python benchmarks/framing.py
+"""
+from __future__ import print_function
+import cPickle as pickle
+import timeit
+
+from x84.framing import encode_event, decode_event
+
+EVENTS = (
+    ('output', (u'\x1b[1;37mHello,\x1b[m world! ' * 4, 'utf8')),
+    ('output', (u'\x1b[10;20H', 'cp437')),
+    ('route', ('telnet-127.0.0.1:52001', 'ACK',
+               'telnet-127.0.0.1:52002', u'biflet')),
+    ('global', ('AYT', 'telnet-127.0.0.1:52002')),
+    ('lock-node/1', ('acquire', None)),
+    ('db-userbase', ('attrs', 'get', (u'biflet', None))),
+)
+
+
+def pickled_path(payload):
+    """ Decode (and forward) as before, by cPickle. """
+    event, data = pickle.loads(payload)
+    if event == 'output':
+        data[0].encode(data[1], 'replace')
+    elif event == 'route':
+        pickle.dumps((data[1], data[2:]), pickle.HIGHEST_PROTOCOL)
+    elif event == 'global':
+        pickle.dumps((event, data), pickle.HIGHEST_PROTOCOL)
+
+
+def framed_path(payload):
+    """ Decode (and forward) by :mod:`x84.framing`. """
+    event, data = decode_event(payload)
+    if event == 'route':
+        encode_event(data[1], data[2])
+    elif event == 'global':
+        encode_event(event, data)
+
+
+def main():
+    """ Program entry point. """
+    number = 100000
+    print('{0:>14} {1:>8} {2:>8} {3:>14} {4:>14}'.format(
+        'event', 'pickled', 'framed', 'pickle (usec)', 'framed (usec)'))
+    for event, data in EVENTS:
+        pickled = pickle.dumps((event, data), pickle.HIGHEST_PROTOCOL)
+        framed = encode_event(event, data)
+        t_pickle = min(timeit.repeat(
+            lambda: pickled_path(pickled), number=number, repeat=3)) / number
+        t_framed = min(timeit.repeat(
+            lambda: framed_path(framed), number=number, repeat=3)) / number
+        print('{0:>14} {1:>8} {2:>8} {3:>14.2f} {4:>14.2f}'.format(
+            event, len(pickled), len(framed),
+            t_pickle * 1e6, t_framed * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+"""
+Benchmark of counting messages of the message area.
+
+A session counts messages of its subscription, as when the message area of
+``msgarea.py`` is displayed, of msgbases of increasing number of messages.
+The "engine" is a thread of this process, see ``fake_session.py``.
+Reported is the time of each display, which should not grow with the
+number of messages.
+
+Usage::
+
+    python benchmarks/msg_area.py
+"""
+from __future__ import print_function
+import datetime
+import os
+import sys
+import tempfile
+import time
+
+import x84.bbs.ini
+import x84.bbs.session
+from x84.bbs.userbase import User
+from x84.db import get_db_filepath
+from x84.msgstore import MsgStore
+
+from fake_session import FakeEngine
+
+#: number of messages of each msgbase
+MESSAGES = (5000, 20000, 80000)
+
+#: tags of messages of msgbase
+TAGS = 20
+
+#: subscriptions of each display
+SUBSCRIPTIONS = ((u'*',), (u'tag0',), (u'tag0', u'tag1'))
+
+#: number of displays of each subscription
+DISPLAYS = 20
+
+
+def populate(store, start, stop):
+    """ Store messages ``start`` to ``stop``, each of one of :data:`TAGS`. """
+    now = datetime.datetime.now()
+    with store.transaction():
+        for idx in range(start, stop):
+            store.save_msg({
+                'idx': None, 'author': u'biscuit', 'recipient': None,
+                'ctime': now, 'stime': now, 'subject': u'test',
+                'parent': None, 'body': u'', 'extra': {},
+                'tags': [u'public', u'tag{0}'.format(idx % TAGS)]})
+
+
+def main():
+    """ Program entry point. """
+    x84.bbs.ini.CFG = x84.bbs.ini.init_bbs_ini()
+    x84.bbs.ini.CFG.set('system', 'datapath', tempfile.mkdtemp())
+    x84.bbs.ini.reload_snapshot()
+    # the message area script, of ini options set above.
+    sys.path.insert(0, os.path.join(
+        os.path.dirname(x84.__file__), 'default'))
+    msgarea = __import__('msgarea')
+    store = MsgStore(get_db_filepath('msgbase'), 'store')
+    engine = FakeEngine()
+    session = x84.bbs.session.SESSION = engine.make_session()
+    # pylint: disable=W0212
+    #         Access to a protected member
+    session._user = User(u'biscuit')
+    print('{0:>8} {1:>16} {2:>10}'.format(
+        'messages', 'subscription', 'ms/display'))
+    populated = 0
+    for num_messages in MESSAGES:
+        populate(store, populated, num_messages)
+        populated = num_messages
+        for subscription in SUBSCRIPTIONS:
+            start = time.time()
+            for _ in range(DISPLAYS):
+                messages, _ = msgarea.get_messages_by_subscription(
+                    session, subscription)
+            elapsed = time.time() - start
+            assert messages['new'] == messages['all']
+            print('{0:>8} {1:>16} {2:>10.2f}'.format(
+                num_messages, u','.join(subscription),
+                elapsed * 1e3 / DISPLAYS))
+    engine.close()
+    store.close()
+
+
+if __name__ == '__main__':
+    main()
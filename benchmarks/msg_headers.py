@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+"""
+Benchmark of listing messages.
+
+A session lists pages of messages of a msgbase of many messages of long
+bodies, as a listing of their author, subject and date, by
+:func:`x84.bbs.msgbase.list_msg_headers`, compared to reading each message
+by :func:`x84.bbs.msgbase.get_msg` as before.  The "engine" is a thread of
+this process, see ``fake_session.py``.  Reported is the time of each page,
+which should not grow with the size of bodies.
+
+Usage::
+
+    python benchmarks/msg_headers.py
+"""
+from __future__ import print_function
+import datetime
+import tempfile
+import time
+
+import x84.bbs.ini
+import x84.bbs.session
+from x84.bbs.msgbase import get_msg, list_msg_headers, list_msgs
+from x84.db import get_db_filepath
+from x84.msgstore import MsgStore
+
+from fake_session import FakeEngine
+
+#: number of messages of msgbase
+MESSAGES = 50000
+
+#: tags of messages of msgbase
+TAGS = 10
+
+#: number of messages of each page, and number of pages listed
+PAGE, PAGES = 50, 20
+
+#: a message body of a few screens of text
+BODY = u'Lorem ipsum dolor sit amet, consectetur adipiscing elit. ' * 64
+
+
+def populate(store):
+    """ Store :data:`MESSAGES` messages, each of one of :data:`TAGS`. """
+    now = datetime.datetime.now()
+    with store.transaction():
+        for idx in range(MESSAGES):
+            store.save_msg({
+                'idx': None, 'author': u'biscuit', 'recipient': None,
+                'ctime': now, 'stime': now, 'subject': u'test',
+                'parent': None, 'body': BODY, 'extra': {},
+                'tags': [u'public', u'tag{0}'.format(idx % TAGS)]})
+
+
+def by_headers(tags, offset):
+    """ List a page of messages by their headers. """
+    return [(header.author, header.subject, header.stime)
+            for header in list_msg_headers(tags=tags, offset=offset,
+                                           limit=PAGE, order='desc')]
+
+
+def by_messages(tags, offset):
+    """ List a page of messages by reading each message. """
+    indices = sorted(list_msgs(tags), reverse=True)[offset:offset + PAGE]
+    return [(msg.author, msg.subject, msg.stime)
+            for msg in map(get_msg, indices)]
+
+
+def main():
+    """ Program entry point. """
+    x84.bbs.ini.CFG = x84.bbs.ini.init_bbs_ini()
+    x84.bbs.ini.CFG.set('system', 'datapath', tempfile.mkdtemp())
+    x84.bbs.ini.reload_snapshot()
+    store = MsgStore(get_db_filepath('msgbase'), 'store')
+    populate(store)
+    engine = FakeEngine()
+    x84.bbs.session.SESSION = engine.make_session()
+    print('{0:>9} {1:>8} {2:>7} {3:>8}'.format(
+        'listing', 'tags', 'offset', 'ms/page'))
+    for label, listing in (('headers', by_headers),
+                           ('messages', by_messages)):
+        for tags in (None, (u'tag0',)):
+            for offset in (0, MESSAGES // TAGS // 2):
+                start = time.time()
+                for _ in range(PAGES):
+                    page = listing(tags, offset)
+                elapsed = time.time() - start
+                assert len(page) == PAGE
+                print('{0:>9} {1:>8} {2:>7} {3:>8.2f}'.format(
+                    label, u','.join(tags or (u'*',)), offset,
+                    elapsed * 1e3 / PAGES))
+    engine.close()
+    store.close()
+
+
+if __name__ == '__main__':
+    main()
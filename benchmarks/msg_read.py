@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+"""
+Benchmark of recording messages read.
+
+A session reads each message of a msgbase of many messages, of a few tags,
+in the order received, marking each read by
+:func:`x84.bbs.msgbase.mark_read`, and lists messages unread of its
+subscribed tags, as by the msgarea.  The "engine" is a thread of this
+process, see ``fake_session.py``.  Reported at intervals of messages read
+is the time of each, and the rows recorded of the user, which should not
+grow with the number of messages read, compared to the size of the pickled
+set of user attribute ``readmsgs`` formerly recorded.
+
+Usage::
+
+    python benchmarks/msg_read.py
+"""
+from __future__ import print_function
+import cPickle as pickle
+import datetime
+import tempfile
+import time
+
+import x84.bbs.ini
+import x84.bbs.session
+from x84.bbs.msgbase import mark_read, list_unread
+from x84.db import get_db_filepath
+from x84.msgstore import MsgStore
+
+from fake_session import FakeEngine
+
+#: number of messages of msgbase
+MESSAGES = 20000
+
+#: tags of messages of msgbase, and tags subscribed
+TAGS, SUBSCRIBED = 8, (u'tag0', u'tag1', u'tag2')
+
+#: number of messages read between each report
+INTERVAL = 1500
+
+
+def populate(store):
+    """ Store :data:`MESSAGES` messages, each of one of :data:`TAGS`. """
+    now = datetime.datetime.now()
+    with store.transaction():
+        for idx in range(MESSAGES):
+            store.save_msg({
+                'idx': None, 'author': u'biscuit', 'recipient': None,
+                'ctime': now, 'stime': now, 'subject': u'test',
+                'parent': None, 'body': u'', 'extra': {},
+                'tags': [u'public', u'tag{0}'.format(idx % TAGS)]})
+
+
+def main():
+    """ Program entry point. """
+    x84.bbs.ini.CFG = x84.bbs.ini.init_bbs_ini()
+    x84.bbs.ini.CFG.set('system', 'datapath', tempfile.mkdtemp())
+    x84.bbs.ini.reload_snapshot()
+    store = MsgStore(get_db_filepath('msgbase'), 'store')
+    populate(store)
+    engine = FakeEngine()
+    x84.bbs.session.SESSION = engine.make_session()
+    print('{0:>8} {1:>10} {2:>10} {3:>6} {4:>10}'.format(
+        'read', 'us/mark', 'us/unread', 'rows', 'readmsgs'))
+    subscribed = sorted(list_unread(u'biscuit', tags=SUBSCRIBED))
+    for start in range(0, len(subscribed), INTERVAL):
+        indices = subscribed[start:start + INTERVAL]
+        begin = time.time()
+        for idx in indices:
+            mark_read(u'biscuit', [idx])
+        elapsed_mark = (time.time() - begin) / len(indices)
+        begin = time.time()
+        unread = list_unread(u'biscuit', tags=SUBSCRIBED)
+        elapsed_unread = time.time() - begin
+        assert len(unread) == len(subscribed) - start - len(indices)
+        # pylint: disable=W0212
+        #         Access to a protected member
+        rows = sum(store._select(
+            'SELECT COUNT(*) FROM {0} WHERE handle = ?'.format(table),
+            (u'biscuit',))[0][0] for table in ('msg_read_mark',
+                                               'msg_read_range'))
+        print('{0:>8} {1:>10.1f} {2:>10.1f} {3:>6} {4:>10}'.format(
+            start + len(indices), elapsed_mark * 1e6, elapsed_unread * 1e6,
+            rows, len(pickle.dumps(set(subscribed[:start + len(indices)]),
+                                   pickle.HIGHEST_PROTOCOL))))
+    engine.close()
+    store.close()
+
+
+if __name__ == '__main__':
+    main()
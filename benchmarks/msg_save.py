@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+"""
+Benchmark of saving messages to a large msgbase.
+
+A session posts new messages, replies to messages, and changes a tag of
+messages of a msgbase of many messages, by :meth:`x84.bbs.msgbase.Msg.save`.
+The "engine" is a thread of this process, see ``fake_session.py``.  Reported
+is the rate of saves, and the number of requests made by the session, of
+each: the cost of a save should not depend on the number of messages, nor
+on the number of tags or replies of other messages.
+
+Usage::
+
+    python benchmarks/msg_save.py
+"""
+from __future__ import print_function
+import datetime
+import random
+import tempfile
+import time
+
+import x84.bbs.ini
+import x84.bbs.session
+from x84.bbs.msgbase import Msg, get_msg
+from x84.db import get_db_filepath
+from x84.msgstore import MsgStore
+
+from fake_session import FakeEngine
+
+#: number of messages of msgbase
+MESSAGES = 100000
+
+#: number of distinct tags of messages of msgbase
+TAGS = 200
+
+#: number of messages saved of each kind
+SAVES = 1000
+
+#: a message body of typical size
+BODY = u'Lorem ipsum dolor sit amet, consectetur adipiscing elit. ' * 16
+
+
+def populate(store):
+    """ Store :data:`MESSAGES` messages, each of a few tags. """
+    now = datetime.datetime.now()
+    with store.transaction():
+        for idx in range(MESSAGES):
+            store.save_msg({
+                'idx': None, 'author': u'biscuit', 'recipient': None,
+                'ctime': now, 'stime': now, 'subject': u'test',
+                'parent': random.randrange(idx) if idx % 3 else None,
+                'body': BODY, 'extra': {},
+                'tags': [u'public', u'tag{0}'.format(idx % TAGS)]})
+
+
+def post(_):
+    """ Save a new public message. """
+    msg = Msg(subject=u'post', body=BODY)
+    msg.tags = set([u'public', u'tag0'])
+    msg.save(send_net=False)
+
+
+def reply(_):
+    """ Save a new reply to a message. """
+    msg = Msg(subject=u're: test', body=BODY)
+    msg.tags = set([u'public', u'tag1'])
+    msg.parent = random.randrange(MESSAGES)
+    msg.save(send_net=False)
+
+
+def retag(msg):
+    """ Save message ``msg`` of one tag changed. """
+    msg.tags = set([u'public', u'tag{0}'.format(random.randrange(TAGS))])
+    msg.save(send_net=False)
+
+
+def main():
+    """ Program entry point. """
+    x84.bbs.ini.CFG = x84.bbs.ini.init_bbs_ini()
+    x84.bbs.ini.CFG.set('system', 'datapath', tempfile.mkdtemp())
+    x84.bbs.ini.reload_snapshot()
+    store = MsgStore(get_db_filepath('msgbase'), 'store')
+    populate(store)
+    store.close()
+    engine = FakeEngine()
+    x84.bbs.session.SESSION = engine.make_session()
+    print('{0:>8} {1:>10} {2:>10} {3:>10}'.format(
+        'save', 'messages', 'saves/s', 'requests'))
+    for label, save in (('post', post), ('reply', reply), ('retag', retag)):
+        # messages of retag are read beforehand, as by a reader.
+        msgs = [get_msg(random.randrange(MESSAGES)) for _ in range(SAVES)]
+        requests, start = engine.requests, time.time()
+        for msg in msgs:
+            save(msg)
+        elapsed = time.time() - start
+        print('{0:>8} {1:>10} {2:>10.0f} {3:>10.1f}'.format(
+            label, MESSAGES, SAVES / elapsed,
+            float(engine.requests - requests) / SAVES))
+    engine.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+"""
+Benchmark of searching messages.
+
+A session searches msgbases of increasing number of messages, each of a
+subject and body of words of a vocabulary of words of decreasing frequency,
+by :func:`x84.bbs.msgbase.search_msgs`.  The "engine" is a thread of this
+process, see ``fake_session.py``.  Reported is the time of each kind of
+query, of rare or common words, phrases, and of a tag or author, and of
+reading every message by :func:`x84.bbs.msgbase.get_msg` as before.
+
+Usage::
+
+    python benchmarks/msg_search.py
+"""
+from __future__ import print_function
+import datetime
+import random
+import tempfile
+import time
+
+import x84.bbs.ini
+import x84.bbs.session
+from x84.bbs.msgbase import search_msgs, get_msg, list_msgs
+from x84.db import get_db_filepath
+from x84.msgstore import MsgStore
+
+from fake_session import FakeEngine
+
+#: number of messages of each msgbase
+MESSAGES = (5000, 20000, 80000)
+
+#: number of words of vocabulary, and of the body of each message
+VOCABULARY, WORDS = 5000, 60
+
+#: tags and authors of messages of msgbase
+TAGS, AUTHORS = 20, 50
+
+#: queries of each kind, as ``(label, query, tags, author)``, the most
+#: frequent word being ``word0``.
+QUERIES = (
+    ('rare', u'word4000', None, None),
+    ('common', u'word1', None, None),
+    ('and', u'word1 word30', None, None),
+    ('rare and', u'word1 word4000', None, None),
+    ('phrase', u'"word1 word2"', None, None),
+    ('tag', u'word30', [u'tag0'], None),
+    ('author', u'word30', None, u'user0'),
+)
+
+#: number of searches of each kind
+SEARCHES = 20
+
+
+def get_word(rand):
+    """ Return a word of vocabulary, of frequency about 1 / its rank. """
+    return u'word{0}'.format(
+        int(VOCABULARY ** rand.random()) - 1)
+
+
+def populate(store, start, stop, rand):
+    """ Store messages ``start`` to ``stop`` of words of vocabulary. """
+    now = datetime.datetime.now()
+    with store.transaction():
+        for idx in range(start, stop):
+            store.save_msg({
+                'idx': None, 'author': u'user{0}'.format(idx % AUTHORS),
+                'recipient': None, 'ctime': now, 'stime': now,
+                'subject': u' '.join(get_word(rand) for _ in range(4)),
+                'parent': None, 'extra': {},
+                'body': u'|07' + u' '.join(
+                    get_word(rand) for _ in range(WORDS)),
+                'tags': [u'public', u'tag{0}'.format(idx % TAGS)]})
+
+
+def scan(query):
+    """ Search by reading every message, as formerly required. """
+    return [idx for idx in sorted(list_msgs())
+            if query in get_msg(idx).body.split()]
+
+
+def main():
+    """ Program entry point. """
+    x84.bbs.ini.CFG = x84.bbs.ini.init_bbs_ini()
+    x84.bbs.ini.CFG.set('system', 'datapath', tempfile.mkdtemp())
+    x84.bbs.ini.reload_snapshot()
+    store = MsgStore(get_db_filepath('msgbase'), 'store')
+    rand = random.Random(0)
+    engine = FakeEngine()
+    x84.bbs.session.SESSION = engine.make_session()
+    print('{0:>8} {1:>8} {2:>8} {3:>10}'.format(
+        'messages', 'query', 'found', 'ms/search'))
+    populated = 0
+    for num_messages in MESSAGES:
+        populate(store, populated, num_messages, rand)
+        populated = num_messages
+        for label, query, tags, author in QUERIES:
+            start = time.time()
+            for _ in range(SEARCHES):
+                found = search_msgs(query, tags=tags, author=author)
+            elapsed = time.time() - start
+            print('{0:>8} {1:>8} {2:>8} {3:>10.2f}'.format(
+                num_messages, label, len(found),
+                elapsed * 1e3 / SEARCHES))
+        start = time.time()
+        found = scan(u'word4000')
+        print('{0:>8} {1:>8} {2:>8} {3:>10.2f}'.format(
+            num_messages, 'scan', len(found), (time.time() - start) * 1e3))
+    engine.close()
+    store.close()
+
+
+if __name__ == '__main__':
+    main()
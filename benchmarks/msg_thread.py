@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+"""
+Benchmark of reading threads of messages.
+
+A session reads the thread of a message of discussions of increasing number
+of replies, each a reply to a random message of its discussion, of a
+msgbase of many messages, by :func:`x84.bbs.msgbase.get_thread`, compared
+to reading each message of the thread by :func:`x84.bbs.msgbase.get_msg`
+by their ``children`` as before.  The "engine" is a thread of this process,
+see ``fake_session.py``.  Reported is the time of each thread.
+
+Usage::
+
+    python benchmarks/msg_thread.py
+"""
+from __future__ import print_function
+import datetime
+import random
+import tempfile
+import time
+
+import x84.bbs.ini
+import x84.bbs.session
+from x84.bbs.msgbase import get_msg, get_thread
+from x84.db import get_db_filepath
+from x84.msgstore import MsgStore
+
+from fake_session import FakeEngine
+
+#: number of messages of msgbase, of no replies
+MESSAGES = 50000
+
+#: number of messages of each discussion
+DISCUSSIONS = (10, 100, 1000)
+
+#: number of reads of each thread
+READS = 10
+
+#: a message body of typical size
+BODY = u'Lorem ipsum dolor sit amet, consectetur adipiscing elit. ' * 16
+
+
+def save(store, parent):
+    """ Store a message replying to ``parent``, returning its index. """
+    now = datetime.datetime.now()
+    return store.save_msg({
+        'idx': None, 'author': u'biscuit', 'recipient': None,
+        'ctime': now, 'stime': now, 'subject': u'test',
+        'parent': parent, 'body': BODY, 'extra': {},
+        'tags': [u'public']})
+
+
+def by_children(idx):
+    """ Read thread of root message ``idx`` by replies of each message. """
+    thread, pending = [], [idx]
+    while pending:
+        msg = get_msg(pending.pop())
+        thread.append(msg)
+        pending.extend(sorted(msg.children, reverse=True))
+    return thread
+
+
+def main():
+    """ Program entry point. """
+    x84.bbs.ini.CFG = x84.bbs.ini.init_bbs_ini()
+    x84.bbs.ini.CFG.set('system', 'datapath', tempfile.mkdtemp())
+    x84.bbs.ini.reload_snapshot()
+    store = MsgStore(get_db_filepath('msgbase'), 'store')
+    with store.transaction():
+        for _ in range(MESSAGES):
+            save(store, None)
+    roots = []
+    for num_messages in DISCUSSIONS:
+        with store.transaction():
+            discussion = [save(store, None)]
+            for _ in range(num_messages - 1):
+                discussion.append(save(store, random.choice(discussion)))
+        roots.append(discussion[0])
+    engine = FakeEngine()
+    x84.bbs.session.SESSION = engine.make_session()
+    print('{0:>8} {1:>8} {2:>10}'.format('thread', 'messages', 'ms/thread'))
+    for label, read in (('thread', get_thread), ('children', by_children)):
+        for num_messages, root in zip(DISCUSSIONS, roots):
+            start = time.time()
+            for _ in range(READS):
+                thread = read(root)
+            elapsed = time.time() - start
+            assert len(thread) == num_messages
+            print('{0:>8} {1:>8} {2:>10.2f}'.format(
+                label, num_messages, elapsed * 1e3 / READS))
+    engine.close()
+    store.close()
+
+
+if __name__ == '__main__':
+    main()
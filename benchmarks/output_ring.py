@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+"""
+Benchmark of bulk session output, by pipe and by shared memory ring.
+
+A forked "session" writes ANSI art through :class:`x84.bbs.ipc.IPCStream`
+as fast as it may, while this process drains it as the engine would, into
+the send buffer of a client that discards it.  Reported is the throughput,
+the number of IPC messages received by the "engine", the cpu time of the
+"engine" for each megabyte, which is shared by all sessions, and the peak
+size of the client's send buffer, held in memory by the "engine".
+
+This is measured for a fast client, whose socket accepts all data, and a
+slow client, whose socket accepts data at a limited rate.
+
+Usage::
+
+    python benchmarks/output_ring.py
+"""
+from __future__ import print_function
+from multiprocessing import Pipe
+import resource
+import array
+import select
+import time
+import os
+
+from x84.bbs.ipc import IPCStream
+from x84.framing import decode_event
+from x84.ringbuf import OutputRing
+
+#: total characters written by session, for fast and slow clients
+TOTAL_FAST = 32 * 1024 * 1024
+TOTAL_SLOW = 1024 * 1024
+
+#: bytes per second accepted by the socket of a slow client
+SLOW_RATE = 1024 * 1024
+
+#: a line of ANSI art, as written by showart()
+LINE = (u'\x1b[1;30m\u2591\u2592\u2593\x1b[0;37m\u2588\u2588\u2584\u2580 '
+        * 8 + u'\r\n')
+
+
+class NullClient(object):
+
+    """ A client whose socket accepts ``rate`` bytes per second, if any. """
+
+    def __init__(self, rate=None):
+        self.send_buffer = array.array('c')
+        self.rate = rate
+        self.sent = 0
+        self.peak = 0
+        self.last_send = time.time()
+
+    def send_encoded(self, bstr):
+        self.send_buffer.fromstring(bstr)
+        self.peak = max(self.peak, len(self.send_buffer))
+
+    def send(self):
+        now = time.time()
+        if self.rate is None:
+            length = len(self.send_buffer)
+        else:
+            length = int((now - self.last_send) * self.rate)
+        self.last_send = now
+        self.sent += min(length, len(self.send_buffer))
+        self.send_buffer = self.send_buffer[length:]
+
+
+def session(writer, ring, total):
+    """ Write ``total`` characters of output. """
+    stream = IPCStream(writer=writer, output_ring=ring)
+    written = 0
+    while written < total:
+        stream.write(LINE, 'utf8')
+        written += len(LINE)
+    stream.flush()
+    writer.send_bytes('')
+
+
+def engine(reader, ring, client):
+    """ Drain output until the session signals completion. """
+    messages, done = 0, False
+    while not done or client.send_buffer or (ring and ring.pending()):
+        select.select([reader.fileno()], [], [], 0.02)
+        while not done and reader.poll():
+            # recv_bytes, rather than x84.framing.recv_event, to receive
+            # the empty message signaling completion.
+            buf = reader.recv_bytes()
+            if not buf:
+                done = True
+                break
+            messages += 1
+            event, data = decode_event(buf)
+            if event == 'output':
+                client.send_encoded(data)
+        if ring is not None:
+            data = ring.read(ring.size - len(client.send_buffer))
+            if data:
+                client.send_encoded(data)
+        if client.send_buffer:
+            client.send()
+    return messages
+
+
+def run(ring_size, total, rate):
+    """ Return elapsed time, engine cpu time, messages and client. """
+    reader, writer = Pipe(duplex=False)
+    client = NullClient(rate)
+    ring = OutputRing(ring_size) if ring_size else None
+    start = time.time()
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    pid = os.fork()
+    if pid == 0:
+        reader.close()
+        session(writer, ring, total)
+        os._exit(0)
+    writer.close()
+    messages = engine(reader, ring, client)
+    os.waitpid(pid, 0)
+    elapsed = time.time() - start
+    end_usage = resource.getrusage(resource.RUSAGE_SELF)
+    cpu = ((end_usage.ru_utime + end_usage.ru_stime) -
+           (usage.ru_utime + usage.ru_stime))
+    return elapsed, cpu, messages, client
+
+
+def main():
+    """ Program entry point. """
+    for kind, total, rate in (('fast', TOTAL_FAST, None),
+                              ('slow', TOTAL_SLOW, SLOW_RATE)):
+        print('{0} client:'.format(kind))
+        print('{0:>10} {1:>10} {2:>10} {3:>14} {4:>14}'.format(
+            'ring', 'MB/s', 'messages', 'engine ms/MB', 'peak buf KB'))
+        for ring_size in (0, 16384, 65536, 262144):
+            elapsed, cpu, messages, client = run(ring_size, total, rate)
+            print('{0:>10} {1:>10.1f} {2:>10} {3:>14.2f} {4:>14}'.format(
+                ring_size or 'pipe', client.sent / elapsed / 1e6, messages,
+                cpu * 1e3 / (client.sent / 1e6), client.peak // 1024))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+"""
+Benchmark of connect-to-first-byte latency of new sessions.
+
+Measures the time from :func:`x84.terminal.spawn_client_session` until
+the first byte of output is received from the session, for sessions of
+newly started sub-processes, and those of idle, pre-forked workers.
+
+A minimal script folder is used, whose matrix script imports the same
+modules as the default matrix script and writes a greeting.  This process
+plays the part of the engine, granting the session's node lock.
+
+Usage::
+
+    python benchmarks/session_start.py
+"""
+from __future__ import print_function
+import logging
+import tempfile
+import time
+import os
+
+import x84.bbs.ini
+import x84.engine  # as imported by the engine before any session begins
+from x84.framing import recv_event, send_event
+from x84.terminal import TERMINALS, prefork_sessions, shutdown_workers
+from x84.terminal import spawn_client_session, unregister_tty, WORKERS
+
+#: number of sessions started by each method
+SESSIONS = 20
+
+MATRIX = '''
+from x84.bbs import getterminal, getsession, get_ini, goto, gosub
+from x84.bbs import echo, showart, syncterm_setfont, LineEditor
+from x84.bbs import find_user, get_user, User
+
+
+def main():
+    term = getterminal()
+    echo(term.normal + u'Connected.')
+'''
+
+
+class FakeClient(object):
+
+    """ A client of :mod:`x84.client` without a socket. """
+
+    kind = 'bench'
+
+    def __init__(self, num):
+        self.addrport = '127.0.0.1:{0}'.format(num)
+        self.env = {'TERM': 'xterm-256color', 'LINES': '24',
+                    'COLUMNS': '80', 'encoding': 'utf8'}
+        self.active = True
+
+    def poll_fileno(self):
+        return None
+
+    def deactivate(self):
+        self.active = False
+
+
+def make_config():
+    """ Return default configuration, with a minimal script folder. """
+    cfg = x84.bbs.ini.init_bbs_ini()
+    script_path = tempfile.mkdtemp()
+    with open(os.path.join(script_path, '__init__.py'), 'w'):
+        pass
+    with open(os.path.join(script_path, 'matrix.py'), 'w') as fout:
+        fout.write(MATRIX)
+    cfg.set('system', 'scriptpath', script_path)
+    cfg.set('system', 'datapath', tempfile.mkdtemp())
+    cfg.set('matrix', 'script_bench', 'matrix')
+    return cfg
+
+
+def first_byte(tty):
+    """ Serve session as the engine would, until its first output. """
+    while True:
+        event, data = recv_event(tty.master_read)
+        if event.startswith('lock-'):
+            send_event(tty.master_write, event, True)
+        elif event in ('output', 'doorbell'):
+            return time.time()
+
+
+def start_session(num):
+    """ Return connect-to-first-byte latency of a new session. """
+    client = FakeClient(num)
+    start = time.time()
+    spawn_client_session(client)
+    tty = next(tty for _, tty in TERMINALS.items() if tty.client is client)
+    latency = first_byte(tty) - start
+    while recv_event(tty.master_read)[0] != 'exit':
+        pass
+    unregister_tty(tty)
+    return latency
+
+
+def report(label, latencies):
+    """ Display latency statistics. """
+    latencies = sorted(latencies)
+    print('{0:>10} {1:>10.1f} {2:>10.1f} {3:>10.1f}'.format(
+        label, latencies[0] * 1e3,
+        latencies[len(latencies) // 2] * 1e3, latencies[-1] * 1e3))
+
+
+def main():
+    """ Program entry point. """
+    x84.bbs.ini.CFG = make_config()
+    logging.getLogger().setLevel(logging.ERROR)
+    print('{0:>10} {1:>10} {2:>10} {3:>10}'.format(
+        'session', 'min (ms)', 'med (ms)', 'max (ms)'))
+
+    x84.bbs.ini.CFG.set('session', 'prefork', '0')
+    report('new', [start_session(num) for num in range(SESSIONS)])
+
+    x84.bbs.ini.CFG.set('session', 'prefork', '1')
+    latencies = []
+    for num in range(SESSIONS):
+        prefork_sessions()
+        # allow the worker to become idle, as it would between connections.
+        while not WORKERS[0].process.is_alive():
+            time.sleep(0.01)
+        time.sleep(0.5)
+        latencies.append(start_session(num))
+    report('prefork', latencies)
+    shutdown_workers()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+"""
+Micro-benchmark of engine loop overhead by number of connected sessions.
+
+Compares the cost of a single pass of the engine loop, where a constant
+number of clients and sessions are ready, against the previous method of
+scanning every terminal (and every terminal again for each client by
+``find_tty``) on each pass.
+
+Usage::
+
+    python benchmarks/terminals.py
+"""
+from __future__ import print_function
+import ConfigParser
+import logging
+import timeit
+
+import x84.bbs.ini
+from x84 import engine
+from x84.framing import encode_event
+from x84.terminal import TERMINALS, TerminalProcess
+
+#: number of clients and sessions ready on each pass of the loop
+READY = 4
+
+
+class FakePipe(object):
+
+    """ A ``multiprocessing.Connection`` with a pending 'output' event. """
+
+    def __init__(self, fd):
+        self.fd = fd
+        self.pending = 0
+
+    def fileno(self):
+        return self.fd
+
+    def poll(self):
+        return self.pending > 0
+
+    def recv_bytes(self):
+        self.pending -= 1
+        return encode_event('output', (u'x', 'utf8'))
+
+    def send_bytes(self, data):
+        pass
+
+
+class FakeClient(object):
+
+    """ A client of :mod:`x84.client` without a socket. """
+
+    kind = 'bench'
+    addrport = '127.0.0.1:0'
+
+    def __init__(self, fd):
+        self.fd = fd
+        self.recv, self.sent = 0, 0
+
+    def poll_fileno(self):
+        return self.fd
+
+    def fileno(self):
+        return self.fd
+
+    def is_active(self):
+        return True
+
+    def socket_recv(self):
+        self.recv += 1
+
+    def input_ready(self):
+        return self.recv > 0
+
+    def get_input(self):
+        self.recv = 0
+        return 'x'
+
+    def send_encoded(self, bstr):
+        self.sent += 1
+
+    def send_ready(self):
+        return self.sent > 0
+
+    def send(self):
+        self.sent = 0
+
+    def idle(self):
+        return 0
+
+
+class FakeServer(object):
+
+    """ A server of :mod:`x84.server` without a socket. """
+
+    def __init__(self):
+        self.clients = {}
+
+    def clients_ready(self, ready_fds):
+        return [client for client in self.clients.values()
+                if client.fileno() in ready_fds]
+
+
+def legacy_tick(server, ready_fds, locks, log):
+    """ One pass of the engine loop, as it was with a flat dictionary. """
+    def find_tty(client):
+        return next((tty for _, tty in TERMINALS.items()
+                     if client == tty.client), None)
+    for client in server.clients_ready(ready_fds):
+        client.socket_recv()
+    session_fds = [find_tty(client).master_read.fileno()
+                   for client in server.clients.values()]
+    terms = TERMINALS.items()
+    if set(session_fds) & set(ready_fds):
+        engine.session_recv(locks, terms, log, False)
+    for _, tty in terms:
+        if tty.client.send_ready():
+            tty.client.send()
+    for _, tty in terms:
+        if tty.client.input_ready():
+            tty.master_write.send_bytes(
+                encode_event('input', tty.client.get_input()))
+
+
+def tick(servers, ready_fds, locks, log):
+    """ One pass of the engine loop using the terminal registry. """
+    received = engine.client_recv(servers, ready_fds, log)
+    recv_terms = [(tty.sid, tty) for tty in map(engine.find_tty, received)]
+    ready_terms = [(tty.sid, tty) for tty in
+                   map(TERMINALS.by_master_fd, ready_fds)
+                   if tty is not None]
+    engine.session_recv(locks, ready_terms, log, False)
+    engine.client_send(set(ready_terms) | set(recv_terms), log)
+    engine.session_send(recv_terms)
+
+
+def make_terminals(server, count):
+    """ Register ``count`` terminals of fake clients and pipes. """
+    for tty in [tty for _, tty in TERMINALS.items()]:
+        TERMINALS.remove(tty)
+    server.clients.clear()
+    for num in range(count):
+        client = FakeClient(fd=10000 + num)
+        server.clients[client.fd] = client
+        TERMINALS.add(TerminalProcess(
+            client=client, sid='bench-{0}'.format(num),
+            master_pipes=(FakePipe(20000 + num), FakePipe(20000 + num))))
+
+
+def main():
+    """ Program entry point. """
+    x84.bbs.ini.CFG = ConfigParser.SafeConfigParser()
+    x84.bbs.ini.CFG.add_section('system')
+    x84.bbs.ini.CFG.set('system', 'timeout', '0')
+    log = logging.getLogger('bench')
+    server = FakeServer()
+    print('{0:>8} {1:>14} {2:>14}'.format(
+        'sessions', 'legacy (usec)', 'indexed (usec)'))
+    for count in (10, 100, 1000):
+        make_terminals(server, count)
+        ready_fds = ([10000 + num for num in range(READY)] +
+                     [20000 + num for num in range(READY)])
+
+        def prime():
+            for num in range(READY):
+                TERMINALS.by_sid('bench-{0}'.format(num)
+                                 ).master_read.pending = 1
+
+        number = max(10, 10000 // count)
+        legacy = min(timeit.repeat(
+            lambda: (prime(), legacy_tick(server, ready_fds, {}, log)),
+            number=number, repeat=3)) / number
+        indexed = min(timeit.repeat(
+            lambda: (prime(), tick([server], ready_fds, {}, log)),
+            number=number, repeat=3)) / number
+        print('{0:>8} {1:>14.1f} {2:>14.1f}'.format(
+            count, legacy * 1e6, indexed * 1e6))
+
+
+if __name__ == '__main__':
+    main()
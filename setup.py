@@ -105,7 +105,6 @@ setup(name='x84',
           'blessed==1.9.5',
           'requests==2.5.1',
           'irc==11.0.1',
-          'sqlitedict==1.1.0',
           'python-dateutil==2.3',
           'jaraco.timing==1.1',
           'jaraco.util==10.6',
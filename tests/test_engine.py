@@ -0,0 +1,94 @@
+""" Tests of events of sessions handled by :mod:`x84.engine`. """
+# std imports
+import logging
+import multiprocessing
+import unittest
+
+# local
+from x84 import engine
+from x84.framing import decode_event, send_event
+from x84.terminal import TERMINALS
+import x84.bbs.ini
+
+
+class FakePipe(object):
+
+    """ A ``multiprocessing.Connection`` recording frames sent to it. """
+
+    def __init__(self):
+        self.frames = []
+
+    def send_bytes(self, buf):
+        self.frames.append(buf)
+
+
+class FakeClient(object):
+
+    """ A client of :mod:`x84.client` without a socket. """
+
+    @staticmethod
+    def poll_fileno():
+        return None
+
+
+class FakeTTY(object):
+
+    """ A :class:`x84.terminal.TerminalProcess` of a pipe of a session. """
+
+    def __init__(self, sid):
+        self.sid = sid
+        self.client = FakeClient()
+        self.master_read, self.session_write = multiprocessing.Pipe(
+            duplex=False)
+        self.master_write = FakePipe()
+
+
+class TestGlobalReload(unittest.TestCase):
+
+    """ The sysop's ``('reload', sid)`` global event. """
+
+    def setUp(self):
+        self.calls = []
+        self._reload_ini = x84.bbs.ini.reload_ini
+        self._shutdown_workers = engine.shutdown_workers
+        x84.bbs.ini.reload_ini = lambda: self.calls.append('reload_ini')
+        engine.shutdown_workers = (
+            lambda: self.calls.append('shutdown_workers'))
+        self.sysop, self.other = FakeTTY('sysop'), FakeTTY('other')
+        TERMINALS.add(self.sysop)
+        TERMINALS.add(self.other)
+
+    def tearDown(self):
+        x84.bbs.ini.reload_ini = self._reload_ini
+        engine.shutdown_workers = self._shutdown_workers
+        for tty in (self.sysop, self.other):
+            TERMINALS.remove(tty)
+            tty.master_read.close()
+            tty.session_write.close()
+
+    def receive(self, data):
+        """ Send global event of ``data`` by sysop session to engine. """
+        send_event(self.sysop.session_write, 'global', data)
+        engine.session_recv(locks={}, terminals=[('sysop', self.sysop)],
+                            log=logging.getLogger(__name__),
+                            tap_events=False)
+
+    def test_reload(self):
+        """ Configuration is read again, and idle workers replaced. """
+        self.receive(('reload', 'sysop'))
+        self.assertEqual(self.calls, ['reload_ini', 'shutdown_workers'])
+        # and forwarded to other sessions.
+        self.assertEqual(self.sysop.master_write.frames, [])
+        self.assertEqual(
+            [decode_event(buf) for buf in self.other.master_write.frames],
+            [('global', ('reload', 'sysop'))])
+
+    def test_other(self):
+        """ Other global events are only forwarded. """
+        self.receive(('AYT', 'sysop'))
+        self.assertEqual(self.calls, [])
+        self.assertEqual(len(self.other.master_write.frames), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -13,7 +13,11 @@ from x84.bbs.exception import Disconnected, Goto
 from x84.bbs.ini import get_ini
 from x84.bbs.lightbar import Lightbar
 from x84.bbs.modem import send_modem, recv_modem
-from x84.bbs.msgbase import list_msgs, get_msg, list_tags, Msg, list_privmsgs
+from x84.bbs.msgbase import (list_msgs, get_msg, list_tags, Msg, list_privmsgs,
+                             mark_read, list_unread, count_unread,
+                             count_msgs, get_tag_counts, search_msgs,
+                             rebuild_search_index, MsgHeader, get_msg_header,
+                             list_msg_headers, get_thread)
 from x84.bbs.output import (echo, timeago, encode_pipe, decode_pipe,
                             syncterm_setfont, showart, ropen,
                             from_cp437,  # deprecated in v2.0
@@ -25,17 +29,22 @@ from x84.bbs.session import (getsession, getterminal,
                              goto, disconnect, gosub,
                              getch,      # deprecated in v2.1
                              )
-from x84.bbs.userbase import list_users, get_user, find_user, User, Group
+from x84.bbs.userbase import (list_users, get_user, find_user,
+                              find_users_by_email, User, Group)
 
 # the scripting API is generally defined by this __all__ attribute, but
 # the real purpose of __all__ is defining what gets placed into a caller's
 # namespace when using statement `from x84.bbs import *`
-__all__ = ('list_users', 'get_user', 'find_user', 'User', 'Group', 'list_msgs',
+__all__ = ('list_users', 'get_user', 'find_user', 'find_users_by_email',
+           'User', 'Group', 'list_msgs',
            'get_msg', 'list_tags', 'Msg', 'LineEditor', 'ScrollingEditor',
            'echo', 'timeago', 'AnsiWindow', 'Selector', 'Disconnected', 'Goto',
            'Lightbar', 'from_cp437', 'DBProxy', 'Pager', 'Door', 'DOSDoor',
            'goto', 'disconnect', 'getsession', 'getterminal', 'getch', 'gosub',
            'ropen', 'showart', 'Dropfile', 'encode_pipe',
            'decode_pipe', 'syncterm_setfont', 'get_ini', 'send_modem',
-           'recv_modem', 'Script', 'list_privmsgs',
+           'recv_modem', 'Script', 'list_privmsgs', 'mark_read',
+           'list_unread', 'count_unread', 'count_msgs', 'get_tag_counts',
+           'search_msgs', 'rebuild_search_index', 'MsgHeader',
+           'get_msg_header', 'list_msg_headers', 'get_thread',
            )
@@ -1,27 +1,110 @@
 """ Database proxy helper for x/84. """
 # std imports
+import cPickle as pickle
+import collections
 import logging
+import sqlite3
 
 # local
-from x84.bbs.ini import get_ini
+from x84.bbs.ini import get_snapshot
+from x84.framing import dumps
 from x84.db import (
-    get_db_filepath,
-    get_database,
+    DBDirectHandler,
     get_db_func,
     get_db_lock,
+    get_db_pool,
     log_db_cmd,
+    written_keys,
 )
 
 
+class DBCache(object):
+
+    """
+    Size-bounded, least-recently-used cache of values of a database schema.
+
+    Held by a session for each schema of ini option ``db_cache`` of section
+    ``[session]``, see :meth:`x84.bbs.session.Session.get_db_cache`.  Values
+    written by any session are discarded by the ``cache-invalidate`` event
+    sent by the engine, see :func:`x84.db.broadcast_invalidate`.
+
+    Values are held pickled, so that a value modified by its caller does
+    not modify the cache.
+    """
+
+    def __init__(self, schema, size):
+        """
+        Class initializer.
+
+        :param str schema: database schema.
+        :param int size: maximum number of values held.
+        """
+        self.schema = schema
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        # pickled value (or None if not found) by (table, key)
+        self._values = collections.OrderedDict()
+
+    @staticmethod
+    def _key(table, key):
+        """ Return key of cache for given ``table`` and database ``key``. """
+        if isinstance(key, unicode):
+            key = key.encode('utf8')
+        return table, key
+
+    def lookup(self, table, key):
+        """
+        Return cached value of ``key`` of ``table``.
+
+        :returns: pickled value, or ``None`` if the key was not found.
+        :raises KeyError: key is not cached.
+        """
+        cache_key = self._key(table, key)
+        try:
+            value = self._values.pop(cache_key)
+        except KeyError:
+            self.misses += 1
+            raise
+        self.hits += 1
+        self._values[cache_key] = value
+        return value
+
+    def store(self, table, key, value):
+        """ Cache pickled ``value``, or ``None`` if not found, of ``key``. """
+        self._values[self._key(table, key)] = value
+        while len(self._values) > self.size:
+            self._values.popitem(last=False)
+
+    def invalidate(self, table, keys):
+        """ Discard ``keys`` of ``table``, all keys if any are ``None``. """
+        if None in keys:
+            for cache_key in [_key for _key in self._values
+                              if _key[0] == table]:
+                del self._values[cache_key]
+        else:
+            for key in keys:
+                self._values.pop(self._key(table, key), None)
+
+    def __repr__(self):
+        return ('DBCache({self.schema!r}, hits={self.hits}, '
+                'misses={self.misses}, size={0}/{self.size})'
+                .format(len(self._values), self=self))
+
+
 class DBProxy(object):
 
     """
     Provide dictionary-like object interface to shared database.
 
     A database call, such as __len__() or keys() is issued as a command
-    to the main engine when ``use_session`` is True, which spawns a thread
-    to acquire a lock on the database and return the results via IPC pipe
-    transfer.
+    to the main engine when ``use_session`` is True, which is served by a
+    database worker thread, returning the results via IPC pipe transfer.
+
+    Calls that only read, however, are served by the session's own
+    read-only connection when available, see
+    :meth:`x84.bbs.session.Session.get_db_reader`, so that reads of many
+    sessions do not wait upon the engine, nor upon each other.
     """
 
     def __init__(self, schema, table='unnamed', use_session=True):
@@ -39,43 +122,70 @@ class DBProxy(object):
         self.log = logging.getLogger(__name__)
         self.schema = schema
         self.table = table
-        self._tap_db = get_ini('session', 'tab_db', getter='getboolean')
+        snapshot = get_snapshot()
+        self._tap_db = snapshot.tap_db
+        self._chunk = (snapshot.db_chunk_items, snapshot.db_chunk_bytes)
 
         from x84.bbs.session import getsession
         self._session = use_session and getsession()
+        self._cache = self._session and self._session.get_db_cache(schema)
+        self._reader = self._session and self._session.get_db_reader(schema)
 
-    def proxy_iter_session(self, method, *args):
-        """ Proxy for iterable-return method calls over session IPC pipe. """
+    def proxy_iter_session(self, method):
+        """
+        Proxy for iterable-return method calls over session IPC pipe.
+
+        Items are requested in chunks, one chunk at a time, as the iterable
+        is consumed, see :meth:`x84.db.Table.iter_chunk`.
+        """
         event = 'db={0}'.format(self.schema)
-        self._session.flush_event(event)
-        self._session.send_event(event, (self.table, method, args))
-        data = self._session.read_event(event)
-        assert data == (None, 'StartIteration'), (
-            'iterable proxy used on non-iterable, {0!r}'.format(data))
-        data = self._session.read_event(event)
-        while data != (None, StopIteration):
-            yield data
-            data = self._session.read_event(event)
-        self._session.flush_event(event)
+        decode = {'iterkeys': lambda key: key,
+                  'itervalues': pickle.loads,
+                  'iteritems': lambda row: (row[0], pickle.loads(row[1])),
+                  }[method]
+        position = None
+        while True:
+            rows, position = self.read_chunk(method, position)
+            for row in rows:
+                yield decode(row)
+            if position is None:
+                break
+
+    def read_chunk(self, method, position):
+        """
+        Return next chunk of rows of iterable ``method``, from ``position``.
+
+        Read directly when possible, otherwise by request of the engine.
+        """
+        if self._reader:
+            try:
+                return self._reader.table(self.table).iter_chunk(
+                    method, position, *self._chunk)
+            except sqlite3.OperationalError:
+                # such as a table not yet created by the engine.
+                pass
+        event = 'db={0}'.format(self.schema)
+        self._session.send_event(event, (self.table, method, (position,)))
+        return self._session.read_event(event)
 
     def proxy_method_direct(self, method, *args):
-        """ Proxy for direct dictionary method calls. """
-        dictdb = get_database(filepath=get_db_filepath(self.schema),
-                              table=self.table)
-        try:
-            func = get_db_func(dictdb, method)
-            if self._tap_db:
-                log_db_cmd(self.log, self.schema, method, args)
-            return func(*args)
-        finally:
-            dictdb.close()
-
-    def proxy_iter(self, method, *args):
+        """
+        Proxy for direct dictionary method calls, of the engine process.
+
+        Served by the database worker pool, of its connections that remain
+        open, see :class:`x84.db.DBDirectHandler`.
+        """
+        handler = DBDirectHandler(self.schema, self.table, method, args)
+        get_db_pool().submit(handler)
+        return handler.wait()
+
+    def proxy_iter(self, method):
         """ Proxy for iterable dictionary method calls. """
         if self._session:
-            return self.proxy_iter_session(method, *args)
+            return self.proxy_iter_session(method)
 
-        return self.proxy_method_direct(method, *args)
+        # a list of all items, rather than an iterable of the worker pool.
+        return iter(self.proxy_method_direct(method[len('iter'):]))
 
     def proxy_method(self, method, *args):
         """ Proxy for dictionary method calls. """
@@ -84,27 +194,151 @@ class DBProxy(object):
 
         return self.proxy_method_direct(method, *args)
 
+    def proxy_read(self, method, *args):
+        """ Proxy for dictionary method calls that do not write. """
+        if self._reader:
+            try:
+                result = get_db_func(self._reader.table(self.table),
+                                     method)(*args)
+            except sqlite3.OperationalError:
+                # such as a table not yet created by the engine.
+                pass
+            else:
+                if self._tap_db:
+                    log_db_cmd(self.log, self.schema, method, args)
+                return result
+        return self.proxy_method(method, *args)
+
     def proxy_method_session(self, method, *args):
         """ Proxy for dictionary method calls over IPC pipe. """
+        if self._cache:
+            keys = written_keys(method, args)
+            if keys is not None:
+                self._cache.invalidate(self.table, keys)
         event = 'db-{0}'.format(self.schema)
         self._session.send_event(event, (self.table, method, args))
         return self._session.read_event(event)
 
+    def proxy_cached(self, key):
+        """
+        Return pickled value of ``key``, or ``None`` if not found.
+
+        Read through the :class:`DBCache` of this schema.
+        """
+        # receive any invalidation of this cache waiting to be read.
+        self._session.handle_events()
+        try:
+            return self._cache.lookup(self.table, key)
+        except KeyError:
+            found, value = self.batch([('__contains__', (key,)),
+                                       ('get', (key,))])
+            value = dumps(value) if found else None
+            self._cache.store(self.table, key, value)
+            return value
+
+    def batch(self, operations):
+        """
+        Call each method of ``operations`` in one round-trip and transaction.
+
+        :param list operations: sequence of ``(method, args)``, such as
+                                ``[('get', ('a', None)), ('keys', ())]``.
+                                Iterable methods may not be batched.
+        :returns: list of return values of each method.
+        :raises Exception: any exception of a method, when none of
+                           ``operations`` are committed.
+        """
+        operations = list(operations)
+        if written_keys('batch', (operations,)) is None:
+            return self.proxy_read('batch', operations)
+        return self.proxy_method('batch', operations)
+
+    def get_many(self, keys, default=None):
+        """
+        Return list of values of each of ``keys``, in one round-trip.
+
+        ``default`` is returned for any keys not found.
+        """
+        return self.batch([('get', (key, default)) for key in keys])
+
+    def set_many(self, items):
+        """
+        Set values of dictionary ``items`` in one round-trip and transaction.
+
+        ``items`` may also be a sequence of ``(key, value)`` pairs.
+        """
+        if hasattr(items, 'items'):
+            items = items.items()
+        operations = [('__setitem__', (key, value)) for key, value in items]
+        if operations:
+            self.batch(operations)
+
+    def update_key(self, key, subkey, value):
+        """
+        Atomically set ``subkey`` of dictionary value of ``key``.
+
+        Only ``value`` is sent, see :meth:`x84.db.Table.update_key`.
+        """
+        return self.proxy_method('update_key', key, subkey, value)
+
+    def set_add(self, key, members, subkey=None):
+        """
+        Atomically add ``members`` to set value of ``key``.
+
+        :returns: number of members added.
+        """
+        return self.proxy_method('set_add', key, members, subkey)
+
+    def set_discard(self, key, members, subkey=None):
+        """
+        Atomically discard ``members`` from set value of ``key``.
+
+        :returns: number of members discarded.
+        """
+        return self.proxy_method('set_discard', key, members, subkey)
+
+    def incr(self, key, amount=1, subkey=None):
+        """ Atomically add ``amount`` to value of ``key``, returning it. """
+        return self.proxy_method('incr', key, amount, subkey)
+
+    def compare_and_swap(self, key, expected, value):
+        """
+        Atomically set ``key`` to ``value`` if it is equal to ``expected``.
+
+        :returns: whether the value was set.
+        """
+        return self.proxy_method('compare_and_swap', key, expected, value)
+
     def acquire(self):
-        """ Acquire system-wide lock on database. """
-        lock = get_db_lock(schema=self.schema, table=self.table)
+        """
+        Acquire system-wide lock on database.
+
+        For sessions, this is a lock of the engine, shared by all sessions,
+        see :func:`x84.engine.handle_lock`; otherwise, it is a lock of this
+        process.  The atomic methods of this class require no lock.
+        """
         if self._tap_db:
             self.log.debug('lock acquire schema=%s, table=%s',
                            self.schema, self.table)
-        lock.acquire()
+        if not self._session:
+            get_db_lock(schema=self.schema, table=self.table).acquire()
+            return
+        # replied once acquired, when held by another session, as soon as
+        # it is released.
+        event = 'lock-db/{0}/{1}'.format(self.schema, self.table)
+        self._session.send_event(event, ('wait', None))
+        self._session.read_event(event)
 
     def release(self):
         """ Release system-wide lock on database. """
-        lock = get_db_lock(schema=self.schema, table=self.table)
         if self._tap_db:
             self.log.debug('lock release schema=%s, table=%s',
                            self.schema, self.table)
-        lock.release()
+        if not self._session:
+            get_db_lock(schema=self.schema, table=self.table).release()
+            return
+        self._session.send_event(
+            'lock-db/{0}/{1}'.format(self.schema, self.table),
+            ('release', None))
 
     def __enter__(self):
         self.acquire()
@@ -116,11 +350,18 @@ class DBProxy(object):
     # pylint: disable=C0111
     #        Missing docstring
     def __contains__(self, key):
-        return self.proxy_method('__contains__', key)
+        if self._cache:
+            return self.proxy_cached(key) is not None
+        return self.proxy_read('__contains__', key)
     __contains__.__doc__ = dict.__contains__.__doc__
 
     def __getitem__(self, key):
-        return self.proxy_method('__getitem__', key)
+        if self._cache:
+            value = self.proxy_cached(key)
+            if value is None:
+                raise KeyError(key)
+            return value.loads()
+        return self.proxy_read('__getitem__', key)
     __getitem__.__doc__ = dict.__getitem__.__doc__
 
     def __setitem__(self, key, value):
@@ -132,11 +373,14 @@ class DBProxy(object):
     __delitem__.__doc__ = dict.__delitem__.__doc__
 
     def get(self, key, default=None):
-        return self.proxy_method('get', key, default)
+        if self._cache:
+            value = self.proxy_cached(key)
+            return default if value is None else value.loads()
+        return self.proxy_read('get', key, default)
     get.__doc__ = dict.get.__doc__
 
     def has_key(self, key):
-        return self.proxy_method('has_key', key)
+        return self.proxy_read('has_key', key)
     has_key.__doc__ = dict.has_key.__doc__
 
     def setdefault(self, key, value):
@@ -148,15 +392,15 @@ class DBProxy(object):
     update.__doc__ = dict.update.__doc__
 
     def __len__(self):
-        return self.proxy_method('__len__')
+        return self.proxy_read('__len__')
     __len__.__doc__ = dict.__len__.__doc__
 
     def values(self):
-        return self.proxy_method('values')
+        return self.proxy_read('values')
     values.__doc__ = dict.values.__doc__
 
     def items(self):
-        return self.proxy_method('items')
+        return self.proxy_read('items')
     items.__doc__ = dict.items.__doc__
 
     def iteritems(self):
@@ -172,7 +416,7 @@ class DBProxy(object):
     itervalues.__doc__ = dict.itervalues.__doc__
 
     def keys(self):
-        return self.proxy_method('keys')
+        return self.proxy_read('keys')
     keys.__doc__ = dict.keys.__doc__
 
     def pop(self):
@@ -186,5 +430,5 @@ class DBProxy(object):
     def copy(self):
         # https://github.com/piskvorky/sqlitedict/issues/20
         # @jquast: should sqlitedict have a .copy() method? "no."
-        return dict(self.proxy_method('items'))
+        return dict(self.proxy_read('items'))
     copy.__doc__ = dict.copy.__doc__
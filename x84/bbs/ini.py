@@ -3,6 +3,7 @@
 from __future__ import print_function
 import logging.config
 import ConfigParser
+import collections
 import warnings
 import inspect
 import getpass
@@ -12,6 +13,12 @@ import os
 #: Singleton representing configuration after load
 CFG = None
 
+#: Singleton ``(CFG, ConfigSnapshot)``, see :func:`get_snapshot`
+SNAPSHOT = None
+
+#: Path of bbs .ini file of ``CFG``, read again by :func:`reload_ini`
+FILEPATH = None
+
 # pylint: disable=R0915,R0912,W0603
 #         Too many statements
 #         Too many branches
@@ -90,8 +97,9 @@ def init(lookup_bbs, lookup_log):
         except IOError as err:
             log.error(err)
 
-    global CFG
+    global CFG, FILEPATH
     CFG = cfg_bbs
+    FILEPATH = cfg_bbsfile
 
 
 def init_bbs_ini():
@@ -219,6 +227,46 @@ def init_bbs_ini():
     cfg_bbs.set('session', 'tap_events', 'no')
     cfg_bbs.set('session', 'tap_db', 'no')
     cfg_bbs.set('session', 'default_encoding', 'utf8')
+    # size of shared memory ring of session output, 0 sends by pipe.
+    cfg_bbs.set('session', 'output_ring', '65536')
+    # number of idle, pre-forked session sub-processes for each terminal
+    # type of prefork_terminals, 0 disables.
+    cfg_bbs.set('session', 'prefork', '1')
+    cfg_bbs.set('session', 'prefork_terminals', 'ansi, xterm-256color')
+    # seconds between tests for modification of cached script modules,
+    # 0 tests each time a script is called, -1 only when reloaded by sysop.
+    cfg_bbs.set('session', 'script_check_interval', '5')
+    # number of engine threads serving database requests of sessions.
+    cfg_bbs.set('session', 'db_workers', '4')
+    # read-mostly database schemas cached by each session, and the number
+    # of values cached for each schema.
+    cfg_bbs.set('session', 'db_cache',
+                'userbase, groupbase, tags, lastcalls, oneliner')
+    cfg_bbs.set('session', 'db_cache_size', '1024')
+    # maximum number of items and bytes of each chunk of database iterables
+    # (such as iteritems) sent to sessions.
+    cfg_bbs.set('session', 'db_chunk_items', '512')
+    cfg_bbs.set('session', 'db_chunk_bytes', '65536')
+    # sqlite journal mode, synchronous level and page cache (in KiB) of
+    # databases, each may be set for a single schema by suffix, such as
+    # db_synchronous_msgbase = full.
+    cfg_bbs.set('session', 'db_journal_mode', 'wal')
+    cfg_bbs.set('session', 'db_synchronous', 'normal')
+    cfg_bbs.set('session', 'db_page_cache', '2048')
+    # greatest seconds that database writes of concurrent sessions are
+    # grouped into a single transaction, 0 commits each write alone.
+    cfg_bbs.set('session', 'db_commit_delay', '0.005')
+    # seconds between checkpoints of each database's write-ahead log.
+    cfg_bbs.set('session', 'db_checkpoint_interval', '30')
+    # whether sessions read databases of a write-ahead log directly, rather
+    # than by request of the engine; writes are always made by the engine.
+    cfg_bbs.set('session', 'db_direct_read', 'yes')
+    # storage backend of databases: sqlite, or memory for small schemas of
+    # frequent writes, held by the engine and journaled to disk, such as
+    # db_backend_lastcalls = memory.  The journal of a memory database is
+    # compacted into a snapshot once greater than db_compact_bytes.
+    cfg_bbs.set('session', 'db_backend', 'sqlite')
+    cfg_bbs.set('session', 'db_compact_bytes', '1048576')
 
     cfg_bbs.add_section('irc')
     cfg_bbs.set('irc', 'server', 'efnet.portlane.se')
@@ -375,3 +423,80 @@ def get_ini(section=None, key=None, getter='get', split=False, splitsep=','):
     if split:
         return []
     return u''
+
+
+#: Immutable record of configuration values read on frequently called paths,
+#: typed and with defaults applied.  Created by :func:`get_snapshot`.
+ConfigSnapshot = collections.namedtuple('ConfigSnapshot', (
+    'tap_input', 'tap_output', 'tap_events', 'tap_db',
+    'show_traceback', 'script_check_interval', 'datapath',
+    'db_cache', 'db_cache_size', 'db_chunk_items', 'db_chunk_bytes'))
+
+
+def _make_snapshot(cfg):
+    """ Return :class:`ConfigSnapshot` of configuration ``cfg``. """
+    def value(section, key, getter='get', default=None):
+        """ Return typed value of option, or ``default`` if not set. """
+        if cfg is None or not cfg.has_option(section, key):
+            return default
+        return getattr(cfg, getter)(section, key)
+
+    return ConfigSnapshot(
+        tap_input=value('session', 'tap_input', 'getboolean', False),
+        tap_output=value('session', 'tap_output', 'getboolean', False),
+        tap_events=value('session', 'tap_events', 'getboolean', False),
+        # this option has long been misspelled as 'tab_db' by its readers.
+        tap_db=(value('session', 'tap_db', 'getboolean', False) or
+                value('session', 'tab_db', 'getboolean', False)),
+        show_traceback=value('system', 'show_traceback', 'getboolean', False),
+        script_check_interval=value(
+            'session', 'script_check_interval', 'getfloat', 5.0),
+        datapath=value('system', 'datapath', default=u''),
+        db_cache=frozenset(
+            schema.strip() for schema in
+            value('session', 'db_cache', default='').split(',')
+            if schema.strip()),
+        db_cache_size=value('session', 'db_cache_size', 'getint', 1024),
+        db_chunk_items=max(1, value('session', 'db_chunk_items',
+                                    'getint', 512)),
+        db_chunk_bytes=value('session', 'db_chunk_bytes', 'getint', 65536))
+
+
+def get_snapshot():
+    """
+    Return :class:`ConfigSnapshot` of configuration.
+
+    Unlike :func:`get_ini`, values are read from the configuration only
+    once per process, or again after :func:`reload_snapshot`, or when the
+    configuration itself is replaced (as by a session sub-process).
+    """
+    global SNAPSHOT
+    if SNAPSHOT is None or SNAPSHOT[0] is not CFG:
+        SNAPSHOT = (CFG, _make_snapshot(CFG))
+    return SNAPSHOT[1]
+
+
+def reload_snapshot():
+    """ Discard :class:`ConfigSnapshot`, such as after changing ``CFG``. """
+    global SNAPSHOT
+    SNAPSHOT = None
+
+
+def reload_ini():
+    """
+    Read bbs .ini file of ``CFG`` again, and discard its snapshot.
+
+    ``CFG`` is replaced only when the file is read without error, otherwise
+    the configuration already loaded remains.
+    """
+    global CFG
+    log = logging.getLogger(__name__)
+    if FILEPATH is not None:
+        cfg_bbs = ConfigParser.SafeConfigParser()
+        try:
+            if cfg_bbs.read(FILEPATH):
+                CFG = cfg_bbs
+                log.info('reloaded %s', FILEPATH)
+        except ConfigParser.Error as err:
+            log.error('{0}: {1}'.format(FILEPATH, err))
+    reload_snapshot()
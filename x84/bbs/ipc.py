@@ -1,9 +1,11 @@
 """ Session IPC package for x/84. """
 # std imports
 import logging
+import time
 
 # local
 from x84.bbs.session import getsession
+from x84.framing import send_event
 
 
 def make_root_logger(out_queue):
@@ -47,7 +49,7 @@ class IPCLogHandler(logging.Handler):
             session = getsession()
             if session:
                 record.handle = session.user.handle
-            self.oqueue.send(('logger', record))
+            send_event(self.oqueue, 'logger', record)
         except (KeyboardInterrupt, SystemExit):
             raise
         except Exception:
@@ -63,25 +65,90 @@ class IPCStream(object):
     is polled for output in x84.engine.  Only the ``write()`` method of
     this "stream" and ``is_a_tty`` attribute is called or evaluated by
     blessed.Terminal.  The attribute ``is_a_tty`` is mocked as ``True``.
+
+    Output is coalesced: written text is buffered until :meth:`flush` is
+    called, which occurs when the session waits for any event (such as
+    keyboard input) by :meth:`x84.bbs.session.Session.read_events`, or
+    when :attr:`FLUSH_THRESHOLD` characters have been buffered.  A screen
+    redraw of many small writes is then sent as a single 'output' event.
+
+    When an ``output_ring`` (:class:`x84.ringbuf.OutputRing`) is given,
+    encoded output is instead written directly to the shared memory ring,
+    which the engine drains to the client.  A 'doorbell' event is sent
+    only when the engine had drained all prior output, and when the ring
+    is full, :meth:`flush` waits for the engine to drain it.
     """
 
-    def __init__(self, writer):
+    #: number of buffered characters that causes an implicit flush.
+    FLUSH_THRESHOLD = 4096
+
+    #: longest interval, in seconds, between checks of a full output ring.
+    RING_WAIT_MAX = 0.05
+
+    def __init__(self, writer, output_ring=None):
         self.writer = writer
+        self.output_ring = output_ring
         self.is_a_tty = True
+        self._buffer = list()
+        self._buffer_len = 0
+        self._encoding = None
 
     def write(self, ucs, encoding='ascii'):
         """
-        Sends unicode text to Pipe.
+        Buffer unicode text to be sent to Pipe.
 
         Default encoding is 'ascii', which is unset only when used
         with blessings, which rarely writes directly to the stream
         (context managers, such as "with term.location(0, 0):" have
         such side effects).
         """
+        if encoding != self._encoding:
+            # output is sent in runs of the same encoding.
+            self.flush()
+            self._encoding = encoding
+
         # wrap 'ucs' with call to 'unicode()', so that special unicode
         # instances such as blessed.formatters.ParameterizingProxyString
         # can be pickled -- as this one in particular contains a local
         # function (lambda) as an attribute -- which would fail:
         # PicklingError: Can't pickle <type 'function'>: attribute
         #                lookup __builtin__.function failed
-        self.writer.send(('output', (unicode(ucs), encoding)))
+        ucs = unicode(ucs)
+        self._buffer.append(ucs)
+        self._buffer_len += len(ucs)
+        if self._buffer_len >= self.FLUSH_THRESHOLD:
+            self.flush()
+
+    def flush(self):
+        """ Send all buffered text to Pipe as a single 'output' event. """
+        if self._buffer:
+            ucs = u''.join(self._buffer)
+            self._buffer = list()
+            self._buffer_len = 0
+            if self.output_ring is None:
+                send_event(self.writer, 'output', (ucs, self._encoding))
+            else:
+                self._write_ring(ucs.encode(self._encoding, 'replace'))
+
+    def _write_ring(self, data):
+        """ Write encoded bytes to output ring, waiting while it is full. """
+        ring = self.output_ring
+        offset, wait = 0, 0.001
+        while offset < len(data):
+            if ring.closed:
+                # disconnected by engine, which has stopped reading.
+                return
+            head = ring.head
+            written = ring.write(data, offset)
+            if written:
+                offset += written
+                wait = 0.001
+                if ring.tail == head:
+                    # all prior output was drained: the engine may be
+                    # waiting for any file descriptor to become ready.
+                    send_event(self.writer, 'doorbell', None)
+            else:
+                # back-pressure: the client has yet to receive enough of
+                # our previous output for the engine to drain the ring.
+                time.sleep(wait)
+                wait = min(wait * 2, self.RING_WAIT_MAX)
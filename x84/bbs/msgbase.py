@@ -1,5 +1,6 @@
 """ Messaging database package for x/84. """
 # std imports
+import collections
 import datetime
 import logging
 
@@ -12,8 +13,9 @@ from x84.bbs.ini import get_ini
 import dateutil.tz
 
 MSGDB = 'msgbase'
-TAGDB = 'tags'
-PRIVDB = 'privmsg'
+
+#: table of :data:`MSGDB` of messages, see :class:`x84.msgstore.MsgStore`
+STORE = 'store'
 
 # TODO(jquast, maze): Use modeling to construct rfc-compliant mail messaging
 # formats.  It would be possible to use standard mbox-formatted mail boxes,
@@ -51,34 +53,159 @@ def format_origin_line():
     return u''.join((u'\r\n---\r\n', get_origin_line()))
 
 
+def get_store(use_session=True):
+    """ Return :class:`DBProxy` of the message store. """
+    return DBProxy(MSGDB, STORE, use_session=use_session)
+
+
+def next_msg_idx():
+    """
+    Allocate and return index of a new message.
+
+    Indices are never allocated twice, see
+    :meth:`x84.msgstore.MsgStore.next_idx`.  A message of an allocated index
+    is saved as a new message by :meth:`Msg.save`.
+    """
+    return get_store().proxy_method('next_idx')
+
+
 def get_msg(idx=0):
     """ Return Msg record instance by index ``idx``. """
-    return DBProxy(MSGDB)['%d' % int(idx)]
+    return Msg.from_record(get_store().proxy_read('get_msg', int(idx)))
+
+
+def get_msg_header(idx):
+    """ Return :class:`MsgHeader` of message ``idx``, without its body. """
+    return MsgHeader.from_record(
+        get_store().proxy_read('get_msg_header', int(idx)))
+
+
+def list_msg_headers(tags=None, offset=0, limit=None, order='asc',
+                     after=None):
+    """
+    Return list of :class:`MsgHeader` of messages of any ``tags``, or all.
+
+    Of at most ``limit`` messages following the first ``offset``, or those
+    following message of index ``after``, of ascending or descending
+    ``order`` (``'asc'`` or ``'desc'``) of their indices.  Bodies of messages
+    are not read, see :meth:`x84.msgstore.MsgStore.list_msg_headers`.
+    """
+    return [MsgHeader.from_record(record) for record in
+            get_store().proxy_read('list_msg_headers', tags and list(tags),
+                                   offset, limit, order, after)]
+
+
+def get_thread(idx):
+    """
+    Return list of :class:`MsgHeader` of the thread of message ``idx``.
+
+    Of the first message of its thread, followed by each of its replies
+    and their replies in turn, of :attr:`MsgHeader.depth`; of a single
+    request, see :meth:`x84.msgstore.MsgStore.get_thread`.
+    """
+    return [MsgHeader.from_record(record) for record in
+            get_store().proxy_read('get_thread', int(idx))]
 
 
 def list_msgs(tags=None):
     """ Return set of indices matching ``tags``, or all by default. """
-    if tags is not None and 0 != len(tags):
-        msgs = set()
-        db_tag = DBProxy(TAGDB)
-        for tag in (_tag for _tag in tags if _tag in db_tag):
-            msgs.update(db_tag[tag])
-        return msgs
-    return set(int(key) for key in DBProxy(MSGDB).keys())
+    return get_store().proxy_read('list_msgs', tags)
 
 
 def list_privmsgs(handle=None):
     """ Return all private messages for given user handle. """
-    db_priv = DBProxy(PRIVDB)
-    if handle:
-        return db_priv.get(handle, set())
-    # flatten list of [set(1, 2), set(3, 4)] to set(1, 2, 3, 4)
-    return set([_idx for indices in db_priv.values() for _idx in indices])
+    return get_store().proxy_read('list_privmsgs', handle)
 
 
 def list_tags():
     """ Return set of available tags. """
-    return [_tag.decode('utf8') for _tag in DBProxy(TAGDB).keys()]
+    return get_store().proxy_read('list_tags')
+
+
+def mark_read(handle, indices):
+    """
+    Mark messages ``indices`` read by user ``handle``.
+
+    See :meth:`x84.msgstore.MsgStore.mark_read`, messages read by
+    ``anonymous`` are not recorded.
+    """
+    if handle != 'anonymous' and indices:
+        get_store().proxy_method('mark_read', handle, list(indices))
+
+
+def list_unread(handle, tags=None, private=False):
+    """
+    Return set of indices of messages not read by user ``handle``.
+
+    Of messages of any ``tags``, or all tags by default, excluding private
+    messages of other users; or when ``private`` is set, of messages
+    private to ``handle``.
+    """
+    return get_store().proxy_read('list_unread', handle,
+                                  tags and list(tags), private)
+
+
+def count_unread(handle, tags=None, private=False):
+    """ Return number of messages of :func:`list_unread`. """
+    return get_store().proxy_read('count_unread', handle,
+                                  tags and list(tags), private)
+
+
+def count_msgs(handle, tags=None, private=False):
+    """
+    Return number of messages, of those not read, and latest message.
+
+    Of public messages of any ``tags``, or all tags by default; or when
+    ``private`` is set, of messages private to ``handle``.  A tuple of
+    ``(total, unread, latest)``, see :meth:`x84.msgstore.MsgStore.count_msgs`.
+    """
+    return get_store().proxy_read('count_msgs', handle,
+                                  tags and list(tags), private)
+
+
+def get_tag_counts():
+    """ Return dictionary of tags and their number of messages. """
+    return get_store().proxy_read('get_tag_counts')
+
+
+def search_msgs(query, tags=None, author=None, handle=None):
+    """
+    Return sorted list of indices of messages of search ``query``.
+
+    Of messages of every word and "quoted phrase" of ``query``, of any
+    ``tags`` and of ``author``, if given.  Private messages to or from
+    ``handle`` are also found, see
+    :meth:`x84.msgstore.MsgStore.search_msgs`.
+    """
+    return get_store().proxy_read('search_msgs', query,
+                                  tags and list(tags), author, handle)
+
+
+def rebuild_search_index():
+    """ Index words of all messages again, for :func:`search_msgs`. """
+    get_store().proxy_method('rebuild_search')
+
+
+class MsgHeader(collections.namedtuple('MsgHeader', (
+        'idx', 'author', 'recipient', 'subject', 'ctime', 'stime', 'parent',
+        'tags', 'body_length', 'root', 'depth'))):
+
+    """
+    Header of a message held in the msgbase, without its body.
+
+    Of attributes of the same name of :class:`Msg`, ``body_length``, the
+    length of its body, as of :func:`list_msg_headers`, and ``root`` and
+    ``depth``, the first message of its thread and its number of parents
+    of that thread, as of :func:`get_thread`.
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def from_record(cls, record):
+        """ Return header of header ``record`` of the message store. """
+        return cls(tags=set(record['tags']), **dict(
+            (key, record[key]) for key in cls._fields if key != 'tags'))
 
 
 class Msg(object):
@@ -98,7 +225,9 @@ class Msg(object):
 
     - ``parent`` points to the message this message directly refers to.
 
-    - ``children`` is a set of indices replied by this message.
+    - ``children`` is a set of indices of messages replying to this
+      message, as of :func:`get_msg`: it is of their ``parent``, and not
+      saved by :meth:`save`.
     """
 
     # pylint: disable=R0902
@@ -137,9 +266,41 @@ class Msg(object):
         self.parent = None
         self.idx = None
 
+    def to_record(self):
+        """
+        Return record of message, as stored by :class:`x84.msgstore.MsgStore`.
+
+        :rtype: dict
+        """
+        extra = dict(self.__dict__)
+        record = dict((key, extra.pop(key, None)) for key in (
+            'idx', 'author', 'recipient', 'parent', 'subject', 'body'))
+        record['ctime'] = extra.pop('_ctime', None)
+        record['stime'] = extra.pop('_stime', None)
+        record['tags'] = sorted(extra.pop('tags', ()))
+        # replies are stored of their own parent, see Msg.children.
+        extra.pop('children', None)
+        record['extra'] = extra
+        return record
+
+    @classmethod
+    def from_record(cls, record):
+        """ Return message of ``record``, see :meth:`to_record`. """
+        msg = cls.__new__(cls)
+        msg.__dict__.update(record['extra'])
+        for key in ('idx', 'author', 'recipient', 'parent', 'subject',
+                    'body'):
+            setattr(msg, key, record[key])
+        # pylint: disable=W0212
+        #         Access to a protected member
+        msg._ctime, msg._stime = record['ctime'], record['stime']
+        msg.tags = set(record['tags'])
+        msg.children = set(record.get('children', ()))
+        return msg
+
     def save(self, send_net=True, ctime=None):
         """
-        Save message to database, recording 'tags' db.
+        Save message to database, with its tags.
 
         As a side-effect, it may queue message for delivery to
         external systems, when configured.
@@ -148,59 +309,24 @@ class Msg(object):
         session = getsession()
         use_session = bool(session is not None)
         new = self.idx is None or self._stime is None
+        store = get_store(use_session)
+
+        # persist message record, with its tags, to the message store.
+        if new:
+            if ctime is not None:
+                self._ctime = self._stime = ctime
+            else:
+                self._stime = datetime.datetime.now()
+        self.idx = store.proxy_method('save_msg', self.to_record())
 
-        # persist message record to MSGDB
-        with DBProxy(MSGDB, use_session=use_session) as db_msg:
-            if new:
-                self.idx = max(map(int, db_msg.keys()) or [-1]) + 1
-                if ctime is not None:
-                    self._ctime = self._stime = ctime
-                else:
-                    self._stime = datetime.datetime.now()
-                new = True
-            db_msg['%d' % (self.idx,)] = self
-
-        # persist message idx to TAGDB
-        with DBProxy(TAGDB, use_session=use_session) as db_tag:
-            for tag in db_tag.keys():
-                msgs = db_tag[tag]
-                if tag in self.tags and self.idx not in msgs:
-                    msgs.add(self.idx)
-                    db_tag[tag] = msgs
-                    log.debug("msg {self.idx} tagged '{tag}'"
-                              .format(self=self, tag=tag))
-                elif tag not in self.tags and self.idx in msgs:
-                    msgs.remove(self.idx)
-                    db_tag[tag] = msgs
-                    log.info("msg {self.idx} removed tag '{tag}'"
-                             .format(self=self, tag=tag))
-            for tag in [_tag for _tag in self.tags if _tag not in db_tag]:
-                db_tag[tag] = set([self.idx])
-
-        # persist message as child to parent;
+        # replies are recorded of their parent by the message store, which
+        # warns of a parent that does not exist.
         assert self.parent not in self.children, ('circular reference',
                                                   self.parent, self.children)
-        if self.parent is not None:
-            try:
-                parent_msg = get_msg(self.parent)
-            except KeyError:
-                log.warn('Child message {0}.parent = {1}: '
-                         'parent does not exist!'.format(self.idx, self.parent))
-            else:
-                if self.idx != parent_msg.idx:
-                    parent_msg.children.add(self.idx)
-                    parent_msg.save()
-                else:
-                    log.error('Parent idx same as message idx; stripping')
-                    self.parent = None
-                    with db_msg:
-                        db_msg['%d' % (self.idx)] = self
-
-        # persist message record to PRIVDB
-        if 'public' not in self.tags:
-            with DBProxy(PRIVDB, use_session=use_session) as db_priv:
-                db_priv[self.recipient] = (
-                    db_priv.get(self.recipient, set()) | set([self.idx]))
+        if self.parent is not None and self.parent == self.idx:
+            log.error('Parent idx same as message idx; stripping')
+            self.parent = None
+            store.proxy_method('save_msg', self.to_record())
 
         # if either any of 'server_tags' or 'network_tags' are enabled,
         # then queue for potential delivery.
@@ -220,6 +346,13 @@ class Msg(object):
                                       else 'reply'),
                     self=self))
 
+    def delete(self):
+        """ Delete message from database. """
+        log = logging.getLogger(__name__)
+        use_session = bool(getsession() is not None)
+        get_store(use_session).proxy_method('delete_msg', self.idx)
+        log.info(u'deleted message {0}.'.format(self.idx))
+
     def queue_for_network(self):
         """ Queue message for networks, hosting or sending. """
         log = logging.getLogger(__name__)
@@ -14,7 +14,8 @@ import os
 from x84.bbs.exception import Disconnected, Goto
 from x84.bbs.script_def import Script
 from x84.bbs.userbase import User
-from x84.bbs.ini import get_ini
+from x84.bbs.ini import get_ini, get_snapshot, reload_ini
+from x84.framing import send_event, recv_event
 
 
 #: singleton representing the session connected by current process
@@ -137,6 +138,15 @@ class Session(object):
         # create event buffer
         self._buffer = dict()
 
+        # script modules by name, see _load_script
+        self._script_cache = dict()
+
+        # database caches by schema, see get_db_cache
+        self._db_caches = dict()
+
+        # read-only database connections by schema, see get_db_reader
+        self._db_readers = dict()
+
     def to_dict(self):
         """ Dictionary describing this session. """
         retval = {
@@ -239,17 +249,17 @@ class Session(object):
     @property
     def tap_input(self):
         """ Whether keyboard input should be logged (bool). """
-        return get_ini('session', 'tap_input', getter='getboolean')
+        return get_snapshot().tap_input
 
     @property
     def tap_output(self):
         """ Whether screen output should be logged (bool). """
-        return get_ini('session', 'tap_output', getter='getboolean')
+        return get_snapshot().tap_output
 
     @property
     def show_traceback(self):
         """ Whether traceback errors should be displayed to user (bool). """
-        return get_ini('system', 'show_traceback', getter='getboolean')
+        return get_snapshot().show_traceback
 
     @property
     def script_path(self):
@@ -329,6 +339,7 @@ class Session(object):
             # give time for exception to write down the IPC queue before
             # continuing or exiting, esp. exiting, otherwise STOP message
             # is not often fully received to the transport.
+            self.flush()
             time.sleep(2)
 
     def run(self):
@@ -390,6 +401,16 @@ class Session(object):
         if self.log.isEnabledFor(logging.DEBUG) and self.tap_output:
             self.log.debug('--> {!r}'.format(ucs))
 
+    def flush(self):
+        """
+        Send all output buffered for terminal.
+
+        Output is otherwise sent when the session waits for any event, such
+        as keyboard input, so this is only necessary before blocking by
+        other means, such as ``time.sleep()``.
+        """
+        self.terminal.stream.flush()
+
     def flush_event(self, event):
         """
         Flush and return all data buffered for ``event``.
@@ -430,6 +451,14 @@ class Session(object):
 
         - ``gosub``: Allows one session to send another to a different script,
           this is used by the default board ``chat.py`` for a chat request.
+
+        - ``global``: events where the first index of ``data`` is ``reload``.
+          This is sent by the sysop to discard script modules cached by all
+          sessions, see :meth:`reload_scripts`.
+
+        - ``cache-invalidate``: Sent by the engine when values of a database
+          schema are written, to discard them from the cache of this session,
+          see :meth:`get_db_cache`.
         """
         # exceptions aren't buffered; they are thrown!
         if event == 'exception':
@@ -448,6 +477,18 @@ class Session(object):
                 self.sid, self.user.handle,))
             return True
 
+        # respond to global 'reload' requests
+        if event == 'global' and data[0] == 'reload':
+            self.reload_scripts()
+            return True
+
+        # discard database values written by other sessions
+        if event == 'cache-invalidate':
+            schema, table, keys = data
+            if schema in self._db_caches:
+                self._db_caches[schema].invalidate(table, keys)
+            return True
+
         # accept 'gosub' as a literal command to run a new script directly
         # from this buffer_event method.  I'm sure it's fine ...
         if event == 'gosub':
@@ -561,7 +602,43 @@ class Session(object):
         :param str event: event name.
         :param data: event data.
         """
-        self.writer.send((event, data))
+        send_event(self.writer, event, data)
+
+    def handle_events(self):
+        """ Buffer and handle all IPC events waiting, without blocking. """
+        while self.reader.poll():
+            event, data = recv_event(self.reader)
+            self.buffer_event(event, data)
+
+    def get_db_cache(self, schema):
+        """
+        Return database cache of ``schema``.
+
+        :returns: :class:`x84.bbs.dbproxy.DBCache` instance, or ``None`` if
+                  the schema is not of ini option ``db_cache`` of section
+                  ``[session]``.
+        """
+        if schema not in self._db_caches:
+            snapshot = get_snapshot()
+            if schema not in snapshot.db_cache:
+                return None
+            from x84.bbs.dbproxy import DBCache
+            self._db_caches[schema] = DBCache(schema, snapshot.db_cache_size)
+        return self._db_caches[schema]
+
+    def get_db_reader(self, schema):
+        """
+        Return read-only database connection of ``schema``.
+
+        Opened on first use, see :func:`x84.db.open_db_reader`.
+
+        :returns: :class:`x84.db.SqliteDatabase` instance, or ``None`` if
+                  reads of the schema are requested of the engine.
+        """
+        if schema not in self._db_readers:
+            from x84.db import open_db_reader
+            self._db_readers[schema] = open_db_reader(schema)
+        return self._db_readers[schema]
 
     def poll_event(self, event):
         """
@@ -600,6 +677,9 @@ class Session(object):
                   and no matching IPC event is discovered, ``(None, None)`` is
                   returned.
         """
+        # deliver coalesced output before waiting for any reply or input.
+        self.flush()
+
         event, data = self._pop_event_buffer(events)
         if event:
             return (event, data)
@@ -616,7 +696,7 @@ class Session(object):
             # ask engine process for new event data,
             poll = min(0.5, waitfor) or 0.01
             if self.reader.poll(poll):
-                event, data = self.reader.recv()
+                event, data = recv_event(self.reader)
                 # it is necessary to always buffer an event, as some
                 # side-effects may occur by doing so.  When buffer_event
                 # returns True, those side-effects caused no data to be
@@ -655,21 +735,8 @@ class Session(object):
         self.log.info("runscript {0!r}".format(script.name))
         self._script_stack.append(script)
 
-        # if given a script name such as 'extras.target', adjust the lookup
-        # path to be extended by {default_scriptdir}/extras, and adjust
-        # script_name to be just 'target'.
-        script_relpath = self.script_module.__path__
-        lookup_paths = [script_relpath]
-        if '.' not in script.name:
-            script_name = script.name
-        else:
-            # build another system path, relative to `script_module'
-            remaining, script_name = script.name.rsplit('.', 1)
-            _lookup_path = os.path.join(script_relpath, *remaining.split('.'))
-            lookup_paths.append(_lookup_path)
-
-        lookup = imp.find_module(script_name, lookup_paths)
-        module = imp.load_module(script_name, *lookup)
+        module = self._load_script(script.name)
+        script_name = script.name.rsplit('.', 1)[-1]
 
         # ensure main() function exists!
         if not hasattr(module, 'main'):
@@ -690,8 +757,78 @@ class Session(object):
 
         return value
 
+    def _load_script(self, name):
+        """
+        Return module of script identified by ``name``.
+
+        Script modules are cached: the file of a cached module is tested
+        for modification no more often than every ``script_check_interval``
+        seconds of section ``[session]``.  When 0, it is tested each time,
+        and when negative, only after :meth:`reload_scripts`.
+        """
+        cached = self._script_cache.get(name)
+        if cached is not None:
+            module, filepath, mtime, checked = cached
+            interval = get_snapshot().script_check_interval
+            if interval < 0 or time.time() - checked < interval:
+                return module
+            try:
+                if os.stat(filepath).st_mtime == mtime:
+                    self._script_cache[name] = (
+                        module, filepath, mtime, time.time())
+                    return module
+            except OSError:
+                pass
+            self.log.debug('script {0!r} modified'.format(name))
+
+        # if given a script name such as 'extras.target', adjust the lookup
+        # path to be extended by {default_scriptdir}/extras, and adjust
+        # script_name to be just 'target'.
+        script_relpath = self.script_module.__path__
+        lookup_paths = [script_relpath]
+        if '.' not in name:
+            script_name = name
+        else:
+            # build another system path, relative to `script_module'
+            remaining, script_name = name.rsplit('.', 1)
+            _lookup_path = os.path.join(script_relpath, *remaining.split('.'))
+            lookup_paths.append(_lookup_path)
+
+        lookup = imp.find_module(script_name, lookup_paths)
+        # load as a new module, rather than re-initializing any module of
+        # the same name, which may remain cached by another script name.
+        sys.modules.pop(script_name, None)
+        try:
+            module = imp.load_module(script_name, *lookup)
+        finally:
+            if lookup[0] is not None:
+                lookup[0].close()
+
+        filepath = lookup[1]
+        self._script_cache[name] = (
+            module, filepath, os.stat(filepath).st_mtime, time.time())
+        return module
+
+    def reload_scripts(self):
+        """
+        Discard all cached script modules, and read bbs .ini file again.
+
+        Each script is then loaded again when next called.  To do so for
+        all sessions, the sysop may broadcast the ``global`` event of data
+        ``('reload', session.sid)``, as the sysop script does.
+        """
+        self.log.debug('reload scripts')
+        self._script_cache.clear()
+        reload_ini()
+
     def close(self):
-        """ Close session, currently releases ``node`` lock.. """
+        """ Close session, flushing output and releasing ``node`` lock. """
+        self.flush()
+        for cache in self._db_caches.values():
+            self.log.debug('{0!r}'.format(cache))
+        for database in self._db_readers.values():
+            if database is not None:
+                database.close()
         if self._node is not None:
             self.send_event(
                 event='lock-node/%d' % (self._node),
@@ -6,6 +6,12 @@ FN_PASSWORD_DIGEST = None
 GROUPDB = 'groupbase'
 USERDB = 'userbase'
 
+#: table of :data:`USERDB` of key :data:`INDEXED` once indices are built.
+INDICES = 'indices'
+
+#: key of table :data:`INDICES` of indices of handles and e-mail addresses.
+INDEXED = 'handles'
+
 
 def list_users():
     """
@@ -32,12 +38,57 @@ def find_user(handle):
     """
     Discover and return matching user by ``handle``, case-insensitive.
 
+    Looked up by the index of lowercase handles, table ``handles`` of
+    :data:`USERDB`, maintained by :meth:`User.save` and :meth:`User.delete`.
+
     :returns: matching handle as str, or None if not found.
     :rtype: None or str.
     """
-    for key in DBProxy(USERDB).keys():
-        if handle.lower() == key.decode('utf8').lower():
-            return key
+    index = DBProxy(USERDB, 'handles')
+    match = index.get(handle.lower())
+    if match is None and INDEXED not in DBProxy(USERDB, INDICES):
+        # userbase of a former version, not yet indexed.
+        rebuild_user_index()
+        match = index.get(handle.lower())
+    return match if match is None else match.encode('utf8')
+
+
+def find_users_by_email(email):
+    """
+    Return handles of users of e-mail address ``email``, case-insensitive.
+
+    :rtype: list
+    """
+    if INDEXED not in DBProxy(USERDB, INDICES):
+        rebuild_user_index()
+    return sorted(DBProxy(USERDB, 'emails').get(email.strip().lower(), set()))
+
+
+def rebuild_user_index():
+    """
+    Rebuild indices of handles and e-mail addresses of all users.
+
+    Called once by :func:`find_user` of a userbase not yet indexed.
+    Handles of users of former versions may be utf8-encoded bytes, they
+    are indexed as unicode, as saved by :meth:`User.save`.
+    """
+    log = logging.getLogger(__name__)
+    handles, emails = dict(), dict()
+    for user in DBProxy(USERDB).values():
+        handle = user.handle
+        if not isinstance(handle, unicode):
+            handle = handle.decode('utf8')
+        handles[handle.lower()] = handle
+        if user.email.strip():
+            emails.setdefault(user.email.strip().lower(),
+                              set()).add(handle)
+    DBProxy(USERDB, 'emails').set_many(emails)
+    DBProxy(USERDB, 'handles').set_many(handles)
+    # formerly, indices were marked by a handle of u'' of table 'handles'.
+    DBProxy(USERDB, 'handles').batch([('pop', (u'', None))])
+    # marked as indexed only once both are written.
+    DBProxy(USERDB, INDICES)[INDEXED] = True
+    log.info('indexed {0} users.'.format(len(handles)))
 
 
 class Group(object):
@@ -83,10 +134,8 @@ class Group(object):
 
     def delete(self):
         """ Delete group record, enforces referential integrity with Users. """
-        udb = DBProxy(USERDB)
-        for chk_user in self.members:
-            user = udb[chk_user]
-            if self.name in user.groups:
+        for user in DBProxy(USERDB).get_many(list(self.members)):
+            if user is not None and self.name in user.groups:
                 user.group_del(self.name)
                 user.save()
         del DBProxy(GROUPDB)[self.name]
@@ -172,37 +221,40 @@ class User(object):
             log.debug("set attr {!r} not possible for 'anonymous'".format(key))
             return
 
-        with adb:
-            if self.handle not in adb:
-                adb[self.handle] = dict([(key, value), ])
-            else:
-                attrs = adb[self.handle]
-                attrs.__setitem__(key, value)
-                adb[self.handle] = attrs
+        adb.update_key(self.handle, key, value)
         log.debug("set attr {!r} for user {!r}.".format(key, self.handle))
     __setitem__.__doc__ = dict.__setitem__.__doc__
 
+    def set_add(self, key, members):
+        """
+        Add ``members`` to set of attribute ``key``.
+
+        Unlike modifying the value of :meth:`get` and setting it again, only
+        ``members`` are sent to the database, and no lock is required.
+
+        :returns: number of members added.
+        """
+        if self.handle == 'anonymous':
+            return 0
+        return DBProxy(USERDB, 'attrs').set_add(
+            self.handle, list(members), subkey=key)
+
     def get(self, key, default=None):
         # pylint: disable=C0111,
         #        Missing docstring
-        from x84.bbs import ini
+        from x84.bbs.ini import get_snapshot
         log = logging.getLogger(__name__)
         adb = DBProxy(USERDB, 'attrs')
-
-        if self.handle not in adb:
-            if ini.CFG.getboolean('session', 'tap_db'):
-                log.debug('User({!r}).get(key={!r}) returns default={!r}'
-                          .format(self.handle, key, default))
-            return default
+        tap_db = get_snapshot().tap_db
 
         attrs = adb.get(self.handle, {})
         if key not in attrs:
-            if ini.CFG.getboolean('session', 'tap_db'):
+            if tap_db:
                 log.debug('User({!r}.get(key={!r}) returns default={!r}'
                           .format(self.handle, key, default))
             return default
 
-        if ini.CFG.getboolean('session', 'tap_db'):
+        if tap_db:
             log.debug('User({!r}.get(key={!r}) returns value.'
                       .format(self.handle, key))
         return attrs[key]
@@ -252,18 +304,17 @@ class User(object):
         assert self._handle != u'anonymous', ('anonymous may not be saved.')
         udb = DBProxy(USERDB)
         with udb:
-            if 0 == len(udb) and self.is_sysop is False:
+            num_users, previous = udb.batch([('__len__', ()),
+                                             ('get', (self.handle,))])
+            if 0 == num_users and self.is_sysop is False:
                 log.warn('{!r}: First new user becomes sysop.'
                          .format(self.handle))
                 self.group_add(u'sysop')
-            is_new = self.handle not in udb
             udb[self.handle] = self
-            if is_new:
+            if previous is None:
                 log.info("saved new user '%s'.", self.handle)
-        adb = DBProxy(USERDB, 'attrs')
-        with adb:
-            if self.handle not in adb:
-                adb[self.handle] = dict()
+            self._apply_index(previous)
+        DBProxy(USERDB, 'attrs').setdefault(self.handle, dict())
         self._apply_groups()
 
     def delete(self):
@@ -271,14 +322,16 @@ class User(object):
         log = logging.getLogger(__name__)
         gdb = DBProxy(GROUPDB)
         with gdb:
-            for gname in self._groups:
-                group = gdb[gname]
-                if self.handle in group.members:
+            changed = list()
+            for group in gdb.get_many(list(self._groups)):
+                if group is not None and self.handle in group.members:
                     group.remove(self.handle)
-                    group.save()
+                    changed.append((group.name, group))
+            gdb.set_many(changed)
         udb = DBProxy(USERDB)
         with udb:
             del udb[self.handle]
+            self._apply_index(self, deleted=True)
         log.info("deleted user '%s'.", self.handle)
 
     @property
@@ -330,25 +383,49 @@ class User(object):
         #         Missing docstring
         self._email = value
 
+    def _apply_index(self, previous, deleted=False):
+        """
+        Update indices of handles and e-mail addresses of this user.
+
+        :param User previous: record of user as last saved, if any.
+        :param bool deleted: whether the user is deleted.
+        """
+        email = u'' if deleted else self.email.strip().lower()
+        old_email = previous.email.strip().lower() if previous else u''
+        if deleted:
+            # not found of a userbase not yet indexed.
+            DBProxy(USERDB, 'handles').batch(
+                [('pop', (self.handle.lower(), None))])
+        elif previous is None:
+            DBProxy(USERDB, 'handles')[self.handle.lower()] = self.handle
+        if email != old_email:
+            emails = DBProxy(USERDB, 'emails')
+            if old_email:
+                emails.set_discard(old_email, [self.handle])
+            if email:
+                emails.set_add(email, [self.handle])
+
     def _apply_groups(self):
         """ Enforce referential integrity of user's groups. """
         log = logging.getLogger(__name__)
         gdb = DBProxy(GROUPDB)
         with gdb:
+            groups = dict(gdb.items())
+            changed = dict()
             for chk_grp in self._groups:
-                if chk_grp not in gdb:
-                    gdb[chk_grp] = Group(chk_grp, set([self.handle]))
+                if chk_grp not in groups:
+                    changed[chk_grp] = Group(chk_grp, set([self.handle]))
                     log.info("created group {!r} for user {!r}."
                              .format(chk_grp, self.handle))
                 # ensure membership in existing groups
-                group = gdb[chk_grp]
-                if self.handle not in group.members:
-                    group.add(self.handle)
-                    group.save()
-            for gname, group in gdb.items():
+                elif self.handle not in groups[chk_grp].members:
+                    groups[chk_grp].add(self.handle)
+                    changed[chk_grp] = groups[chk_grp]
+            for gname, group in groups.items():
                 if gname not in self._groups and self.handle in group.members:
                     group.remove(self.handle)
-                    group.save()
+                    changed[gname] = group
+            gdb.set_many(changed)
 
 
 def _digestpw_bcrypt(password, salt=None):
@@ -60,6 +60,15 @@ class BaseClient(object):
         except socket.error:
             return None
 
+    def poll_fileno(self):
+        """
+        File descriptor polled by the engine for read-readiness.
+
+        Returns ``None`` when nothing should be polled, or the socket
+        has since been closed.
+        """
+        return self.fileno()
+
     def input_ready(self):
         """ Whether any data is buffered for reading. """
         return bool(self.recv_buffer.__len__())
@@ -82,7 +91,7 @@ class BaseClient(object):
             warnings.warn('send() called on empty buffer', RuntimeWarning, 2)
             return 0
 
-        ready_bytes = bytes(''.join(self.send_buffer))
+        ready_bytes = self.send_buffer.tostring()
         self.send_buffer = array.array('c')
 
         def _send(send_bytes):
@@ -162,9 +171,13 @@ class BaseClient(object):
         """ Buffer bytestring for client. """
         self.send_buffer.fromstring(bstr)
 
+    def send_encoded(self, bstr):
+        """ Buffer bytestring of session output, already encoded. """
+        self.send_str(bstr)
+
     def send_unicode(self, ucs, encoding='utf8'):
         """ Buffer unicode string, encoded for client as 'encoding'. """
-        self.send_str(ucs.encode(encoding, 'replace'))
+        self.send_encoded(ucs.encode(encoding, 'replace'))
 
     def is_active(self):
         """ Whether this connection is active (bool). """
@@ -1,20 +1,626 @@
 """ Database request handler for x/84. """
 # std imports
 import multiprocessing
+import cPickle as pickle
+import collections
+import contextlib
 import threading
 import logging
+import sqlite3
+import UserDict
+import Queue
 import errno
+import time
 import os
 
-# 3rd-party
-import sqlitedict
+# local
+from x84.framing import Pickled, dumps, encode_event, send_event
 
 FILELOCK = multiprocessing.Lock()
 DATALOCK = {}
 
+#: values permitted of each configurable pragma, see :func:`get_db_pragmas`
+PRAGMA_VALUES = {
+    'journal_mode': ('delete', 'truncate', 'persist', 'memory', 'wal'),
+    'synchronous': ('off', 'normal', 'full', 'extra'),
+}
+
+
+def get_db_option(key, schema=None, getter='get', default=None):
+    """
+    Return database option ``key`` of ini section ``[session]``.
+
+    The option ``db_<key>_<schema>`` is preferred over ``db_<key>``, so
+    that any option may be set differently for any one schema.
+
+    :returns: value of option, or ``default`` when neither is set.
+    """
+    from x84.bbs import ini
+    names = ['db_{0}'.format(key)]
+    if schema is not None:
+        names.insert(0, 'db_{0}_{1}'.format(key, schema))
+    for name in names:
+        if ini.CFG is not None and ini.CFG.has_option('session', name):
+            return getattr(ini.CFG, getter)('session', name)
+    return default
+
+
+def get_db_pragmas(schema):
+    """
+    Return list of ``(pragma, value)`` of connections to ``schema``.
+
+    :raises AssertionError: value of option is not permitted.
+    """
+    pragmas = [
+        ('journal_mode', get_db_option('journal_mode', schema,
+                                       default='wal').strip().lower()),
+        ('synchronous', get_db_option('synchronous', schema,
+                                      default='normal').strip().lower()),
+    ]
+    for pragma, value in pragmas:
+        assert value in PRAGMA_VALUES[pragma], (
+            'db_{0} must be one of {1}, not {2!r}'.format(
+                pragma, ', '.join(PRAGMA_VALUES[pragma]), value))
+    # a negative cache_size is a number of KiB, rather than of pages.
+    pragmas.append(('cache_size', -get_db_option(
+        'page_cache', schema, getter='getint', default=2048)))
+    return pragmas
+
+
+class Database(object):
+
+    """
+    Base class of the storage backends of a database schema.
+
+    A database holds the tables of a schema, each a :class:`Table`, see
+    :meth:`table`.  Transactions span all tables of the database.  The
+    backend of each schema is chosen by ini option ``db_backend`` of
+    section ``[session]``, see :func:`get_db_backend`.
+
+    A database is used by one thread at a time, such as a thread of
+    :class:`DBWorkerPool`, which serves requests of a schema one at a time.
+    """
+
+    #: whether the database may only be read.
+    readonly = False
+
+    #: whether a transaction is begun, see :meth:`begin`.
+    in_transaction = False
+
+    @classmethod
+    def open(cls, filepath, autocheckpoint=True, readonly=False):
+        """
+        Return database of ``filepath``.
+
+        :param str filepath: filepath of database.
+        :param bool autocheckpoint: whether the database is checkpointed as
+            needed by its commits, otherwise only by :meth:`checkpoint`.
+        :param bool readonly: whether the database is only for reading.
+        """
+        return cls(filepath, autocheckpoint=autocheckpoint,
+                   readonly=readonly)
+
+    @classmethod
+    def open_table(cls, filepath, table):
+        """ Return :class:`Table` of a database, for a single caller. """
+        return cls.open(filepath).table(table)
+
+    def table(self, table):
+        """ Return :class:`Table` of ``table``, created if not found. """
+        raise NotImplementedError
+
+    def begin(self):
+        """ Begin transaction, locking the database for writing. """
+        raise NotImplementedError
+
+    def commit(self):
+        """ Commit transaction. """
+        raise NotImplementedError
+
+    def rollback(self):
+        """ Roll back transaction. """
+        raise NotImplementedError
+
+    def savepoint(self):
+        """
+        Context manager rolling back to this point of a transaction.
+
+        Only changes made within the context are rolled back on exception.
+        Outside of a transaction, nothing is done.
+        """
+        raise NotImplementedError
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Context manager of a transaction, rolled back on exception.
+
+        The database is locked for writing until the transaction ends.
+        Nested transactions are part of the outermost transaction, though
+        an exception of a nested transaction rolls back only its changes.
+        """
+        if self.in_transaction:
+            with self.savepoint():
+                yield
+            return
+        self.begin()
+        # pylint: disable=W0702
+        #         No exception type(s) specified
+        try:
+            yield
+            self.commit()
+        except:
+            self.rollback()
+            raise
+
+    def checkpoint(self):
+        """ Checkpoint database, called periodically by the engine. """
+        pass
+
+    def close(self):
+        """ Close database. """
+        raise NotImplementedError
+
+
+class Table(object, UserDict.DictMixin):
+
+    """
+    Base class of the tables of a :class:`Database`.
+
+    A dictionary of pickled values, whose backend implements the methods
+    ``__len__``, ``__contains__``, ``__getitem__``, ``__setitem__``,
+    ``__delitem__``, ``keys``, ``values``, ``items``, ``update`` and
+    :meth:`iter_chunk`.  Rows are ordered as they were last set.
+
+    Each method is committed as it is called, or all together when called
+    by :meth:`batch`, or within a :meth:`transaction`.
+
+    Atomic read-modify-write methods, :meth:`update_key`, :meth:`set_add`,
+    :meth:`set_discard`, :meth:`incr` and :meth:`compare_and_swap`, are
+    each run in a single transaction, so that they are correct for any
+    number of connections, in any process.  Those with ``subkey``
+    parameters may modify a value of a dictionary value.
+    """
+
+    #: :class:`Database` of table.
+    database = None
+
+    # pylint: disable=C0111
+    #         Missing docstring
+    def iterkeys(self):
+        return iter(self.keys())
+
+    def itervalues(self):
+        return iter(self.values())
+
+    def iteritems(self):
+        return iter(self.items())
+
+    __iter__ = iterkeys
+
+    def iter_chunk(self, method, position, count, max_bytes):
+        """
+        Return next chunk of rows of iterable ``method``, from ``position``.
+
+        Rows are returned in the order of :meth:`iteritems`.  Values remain
+        pickled: each row is a key for ``iterkeys``, a pickled value for
+        ``itervalues``, or a ``(key, pickled value)`` tuple for
+        ``iteritems``.
+
+        :param str method: one of ``iterkeys``, ``itervalues``, ``iteritems``.
+        :param int position: position returned by the previous chunk, or
+                             ``None`` for the first.
+        :param int count: maximum number of rows.
+        :param int max_bytes: rows are no longer added once their keys and
+                              values exceed this size.
+        :returns: ``(rows, position)``, where ``position`` is ``None`` when
+                  no rows remain.
+        :rtype: tuple
+        """
+        raise NotImplementedError
+
+    def transaction(self):
+        """
+        Context manager of a transaction, rolled back on exception.
+
+        See :meth:`Database.transaction`, transactions span all tables of
+        the database.
+        """
+        return self.database.transaction()
+
+    def batch(self, operations):
+        """
+        Call each method of ``operations`` in a single transaction.
+
+        :param list operations: sequence of ``(method, args)``, such as
+                                ``[('get', ('a', None)), ('keys', ())]``.
+        :returns: list of return values of each method.
+        :raises Exception: any exception of a method, when all are rolled
+                           back.
+        """
+        with self.transaction():
+            results = []
+            for method, args in operations:
+                assert method != 'batch' and not method.startswith('iter'), (
+                    '{0!r} may not be batched'.format(method))
+                results.append(get_db_func(self, method)(*args))
+        return results
+
+    def _get_field(self, key, subkey, default):
+        """ Return ``(record, value)`` of ``key``, or of its ``subkey``. """
+        if subkey is None:
+            return None, self.get(key, default)
+        record = self.get(key, {})
+        return record, record.get(subkey, default)
+
+    def _set_field(self, key, subkey, record, value):
+        """ Store ``value`` of ``key``, or of ``subkey`` of ``record``. """
+        if subkey is None:
+            self[key] = value
+        else:
+            record[subkey] = value
+            self[key] = record
+
+    def update_key(self, key, subkey, value):
+        """ Set ``subkey`` of dictionary value of ``key`` to ``value``. """
+        with self.transaction():
+            record = self.get(key, {})
+            record[subkey] = value
+            self[key] = record
+
+    def set_add(self, key, members, subkey=None):
+        """
+        Add ``members`` to set value of ``key``, or of its ``subkey``.
+
+        :returns: number of members added.
+        :rtype: int
+        """
+        with self.transaction():
+            record, value = self._get_field(key, subkey, set())
+            added = set(members) - value
+            if added:
+                self._set_field(key, subkey, record, value | added)
+        return len(added)
+
+    def set_discard(self, key, members, subkey=None):
+        """
+        Discard ``members`` from set value of ``key``, or of its ``subkey``.
+
+        :returns: number of members discarded.
+        :rtype: int
+        """
+        with self.transaction():
+            record, value = self._get_field(key, subkey, set())
+            discarded = value & set(members)
+            if discarded:
+                self._set_field(key, subkey, record, value - discarded)
+        return len(discarded)
+
+    def incr(self, key, amount=1, subkey=None):
+        """
+        Add ``amount`` to value of ``key``, or of its ``subkey``.
+
+        A value not found is 0.
+
+        :returns: new value.
+        """
+        with self.transaction():
+            record, value = self._get_field(key, subkey, 0)
+            value += amount
+            self._set_field(key, subkey, record, value)
+        return value
+
+    def compare_and_swap(self, key, expected, value):
+        """
+        Set value of ``key`` to ``value`` only if it is equal to ``expected``.
+
+        An ``expected`` value of ``None`` also matches a key not found.
+
+        :returns: whether the value was set.
+        :rtype: bool
+        """
+        with self.transaction():
+            if self.get(key, None) != expected:
+                return False
+            self[key] = value
+        return True
+
+    def close(self):
+        """ Release table, the database remains open. """
+        pass
+
+
+class SqliteDatabase(Database):
+
+    """
+    Connection to the sqlite database file of a schema, shared by its tables.
+
+    Configured by :func:`get_db_pragmas`.  A ``readonly`` connection may not
+    write, nor create tables, nor change the journal mode: its transactions
+    are read transactions, a consistent snapshot of the database.
+    """
+
+    def __init__(self, filepath, autocheckpoint=True, readonly=False):
+        """
+        Class initializer.
+
+        :param str filepath: filepath of database.
+        :param bool autocheckpoint: whether the write-ahead log is
+            checkpointed by commits of this connection, otherwise only by
+            :meth:`checkpoint`.
+        :param bool readonly: whether the connection is only for reading.
+        """
+        self.log = logging.getLogger(__name__)
+        self.filepath = filepath
+        self.schema = os.path.splitext(os.path.basename(filepath))[0]
+        self.conn = sqlite3.connect(filepath, isolation_level=None,
+                                    check_same_thread=False)
+        self.conn.text_factory = str
+        self.readonly = readonly
+        self._savepoints = 0
+        self._tables = dict()
+        for pragma, value in get_db_pragmas(self.schema):
+            if readonly and pragma != 'cache_size':
+                continue
+            try:
+                self.conn.execute('PRAGMA {0}={1}'.format(pragma, value))
+            except sqlite3.OperationalError as err:
+                # such as a change of journal mode while another
+                # connection has the database open.
+                self.log.warn('{0}: PRAGMA {1}={2}: {3}'.format(
+                    self.schema, pragma, value, err))
+        #: journal mode in effect, 'wal' for a write-ahead log.
+        self.journal_mode = self.conn.execute(
+            'PRAGMA journal_mode').fetchone()[0].lower()
+        if not autocheckpoint:
+            self.conn.execute('PRAGMA wal_autocheckpoint=0')
+        if readonly:
+            self.conn.execute('PRAGMA query_only=ON')
+
+    @classmethod
+    def open_table(cls, filepath, table):
+        """ Return :class:`SqliteTable` of its own connection. """
+        schema = os.path.splitext(os.path.basename(filepath))[0]
+        return get_table_class(schema, table)(filepath, table)
+
+    def table(self, table):
+        """ Return :class:`SqliteTable` of ``table`` of this connection. """
+        if table not in self._tables:
+            self._tables[table] = get_table_class(self.schema, table)(
+                self.filepath, table, database=self)
+        return self._tables[table]
+
+    def begin(self):
+        self.conn.execute('BEGIN' if self.readonly else 'BEGIN IMMEDIATE')
+        self.in_transaction = True
+    begin.__doc__ = Database.begin.__doc__
+
+    def commit(self):
+        self.conn.execute('COMMIT')
+        self.in_transaction = False
+    commit.__doc__ = Database.commit.__doc__
+
+    def rollback(self):
+        self.in_transaction = False
+        try:
+            self.conn.execute('ROLLBACK')
+        except sqlite3.OperationalError:
+            # already rolled back by sqlite, such as of a failed commit.
+            pass
+        # tables created by the transaction no longer exist.
+        self._tables.clear()
+    rollback.__doc__ = Database.rollback.__doc__
+
+    @contextlib.contextmanager
+    def savepoint(self):
+        if not self.in_transaction:
+            yield
+            return
+        self._savepoints += 1
+        name = 'sp{0}'.format(self._savepoints)
+        self.conn.execute('SAVEPOINT {0}'.format(name))
+        # pylint: disable=W0702
+        #         No exception type(s) specified
+        try:
+            yield
+        except:
+            self.conn.execute('ROLLBACK TO {0}'.format(name))
+            self.conn.execute('RELEASE {0}'.format(name))
+            raise
+        else:
+            self.conn.execute('RELEASE {0}'.format(name))
+        finally:
+            self._savepoints -= 1
+    savepoint.__doc__ = Database.savepoint.__doc__
+
+    def checkpoint(self):
+        """
+        Copy changes of the write-ahead log into the database file.
+
+        Only as many changes are copied as current readers allow.
+        """
+        if self.journal_mode != 'wal':
+            return
+        busy, log_frames, checkpointed = self.conn.execute(
+            'PRAGMA wal_checkpoint(PASSIVE)').fetchone()
+        if busy or checkpointed < log_frames:
+            self.log.debug('{0}: checkpoint of {1}/{2} frames, busy'
+                           .format(self.schema, checkpointed, log_frames))
+
+    def close(self):
+        """ Close database connection. """
+        self.conn.close()
+
+
+class SqliteTable(Table):
+
+    """
+    Dictionary of pickled values, stored by a table of an sqlite database.
+
+    Compatible with the tables of :mod:`sqlitedict`, formerly used, though
+    without its thread for each connection: an instance may be used by any
+    thread, but only one thread at a time.
+    """
+
+    def __init__(self, filepath, table, database=None):
+        """
+        Class initializer.
+
+        :param str filepath: filepath of database.
+        :param str table: name of table, created when it does not exist.
+        :param SqliteDatabase database: connection shared with other tables,
+                                        otherwise a connection is opened
+                                        and closed by :meth:`close`.
+        """
+        self.filepath, self.table = filepath, table
+        self._owned = database is None
+        self.database = database or SqliteDatabase(filepath)
+        self._conn = self.database.conn
+        self._name = '"{0}"'.format(table.replace('"', '""'))
+        if not self.database.readonly:
+            self._conn.execute('CREATE TABLE IF NOT EXISTS {0} '
+                               '(key TEXT PRIMARY KEY, value BLOB)'
+                               .format(self._name))
+
+    @staticmethod
+    def _encode(value):
+        """ Return ``value`` as sqlite blob. """
+        return sqlite3.Binary(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+
+    @staticmethod
+    def _decode(blob):
+        """ Return value of sqlite blob. """
+        return pickle.loads(str(blob))
+
+    def _select(self, query, args=()):
+        """ Return all rows of ``query`` on this table. """
+        return self._conn.execute(query.format(self._name), args).fetchall()
+
+    # pylint: disable=C0111
+    #         Missing docstring
+    def __len__(self):
+        return self._select('SELECT COUNT(*) FROM {0}')[0][0]
+
+    def __contains__(self, key):
+        return bool(self._select('SELECT 1 FROM {0} WHERE key = ?', (key,)))
+
+    def __getitem__(self, key):
+        rows = self._select('SELECT value FROM {0} WHERE key = ?', (key,))
+        if not rows:
+            raise KeyError(key)
+        return self._decode(rows[0][0])
+
+    def __setitem__(self, key, value):
+        self._conn.execute('REPLACE INTO {0} (key, value) VALUES (?, ?)'
+                           .format(self._name), (key, self._encode(value)))
+
+    def __delitem__(self, key):
+        if not self._conn.execute('DELETE FROM {0} WHERE key = ?'
+                                  .format(self._name), (key,)).rowcount:
+            raise KeyError(key)
+
+    def keys(self):
+        return [key for key, in
+                self._select('SELECT key FROM {0} ORDER BY rowid')]
+
+    def values(self):
+        return [self._decode(value) for value, in
+                self._select('SELECT value FROM {0} ORDER BY rowid')]
+
+    def items(self):
+        return [(key, self._decode(value)) for key, value in
+                self._select('SELECT key, value FROM {0} ORDER BY rowid')]
+
+    def iter_chunk(self, method, position, count, max_bytes):
+        columns = {'iterkeys': 'key',
+                   'itervalues': 'value',
+                   'iteritems': 'key, value'}[method]
+        cursor = self._conn.execute(
+            'SELECT rowid, {0} FROM {1} WHERE rowid > ? ORDER BY rowid '
+            'LIMIT ?'.format(columns, self._name), (position or 0, count))
+        rows, size = [], 0
+        for row in cursor:
+            position = row[0]
+            fields = tuple(str(field) for field in row[1:])
+            rows.append(fields if len(fields) > 1 else fields[0])
+            size += sum(map(len, fields))
+            if size >= max_bytes:
+                # more rows may remain
+                return rows, position
+        return rows, (position if len(rows) == count else None)
+
+    def update(self, *args, **kwargs):
+        items = dict(*args, **kwargs).items()
+        self._conn.executemany('REPLACE INTO {0} (key, value) VALUES (?, ?)'
+                               .format(self._name),
+                               [(key, self._encode(value))
+                                for key, value in items])
+
+    def close(self):
+        """ Close database connection, unless shared with other tables. """
+        if self._owned:
+            self.database.close()
+
+
+#: tables of the sqlite backend of a class other than :class:`SqliteTable`,
+#: by ``(schema, table)``, as ``(module, class name)``.
+TABLE_CLASSES = {
+    ('msgbase', 'store'): ('x84.msgstore', 'MsgStore'),
+}
+
+#: methods of the classes of :data:`TABLE_CLASSES` that write.
+TABLE_WRITES = frozenset(['save_msg', 'delete_msg', 'next_idx', 'mark_read',
+                          'rebuild_counts', 'rebuild_search',
+                          'rebuild_threads'])
+
+
+def get_table_class(schema, table):
+    """ Return class of ``table`` of ``schema`` of the sqlite backend. """
+    if (schema, table) not in TABLE_CLASSES:
+        return SqliteTable
+    module, name = TABLE_CLASSES[(schema, table)]
+    return getattr(__import__(module, fromlist=[name]), name)
+
+
+def get_db_backend(schema):
+    """
+    Return :class:`Database` class of the storage backend of ``schema``.
+
+    Chosen by ini option ``db_backend`` of section ``[session]``: ``sqlite``
+    for :class:`SqliteDatabase`, or ``memory`` for
+    :class:`x84.memdb.MemoryDatabase`.  Schemas of :data:`TABLE_CLASSES`
+    are always of the sqlite backend.
+
+    :raises AssertionError: not a valid backend.
+    """
+    backend = get_db_option('backend', schema, default='sqlite')
+    backend = backend.strip().lower()
+    if any(schema == _schema for _schema, _ in TABLE_CLASSES):
+        backend = 'sqlite'
+    if backend == 'memory':
+        from x84.memdb import MemoryDatabase
+        return MemoryDatabase
+    assert backend == 'sqlite', (
+        'db_backend must be one of sqlite, memory, not {0!r}'
+        .format(backend))
+    return SqliteDatabase
+
+
+def open_database(filepath, autocheckpoint=True):
+    """ Return :class:`Database` of ``filepath``, of its schema's backend. """
+    schema = os.path.splitext(os.path.basename(filepath))[0]
+    # pylint: disable=W0602
+    #          Using global for 'FILELOCK' but no assignment is done
+    global FILELOCK
+    with FILELOCK:
+        check_db(filepath)
+        return get_db_backend(schema).open(
+            filepath, autocheckpoint=autocheckpoint)
+
 
 def get_database(filepath, table):
-    """ Return :class:`sqlitedict.SqliteDict` instance for given database. """
+    """ Return :class:`Table` instance for given database. """
+    schema = os.path.splitext(os.path.basename(filepath))[0]
     # pylint: disable=W0602
     #          Using global for 'FILELOCK' but no assignment is done
     global FILELOCK
@@ -24,12 +630,41 @@ def get_database(filepath, table):
         # exit earlier if we know that file permissions are to blame
         check_db(filepath)
 
-        dictdb = sqlitedict.SqliteDict(filename=filepath,
-                                       tablename=table,
-                                       autocommit=True)
+        dictdb = get_db_backend(schema).open_table(filepath, table)
     return dictdb
 
 
+def open_db_reader(schema):
+    """
+    Return read-only :class:`SqliteDatabase` of ``schema`` for a session.
+
+    A session may read a database of a write-ahead log directly, rather
+    than by request of the engine: its reads are then isolated from the
+    writes of the engine, and do not block them.
+
+    :returns: database, or ``None`` when reads must be requested of the
+              engine: the database does not yet exist, is not of a
+              write-ahead log, is not of the sqlite backend, or ini option
+              ``db_direct_read`` of section ``[session]`` is not set for
+              the schema.
+    """
+    filepath = get_db_filepath(schema)
+    if not (get_db_option('direct_read', schema, getter='getboolean',
+                          default=False) and os.path.exists(filepath)
+            and get_db_backend(schema) is SqliteDatabase):
+        return None
+    try:
+        database = SqliteDatabase(filepath, readonly=True)
+    except sqlite3.Error as err:
+        logging.getLogger(__name__).warn(
+            '{0}: cannot read directly: {1}'.format(schema, err))
+        return None
+    if database.journal_mode != 'wal':
+        database.close()
+        return None
+    return database
+
+
 def check_db(filepath):
     """
     Verify permission access of given database file.
@@ -49,8 +684,8 @@ def check_db(filepath):
 
 def get_db_filepath(schema):
     """ Return filesystem path of given database ``schema``. """
-    from x84.bbs.ini import get_ini
-    folder = get_ini('system', 'datapath')
+    from x84.bbs.ini import get_snapshot
+    folder = get_snapshot().datapath
     return os.path.join(folder, '{0}.sqlite3'.format(schema))
 
 
@@ -101,6 +736,52 @@ def parse_dbevent(event):
     return iterable, schema
 
 
+def written_keys(cmd, args):
+    """
+    Return list of keys written by method ``cmd`` of ``args``.
+
+    :returns: ``None`` if the method does not write, otherwise a list of
+              keys, where a key of ``None`` is any key of the table.
+    :rtype: list or None
+    """
+    if cmd in ('__setitem__', '__delitem__', 'setdefault', 'pop',
+               'update_key', 'set_add', 'set_discard', 'incr',
+               'compare_and_swap'):
+        return [args[0]]
+    elif cmd == 'update':
+        return dict(*args).keys()
+    elif cmd in ('popitem', 'clear') or cmd in TABLE_WRITES:
+        return [None]
+    elif cmd == 'batch':
+        keys = [key for method, op_args in args[0]
+                for key in written_keys(method, op_args) or []]
+        return keys or None
+    return None
+
+
+def broadcast_invalidate(schema, table, keys, exclude=None):
+    """
+    Notify all sessions that cache ``schema`` that ``keys`` were written.
+
+    Sent as event ``cache-invalidate``, see :class:`x84.bbs.dbproxy.DBCache`.
+
+    :param list keys: keys written, as returned by :func:`written_keys`.
+    :param exclude: ``master_write`` pipe of the session that wrote them.
+    """
+    from x84.bbs.ini import get_snapshot
+    if schema not in get_snapshot().db_cache:
+        return
+    from x84.terminal import get_terminals
+    buf = encode_event('cache-invalidate', (schema, table, keys))
+    for _, tty in get_terminals():
+        if tty.master_write is not exclude:
+            try:
+                tty.master_write.send_bytes(buf)
+            except (IOError, OSError):
+                # session has disconnected
+                pass
+
+
 def log_db_cmd(log, schema, cmd, args):
     """ Log database command (when tap_db ini option is used). """
     s_args = '()'
@@ -111,14 +792,14 @@ def log_db_cmd(log, schema, cmd, args):
                                             args=s_args))
 
 
-class DBHandler(threading.Thread):
+class DBHandler(object):
 
     """
     This handler receives and handles a dictionary-based "database command".
 
     See complimenting :class:`x84.bbs.dbproxy.DBProxy`, which behaves as a
     dictionary and "packs" command iterables through an IPC event queue which
-    is then dispatched by the engine.
+    is then dispatched by the engine to the :class:`DBWorkerPool`.
 
     The return values are sent to the session queue with equal 'event' name.
     """
@@ -131,12 +812,14 @@ class DBHandler(threading.Thread):
                                            ipc queue (``tty.master_write``).
         :param str event: database schema in form of string ``'db-schema'``
                           or ``'db=schema'``.  When ``'-'`` is used, the result
-                          is returned as a single transfer. When ``'='``, an
-                          iterable is yielded and the data is transfered via
-                          the IPC Queue as a stream.
+                          is returned as a single transfer. When ``'='``, the
+                          next chunk of an iterable is returned, see
+                          :meth:`Table.iter_chunk`.
         :param tuple data: a dict method proxy command sequence in form of
                            ``(table, command, arguments)``.  For example,
-                           ``('unnamed', 'pop', 0).
+                           ``('unnamed', 'pop', 0).  ``arguments`` may
+                           remain :class:`x84.framing.Pickled`, and are
+                           unpickled by the worker thread.
         """
         self.log = logging.getLogger(__name__)
         self.queue, self.event = queue, event
@@ -145,45 +828,462 @@ class DBHandler(threading.Thread):
         self.iterable, self.schema = parse_dbevent(event)
         self.filepath = get_db_filepath(self.schema)
 
-        from x84.bbs.ini import get_ini
-        self._tap_db = self.log.isEnabledFor(logging.DEBUG) and (
-            get_ini('session', 'tab_db', getter='getboolean'))
+        from x84.bbs.ini import get_snapshot
+        snapshot = get_snapshot()
+        self._tap_db = (self.log.isEnabledFor(logging.DEBUG) and
+                        snapshot.tap_db)
+        self._chunk = (snapshot.db_chunk_items, snapshot.db_chunk_bytes)
+        self._loaded = False
 
-        threading.Thread.__init__(self)
+        #: keys written by command, see :func:`written_keys`
+        self.keys = None
 
-    def run(self):
-        """ Execute database command and return results to session queue. """
-        dictdb = get_database(self.filepath, self.table)
-        func = get_db_func(dictdb, self.cmd)
+        #: ``(event, data)`` sent by :meth:`respond`
+        self.reply = None
+
+        #: time queued by :meth:`DBWorkerPool.submit`
+        self.queued = None
+
+    def _load(self):
+        """ Unpickle arguments of command, once. """
+        if self._loaded:
+            return
+        self._loaded = True
+        if isinstance(self.args, Pickled):
+            self.args = self.args.loads()
+        if not self.iterable:
+            self.keys = written_keys(self.cmd, self.args)
+
+    def writes(self):
+        """ Whether the command may write to the database. """
+        self._load()
+        return self.keys is not None
+
+    def run(self, dictdb):
+        """
+        Execute database command and return results to session queue.
+
+        :param Table dictdb: database of ``(schema, table)``.
+        """
+        # pylint: disable=W0703
+        #         Catching too general exception
+        try:
+            self.execute(dictdb)
+        except Exception as err:
+            self.fail(err)
+        self.respond()
+
+    def execute(self, dictdb):
+        """
+        Execute database command, its result is sent by :meth:`respond`.
+
+        :param Table dictdb: database of ``(schema, table)``.
+        :raises Exception: any exception of the command.
+        """
+        self._load()
         if self._tap_db:
             log_db_cmd(self.log, self.schema, self.cmd, self.args)
 
+        # single value result,
+        if not self.iterable:
+            result = get_db_func(dictdb, self.cmd)(*self.args)
+            self.reply = (self.event, dumps(result))
+
+        # iterable value result, in chunks requested by the session
+        # one at a time: only one chunk is ever held by the engine.
+        else:
+            position, = self.args or (None,)
+            self.reply = (self.event, dumps(
+                dictdb.iter_chunk(self.cmd, position, *self._chunk)))
+
+    def fail(self, err):
+        """ Reply with exception ``err``, nothing was written. """
+        # Pokemon exception, send to session
+        self.reply = ('exception', err)
+        self.keys = None
+
+    def respond(self):
+        """ Send reply to session queue, once the command is committed. """
+        event, data = self.reply
         try:
-            # single value result,
-            if not self.iterable:
-                result = func(*self.args)
-                self.queue.send((self.event, result))
+            if self.keys is not None:
+                # before the reply, so that other sessions receive it
+                # before the writer may act upon what it has written.
+                broadcast_invalidate(self.schema, self.table, self.keys,
+                                     exclude=self.queue)
+            send_event(self.queue, event, data)
+        except IOError as err:
+            if err.errno == errno.EBADF:
+                # our pipe/queue has been disconnected (the session
+                # has disconnected), heck this might be the cause of
+                # an exception of the command.
+                return
+            raise
+
+
+class DBDirectHandler(DBHandler):
+
+    """
+    A :class:`DBHandler` of a caller of the engine process itself.
+
+    Such as the message polling thread and web modules, by way of
+    :meth:`x84.bbs.dbproxy.DBProxy.proxy_method_direct`: served by the
+    long-lived connections of the :class:`DBWorkerPool`, rather than by a
+    database opened for each call.  The caller awaits its result by
+    :meth:`wait`.
+    """
 
-            # iterable value result,
+    def __init__(self, schema, table, cmd, args):
+        """
+        Class initializer.
+
+        :param str schema: database schema.
+        :param str table: database table.
+        :param str cmd: dict method of table.
+        :param tuple args: arguments of method.
+        """
+        super(DBDirectHandler, self).__init__(
+            None, 'db-{0}'.format(schema), (table, cmd, args))
+        self._served = threading.Event()
+
+    def respond(self):
+        """ Wake caller of :meth:`wait`, once the command is committed. """
+        if self.keys is not None:
+            broadcast_invalidate(self.schema, self.table, self.keys)
+        self._served.set()
+
+    def wait(self):
+        """
+        Return result of command, once served.
+
+        :raises Exception: any exception of the command.
+        """
+        self._served.wait()
+        event, data = self.reply
+        if event == 'exception':
+            raise data
+        return data.loads()
+
+
+class DBCheckpoint(object):
+
+    """ Request of :meth:`Database.checkpoint`, by the engine. """
+
+    def __init__(self, database):
+        """
+        Class initializer.
+
+        :param Database database: database to checkpoint.
+        """
+        self.schema, self.filepath = database.schema, database.filepath
+
+        #: time queued by :meth:`DBWorkerPool.submit`
+        self.queued = None
+
+    @staticmethod
+    def run(database):
+        """ Checkpoint ``database``. """
+        database.checkpoint()
+
+
+class DBWorkerPool(object):
+
+    """
+    Fixed-size pool of threads serving :class:`DBHandler` requests.
+
+    Each thread serves requests of any schema, using database connections
+    that remain open for the lifetime of the pool, one for each schema.
+    Requests of the same schema are served one at a time, in the order
+    submitted, so that a session reading its own writes (or the writes of
+    any session before it) is always answered in order.  Requests of
+    differing schemas are served concurrently.
+
+    When ``commit_delay`` is non-zero, requests of a schema queued while
+    one that writes is served are served by the same transaction ("group
+    commit"), for up to ``commit_delay`` seconds: many writes of
+    concurrent sessions are then committed, and synced to disk, only once.
+    Replies are sent only after the transaction is committed.
+
+    When ``checkpoint_interval`` is non-zero, databases are checkpointed
+    only by :meth:`schedule_checkpoints`, rather than by whichever request
+    happens to fill a write-ahead log.
+    """
+
+    #: seconds between reports of :meth:`log_metrics`
+    METRICS_INTERVAL = 60
+
+    def __init__(self, num_workers, commit_delay=0, checkpoint_interval=0):
+        """
+        Class initializer.
+
+        :param int num_workers: number of worker threads.
+        :param float commit_delay: greatest seconds of a group commit,
+                                   0 commits each request as it is served.
+        :param float checkpoint_interval: seconds between checkpoints of
+                                          each database, 0 disables.
+        """
+        self.log = logging.getLogger(__name__)
+        self.num_workers = num_workers
+        self.commit_delay = commit_delay
+        self.checkpoint_interval = checkpoint_interval
+        # pending requests by schema; a schema is present for as long as it
+        # has requests queued or in service, and is then placed in _ready
+        # at most once, so that only one thread ever serves it.
+        self._pending = dict()
+        self._ready = Queue.Queue()
+        self._lock = threading.Lock()
+        self._databases = dict()
+        self._threads = []
+        self._closed = False
+        self._metrics = self._new_metrics()
+        self._last_report = time.time()
+        self._last_checkpoint = time.time()
+        for num in range(num_workers):
+            thread = threading.Thread(target=self._serve,
+                                      name='db-worker-{0}'.format(num))
+            # the engine may exit without awaiting outstanding requests.
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    @staticmethod
+    def _new_metrics():
+        """ Return metrics counters, reset. """
+        return {'served': 0, 'depth': 0, 'peak_depth': 0,
+                'wait_total': 0.0, 'service_total': 0.0,
+                'service_max': 0.0, 'commits': 0, 'checkpoints': 0}
+
+    def submit(self, handler):
+        """ Queue :class:`DBHandler` ``handler`` for service. """
+        handler.queued = time.time()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('DBWorkerPool is closed.')
+            metrics = self._metrics
+            metrics['depth'] += 1
+            metrics['peak_depth'] = max(metrics['peak_depth'],
+                                        metrics['depth'])
+            if handler.schema in self._pending:
+                # queued behind requests of the same schema
+                self._pending[handler.schema].append(handler)
+                return
+            self._pending[handler.schema] = collections.deque([handler])
+        self._ready.put(handler.schema)
+
+    def get_database(self, filepath):
+        """ Return open :class:`Database` of ``filepath``. """
+        with self._lock:
+            database = self._databases.get(filepath)
+        if database is None:
+            database = open_database(
+                filepath, autocheckpoint=not self.checkpoint_interval)
+            with self._lock:
+                self._databases[filepath] = database
+        return database
+
+    def _serve(self):
+        """ Worker thread, serves requests until :meth:`close`. """
+        while True:
+            schema = self._ready.get()
+            if schema is None:
+                return
+            with self._lock:
+                handler = self._pending[schema].popleft()
+            started = time.time()
+            served, commits = [(handler, started)], 0
+            try:
+                database = self.get_database(handler.filepath)
+                if isinstance(handler, DBCheckpoint):
+                    handler.run(database)
+                else:
+                    served, commits = self._serve_group(
+                        database, schema, handler, started)
+            # pylint: disable=W0703
+            #         Catching too general exception
+            except Exception as err:
+                # such as a database file that cannot be opened
+                self.log.exception(err)
+                if not isinstance(handler, DBCheckpoint) and (
+                        handler.reply is None):
+                    handler.fail(err)
+                    self._respond(handler)
+            finished = time.time()
+            with self._lock:
+                metrics = self._metrics
+                metrics['served'] += len(served)
+                metrics['depth'] -= len(served)
+                metrics['commits'] += commits
+                metrics['checkpoints'] += isinstance(handler, DBCheckpoint)
+                for handler, started in served:
+                    metrics['wait_total'] += started - handler.queued
+                    metrics['service_total'] += finished - started
+                    metrics['service_max'] = max(metrics['service_max'],
+                                                 finished - started)
+                if self._pending[schema]:
+                    # serve next request of schema, after any others.
+                    self._ready.put(schema)
+                else:
+                    del self._pending[schema]
+
+    def _serve_group(self, database, schema, handler, started):
+        """
+        Serve ``handler``, and those queued behind it, of ``schema``.
+
+        Requests served after any that writes are served by the same
+        transaction, and are replied to only once it is committed.  A
+        request that fails rolls back only its own changes.
+
+        :returns: list of ``(handler, started)`` served, and the number of
+                  transactions committed.
+        :rtype: tuple
+        """
+        deadline = started + self.commit_delay
+        served, deferred = [], []
+        while True:
+            served.append((handler, started))
+            # pylint: disable=W0703
+            #         Catching too general exception
+            try:
+                if (self.commit_delay and not database.in_transaction
+                        and handler.writes()):
+                    database.begin()
+                dictdb = database.table(handler.table)
+                with database.savepoint():
+                    handler.execute(dictdb)
+            except Exception as err:
+                handler.fail(err)
+            if database.in_transaction:
+                deferred.append(handler)
             else:
-                self.queue.send((self.event, (None, 'StartIteration'),))
-                for item in func(*self.args):
-                    self.queue.send((self.event, item,))
-                self.queue.send((self.event, (None, StopIteration,),))
+                self._respond(handler)
+            started = time.time()
+            if started >= deadline:
+                break
+            with self._lock:
+                pending = self._pending[schema]
+                if not pending or isinstance(pending[0], DBCheckpoint):
+                    break
+                handler = pending.popleft()
+        if not database.in_transaction:
+            return served, 0
+        # pylint: disable=W0703
+        #         Catching too general exception
+        try:
+            database.commit()
+        except Exception as err:
+            database.rollback()
+            for handler in deferred:
+                handler.fail(err)
+        for handler in deferred:
+            self._respond(handler)
+        return served, 1
 
+    def _respond(self, handler):
+        """ Send reply of ``handler``, logging any exception. """
         # pylint: disable=W0703
         #         Catching too general exception
+        try:
+            handler.respond()
         except Exception as err:
-            # Pokemon exception, send to session
-            try:
-                self.queue.send(('exception', err,))
-            except IOError as err:
-                if err.errno == errno.EBADF:
-                    # our pipe/queue has been disconnected (the session
-                    # has disconnected), heck this might be the cause of
-                    # our first exception
-                    return
-                raise
+            # such as a session that has disconnected, the requests of
+            # others served by the same transaction are yet replied to.
+            self.log.exception(err)
 
-        finally:
-            dictdb.close()
+    def schedule_checkpoints(self):
+        """
+        Queue checkpoint of each database, see :meth:`Database.checkpoint`.
+
+        Called periodically by the engine, checkpoints are queued at most
+        once every ``checkpoint_interval``.
+        """
+        if (not self.checkpoint_interval or time.time() -
+                self._last_checkpoint < self.checkpoint_interval):
+            return
+        self._last_checkpoint = time.time()
+        with self._lock:
+            databases = self._databases.values()
+        for database in databases:
+            self.submit(DBCheckpoint(database))
+
+    def metrics(self, reset=False):
+        """
+        Return dictionary of metrics since the pool began, or last reset.
+
+        - ``depth``: number of requests queued or in service.
+        - ``peak_depth``: greatest ``depth``.
+        - ``served``: number of requests served.
+        - ``wait_avg``: average seconds a request waited to be served.
+        - ``service_avg``: average seconds serving a request.
+        - ``service_max``: greatest seconds serving a request.
+        - ``commits``: number of group commits.
+        - ``checkpoints``: number of checkpoints.
+        """
+        with self._lock:
+            metrics = self._metrics.copy()
+            if reset:
+                self._metrics = self._new_metrics()
+                self._metrics['depth'] = metrics['depth']
+        served = metrics['served']
+        return dict(depth=metrics['depth'],
+                    peak_depth=metrics['peak_depth'],
+                    served=served,
+                    wait_avg=metrics['wait_total'] / (served or 1),
+                    service_avg=metrics['service_total'] / (served or 1),
+                    service_max=metrics['service_max'],
+                    commits=metrics['commits'],
+                    checkpoints=metrics['checkpoints'])
+
+    def log_metrics(self):
+        """ Log and reset metrics, at most once every METRICS_INTERVAL. """
+        if time.time() - self._last_report < self.METRICS_INTERVAL:
+            return
+        self._last_report = time.time()
+        metrics = self.metrics(reset=True)
+        if metrics['served']:
+            self.log.debug(
+                'db: {served} served, depth {depth} (peak {peak_depth}), '
+                'wait avg {wait_avg:0.4f}s, service avg {service_avg:0.4f}s '
+                '(max {service_max:0.4f}s), {commits} group commits, '
+                '{checkpoints} checkpoints'.format(**metrics))
+
+    def close(self):
+        """ Stop worker threads and close databases. """
+        with self._lock:
+            self._closed = True
+        for _ in self._threads:
+            self._ready.put(None)
+        for thread in self._threads:
+            thread.join()
+        for database in self._databases.values():
+            database.close()
+        self._databases.clear()
+
+
+#: Singleton :class:`DBWorkerPool` of engine, see :func:`get_db_pool`
+DBPOOL = None
+
+
+def get_db_pool():
+    """ Return :class:`DBWorkerPool` of engine, created on first use. """
+    # pylint: disable=W0603
+    #          Using the global statement
+    global DBPOOL
+    if DBPOOL is None:
+        DBPOOL = DBWorkerPool(
+            num_workers=max(1, get_db_option('workers', getter='getint',
+                                             default=4)),
+            commit_delay=get_db_option('commit_delay', getter='getfloat',
+                                       default=0.005),
+            checkpoint_interval=get_db_option(
+                'checkpoint_interval', getter='getfloat', default=30))
+    return DBPOOL
+
+
+def close_db_pool():
+    """ Close :class:`DBWorkerPool` of engine, if any. """
+    # pylint: disable=W0603
+    #          Using the global statement
+    global DBPOOL
+    if DBPOOL is not None:
+        DBPOOL.close()
+        DBPOOL = None
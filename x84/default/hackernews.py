@@ -235,7 +235,8 @@ def view_article(session, term, url, title):
     fetch_txt = 'fetching {0}'.format(url)
     echo(u''.join((moveto_lastline, term.center(fetch_txt[:term.width], width))))
 
-    # perform get request,
+    # perform get request, once 'fetching ...' is displayed.
+    getsession().flush()
     headers = {'User-Agent': USER_AGENT}
     try:
         req = requests.get(url, headers=headers, timeout=REQUEST_TIMEOUT)
@@ -357,6 +358,7 @@ def view_article_summaries(session, term, rss_url, rss_title):
     # fetch rss feed articles
     echo(term.move(term.height // 2, 0))
     echo(term.center('Fetching {0} ...'.format(term.bold(rss_url))).rstrip())
+    session.flush()
     result = feedparser.parse(rss_url)
     assert result['status'] == 200
 
@@ -371,6 +371,7 @@ def establish_connection(term, session):
 
     client = IRCChat(term, session)
     irc_handle = session.user.handle.replace(' ', '_')
+    session.flush()
     try:
         # pylint: disable=W0142
         client.connect(SERVER, PORT, irc_handle, **kwargs)
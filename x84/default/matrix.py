@@ -20,7 +20,7 @@ import random
 import time
 import os
 
-from x84.bbs import getterminal, get_ini, goto, gosub
+from x84.bbs import getterminal, getsession, get_ini, goto, gosub
 from x84.bbs import echo, showart, syncterm_setfont, LineEditor
 from x84.bbs import find_user, get_user, User
 from x84.engine import __url__
@@ -187,12 +187,14 @@ def authenticate_user(handle, password):
     if matching_handle is None:
         log.debug('Failed login for {handle}: no such user.'
                   .format(handle=handle))
+        getsession().flush()
         time.sleep(artificial_delay)
         return False
 
     elif not password.strip():
         log.debug('Failed login for {handle}: password not provided.'
                   .format(handle=handle))
+        getsession().flush()
         time.sleep(artificial_delay)
         return False
 
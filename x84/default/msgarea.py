@@ -19,18 +19,24 @@ import difflib
 from x84.bbs import (
     syncterm_setfont,
     ScrollingEditor,
+    get_msg_header,
+    get_tag_counts,
     list_privmsgs,
+    search_msgs,
+    list_unread,
     decode_pipe,
     getterminal,
     getsession,
+    count_msgs,
     LineEditor,
     list_users,
+    get_thread,
+    mark_read,
     list_msgs,
     list_tags,
     get_ini,
     get_msg,
     timeago,
-    DBProxy,
     gosub,
     echo,
     Msg,
@@ -93,6 +99,9 @@ subject_max_length = get_ini(
     section='msg', key='max_subject', getter='getint'
 ) or 40
 
+#: maximum length of search queries
+search_max_length = 60
+
 
 def get_menu(messages):
     """ Return list of menu items by given dict ``messages``. """
@@ -100,20 +109,21 @@ def get_menu(messages):
     items = []
     if messages['new']:
         items.extend([
-            MenuItem(u'n', u'new ({0})'.format(len(messages['new']))),
+            MenuItem(u'n', u'new ({0})'.format(messages['new'])),
             MenuItem(u'm', u'mark all read'),
         ])
     if messages['all']:
         items.append(
-            MenuItem(u'a', u'all ({0})'.format(len(messages['all'])))
+            MenuItem(u'a', u'all ({0})'.format(messages['all']))
         )
     if messages['private']:
         items.append(
-            MenuItem(u'v', u'private ({0})'.format(len(messages['private'])))
+            MenuItem(u'v', u'private ({0})'.format(messages['private']))
         )
     items.extend([
         MenuItem(u'p', u'post public'),
         MenuItem(u'w', u'write private'),
+        MenuItem(u's', u'search'),
         MenuItem(u'c', u'change area'),
         MenuItem(u'?', u'help'),
         MenuItem(u'q', u'quit'),
@@ -123,43 +133,76 @@ def get_menu(messages):
 
 def do_mark_as_read(session, message_indicies):
     """ Mark all given messages read. """
-    session.user['readmsgs'] = (
-        session.user.get('readmsgs', set()) | set(message_indicies)
-    )
+    mark_read(session.user.handle, message_indicies)
+
+
+def migrate_messages_read(session):
+    """ Move messages read of former user attribute 'readmsgs'. """
+    messages_read = session.user.get('readmsgs', None)
+    if messages_read is not None:
+        mark_read(session.user.handle, messages_read)
+        del session.user['readmsgs']
 
 
 def get_messages_by_subscription(session, subscription):
+    """
+    Return numbers of messages of tag patterns ``subscription``.
+
+    Returns a dictionary of the number of 'all', 'new' and 'private'
+    messages, the index of the 'latest' message and the 'tags' matched,
+    and a dictionary of the number of 'all' and 'new' messages of each
+    tag pattern.  Messages are counted by the message base as they are
+    saved and read, see :func:`x84.bbs.msgbase.count_msgs`.
+    """
     all_tags = list_tags()
-    messages = {'all': set(), 'new': set()}
-    messages_bytag = {}
-    messages_read = session.user.get('readmsgs', set())
+    handle = session.user.handle
+    counts = {frozenset(): (0, 0, None)}
 
-    # this looks like perl code
+    def count(tags):
+        tags = frozenset(tags)
+        if tags not in counts:
+            counts[tags] = count_msgs(handle, tags=tags)
+        return counts[tags]
+
+    tags, messages_bytag = set(), {}
     for tag_pattern in subscription:
-        messages_bytag[tag_pattern] = collections.defaultdict(set)
-        for tag_match in fnmatch.filter(all_tags, tag_pattern):
-            msg_indicies = list_msgs(tags=(tag_match,))
-            messages['all'].update(msg_indicies)
-            messages_bytag[tag_pattern]['all'].update(msg_indicies)
-        messages_bytag[tag_pattern]['new'] = (
-            messages_bytag[tag_pattern]['all'] - messages_read)
+        tag_matches = fnmatch.filter(all_tags, tag_pattern)
+        tags.update(tag_matches)
+        num_all, num_new, _ = count(tag_matches)
+        messages_bytag[tag_pattern] = {'all': num_all, 'new': num_new}
+
+    # public messages of all tags matched, and our own private messages
+    num_all, num_new, latest = count(tags)
+    num_private, num_private_new, latest_private = count_msgs(
+        handle, private=True)
+    messages = {'all': num_all,
+                'new': num_new + num_private_new,
+                'private': num_private,
+                'latest': max(latest, latest_private),
+                'tags': sorted(tags)}
 
-    # now occlude all private messages :)
-    all_private = list_privmsgs(None)
-    messages['new'] -= all_private
-    messages['all'] -= all_private
+    return messages, messages_bytag
 
-    # and make a list of only our own
-    messages['private'] = list_privmsgs(session.user.handle)
 
-    # and calculate 'new' messages
-    messages['new'] = (messages['all'] | messages['private']) - messages_read
+def list_messages_by_subscription(session, messages, kind):
+    """
+    Return sorted list of messages of subscription, of ``kind``.
 
-    return messages, messages_bytag
+    :param dict messages: as returned by :func:`get_messages_by_subscription`.
+    :param str kind: one of 'all', 'new', or 'private'.
+    """
+    handle, tags = session.user.handle, messages['tags']
+    if kind == 'private':
+        return sorted(list_privmsgs(handle))
+    elif kind == 'all':
+        return sorted(list_msgs(tags=tags) - list_privmsgs(None)
+                      if tags else set())
+    return sorted((list_unread(handle, tags=tags) if tags else set()) |
+                  list_unread(handle, private=True))
 
 
 def describe_message_area(term, subscription, messages_bytags, colors):
-    get_num = lambda lookup, tag_pattern, grp: len(lookup[tag_pattern][grp])
+    get_num = lambda lookup, tag_pattern, grp: lookup[tag_pattern][grp]
     return u''.join((
         colors['highlight'](u'msgarea: '),
         colors['text'](u', ').join((
@@ -188,8 +231,8 @@ def quote(txt, colors):
 
 
 def do_describe_available_tags(term, colors):
-    sorted_tags = sorted([(len(list_msgs(tags=(tag,))), tag)
-                          for tag in list_tags() or [u'public']
+    sorted_tags = sorted([(num_msgs, tag) for tag, num_msgs in
+                          (get_tag_counts() or {u'public': 0}).items()
                           ], reverse=True)
     decorated_tags = [
         colors['text'](tag) +
@@ -365,7 +408,7 @@ def allow_tag(session, idx):
         # tags are moderated, but user is one of the moderator groups
         return True
 
-    msg = get_msg(idx)
+    msg = get_msg_header(idx)
     if session.user.handle in (msg.recipient, msg.author):
         return True
 
@@ -466,6 +509,26 @@ def display_message(session, term, msg_index, colors):
                  break_long_words=True)
 
 
+def display_thread(term, msg_index, colors):
+    """ Display thread of message ``msg_index``, indented by replies. """
+    now = datetime.datetime.now()
+    lines = [u'']
+    for header in get_thread(msg_index):
+        txt_subject = u'{0}  {1}  {2} ago'.format(
+            header.author, header.subject,
+            timeago((now - header.stime).total_seconds()).strip())
+        if header.idx == msg_index:
+            txt_subject = colors['highlight'](txt_subject)
+        # indent of replies, of at most half of the screen.
+        lines.append(u'{0}{1}'.format(
+            u'  ' * min(header.depth, 20), txt_subject))
+    prompt_pager(content=lines, line_no=0,
+                 width=min(80, term.width),
+                 colors=colors, breaker=u'- ', end_prompt=False,
+                 break_long_words=True)
+    echo(u'\r\n')
+
+
 def can_delete(session):
     moderated = get_ini('msg', 'moderated_tags', getter='getboolean')
     tag_moderators = set(get_ini('msg', 'tag_moderators', split=True))
@@ -474,30 +537,8 @@ def can_delete(session):
 
 
 def delete_message(msg):
-    """ Experimental message delete! """
-    # ! belongs as msg.delete() function !
-    msg.recipient = u''
-    msg.subject = u''
-    msg.body = u''
-    msg.children = set()
-    msg.parent = None
-    msg.tags = set()
-    msg.save()
-    with DBProxy('tags') as tag_db:
-        for key, values in tag_db.items()[:]:
-            if msg.idx in values:
-                newvalue = values - set([msg.idx])
-                if newvalue:
-                    tag_db[key] = newvalue
-                else:
-                    # no more messages by this tag, delete it
-                    del tag_db[key]
-    with DBProxy('privmsg') as priv_db:
-        for key, values in priv_db.items()[:]:
-            if msg.idx in values:
-                priv_db[key] = values - set([msg.idx])
-    with DBProxy('msgbase') as msg_db:
-        del msg_db['%d' % int(msg.idx)]
+    """ Delete message ``msg``. """
+    msg.delete()
 
 
 def do_reader_prompt(session, term, index, message_indices, colors):
@@ -512,6 +553,7 @@ def do_reader_prompt(session, term, index, message_indices, colors):
     if can_delete(session):
         opts += (('D', 'elete'),)
     opts += (('r', 'eply'),)
+    opts += (('t', 'hread'),)
     opts += (('q', 'uit'),)
     opts += (('idx', ''),)
     while True:
@@ -554,6 +596,12 @@ def do_reader_prompt(session, term, index, message_indices, colors):
                 echo(u'\r\n')
                 msg.save()
             return index
+        elif inp == u't':
+            # display thread of message
+            echo(term.move_x(xpos) + term.clear_eol)
+            display_thread(term=term, msg_index=message_indices[index],
+                           colors=colors)
+            continue
         elif inp == u'D' and can_delete(session):
             delete_message(msg=get_msg(message_indices[index]))
             return None
@@ -612,6 +660,47 @@ def read_messages(session, term, message_indices, colors):
             break
 
 
+def prompt_search(session, term, colors):
+    """
+    Prompt for search query, returning sorted list of messages found.
+
+    Messages of all words and "quoted phrases" of the query, see
+    :func:`x84.bbs.msgbase.search_msgs`, of any tags given as ``tag:name``,
+    and of author given as ``from:handle``.
+    """
+    xpos = max(0, (term.width // 2) - (80 // 2))
+    echo(u''.join((term.move_x(xpos),
+                   term.clear_eos,
+                   u'Enter words or "phrases" to search for, '
+                   u'and optionally tag:name or from:handle.\r\n',
+                   term.move_x(xpos),
+                   u':: ')))
+    inp = LineEditor(search_max_length,
+                     colors={'highlight': colors['backlight']}
+                     ).read()
+    if inp is None or not inp.strip():
+        return []
+
+    tags, author, query = set(), None, []
+    for term_txt in inp.split():
+        if term_txt.lower().startswith(u'tag:') and term_txt[4:]:
+            tags.add(term_txt[4:])
+        elif term_txt.lower().startswith(u'from:') and term_txt[5:]:
+            author = term_txt[5:]
+        else:
+            query.append(term_txt)
+
+    session.activity = 'searching msgs'
+    message_indices = search_msgs(u' '.join(query), tags=tags or None,
+                                  author=author, handle=session.user.handle)
+    if not message_indices:
+        echo(u''.join((u'\r\n', term.move_x(xpos),
+                       colors['highlight']('No messages found.'),
+                       term.clear_eol)))
+        term.inkey(1)
+    return message_indices
+
+
 def main(quick=False):
     """ Main procedure. """
 
@@ -635,6 +724,7 @@ def main(quick=False):
 
     yloc = top_margin = 0
     subscription = session.user.get('msg_subscription', [])
+    migrate_messages_read(session)
     dirty = 2
 
     while True:
@@ -697,7 +787,7 @@ def main(quick=False):
             session.flush_event('newmsg')
             nxt_msgs, nxt_bytags = get_messages_by_subscription(
                 session, subscription)
-            if nxt_msgs['new'] - messages['new']:
+            if nxt_msgs['new'] and nxt_msgs['latest'] > messages['latest']:
                 # beep and re-display when a new message has arrived.
                 echo(u'\b')
                 messages, messages_bytags = nxt_msgs, nxt_bytags
@@ -718,11 +808,11 @@ def main(quick=False):
             inp = given_inp.strip()
             if inp.lower() in (u'n', 'a', 'v'):
                 # read new/all/private messages
-                message_indices = sorted(list(
-                    {'n': messages['new'],
-                     'a': messages['all'],
-                     'v': messages['private'],
-                     }[inp.lower()]))
+                message_indices = list_messages_by_subscription(
+                    session, messages, {'n': 'new',
+                                        'a': 'all',
+                                        'v': 'private',
+                                        }[inp.lower()])
                 if message_indices:
                     dirty = 2
                     read_messages(session=session, term=term,
@@ -731,7 +821,8 @@ def main(quick=False):
             elif inp.lower() == u'm' and messages['new']:
                 # mark all messages as read
                 dirty = 1
-                do_mark_as_read(session, messages['new'])
+                do_mark_as_read(session, list_messages_by_subscription(
+                    session, messages, 'new'))
             elif inp.lower() in (u'p', u'w'):
                 # write new public/private message
                 dirty = 2
@@ -752,6 +843,16 @@ def main(quick=False):
                     continue
                 do_send_message(session=session, term=term,
                                 msg=msg, colors=colors)
+            elif inp.lower() == u's':
+                # search messages
+                dirty = 2
+                echo(u'\r\n')
+                message_indices = prompt_search(
+                    session=session, term=term, colors=colors)
+                if message_indices:
+                    read_messages(session=session, term=term,
+                                  message_indices=message_indices,
+                                  colors=colors)
             elif inp.lower() == u'c':
                 # prompt for new tag subscription (at next loop)
                 subscription = []
@@ -193,6 +193,8 @@ def post_shroo_ms(message, username):
         # is impersonated.
         'bbsfakeuser': False,
     })
+    # display 'Burning, please wait ...' before awaiting the post.
+    getsession().flush()
     try:
         result = requests.post(shroo_ms_api_url, data=payload, headers=headers)
     except Exception as err:
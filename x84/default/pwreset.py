@@ -7,7 +7,7 @@ import random
 
 from x84.bbs import getsession, getterminal
 from x84.bbs import echo, LineEditor
-from x84.bbs import get_ini, find_user, get_user
+from x84.bbs import get_ini, find_user, find_users_by_email, get_user
 from common import display_banner
 
 import logging
@@ -223,7 +223,7 @@ def matches_email(handle, email):
         log.debug('password reset failed, user {0} has no email on file.'
                   .format(handle))
         return False
-    elif email.lower() != user.email.lower():
+    elif user.handle not in find_users_by_email(email):
         log.debug('pasword reset failed, email mismatch: {0} != {1}.'
                   .format(email, user.email))
         return False
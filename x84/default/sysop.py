@@ -1,10 +1,12 @@
 """
 Sysop area script for x/84.
 
-Currently, this only serves the purpose of adding new message networks.
+Currently, this only serves the purpose of adding new message networks,
+and of rebuilding the message search index.
 """
 
 from x84.bbs import getsession, getterminal, echo, get_ini, DBProxy, LineEditor
+from x84.bbs import rebuild_search_index
 
 
 MSG_NO_SERVER_TAGS = "no `server_tags' defined in ini file, section [msg]."
@@ -86,6 +88,10 @@ def main():
             echo(u'\r\n\r\nmessage network functions:\r\n')
             echo(u'    [a]dd new leaf node.\r\n')
             echo(u'    [v]iew leaf nodes.\r\n')
+            echo(u'\r\nmessage base functions:\r\n')
+            echo(u'    [i]ndex messages for search again.\r\n')
+            echo(u'\r\nscript functions:\r\n')
+            echo(u'    [r]eload scripts of all sessions.\r\n')
             echo(u'\r\n\r\n')
             echo(u'[q]uit\r\n')
             dirty = False
@@ -99,6 +105,17 @@ def main():
             echo(inp)
             add_leaf_msgnet()
             dirty = True
+        elif inp.lower() == u'i':
+            echo(inp)
+            echo(u'\r\nindexing messages ... ')
+            rebuild_search_index()
+            echo(u'done.\r\n')
+        elif inp.lower() == u'r':
+            echo(inp)
+            session.reload_scripts()
+            session.send_event('global', ('reload', session.sid))
+            echo(u'\r\nconfiguration is reloaded, scripts are reloaded '
+                 u'when next called.\r\n')
         elif inp.lower() == u'v':
             echo(inp)
             echo(u'\r\n')
@@ -116,7 +116,9 @@ def fetch_weather(postal):
     Given postal code, fetch and return xml root node of weather results.
     """
     import StringIO
+    from x84.bbs import getsession
     disp_msg(u'fEtChiNG')
+    getsession().flush()
     resp = requests.get(u'http://apple.accuweather.com'
                         + u'/adcbin/apple/Apple_Weather_Data.asp',
                         params=(('zipcode', postal),))
@@ -134,8 +136,9 @@ def fetch_weather(postal):
 def do_search(term, search):
     """ Given search string, return list of possible matching locations. """
     import StringIO
-    from x84.bbs import echo
+    from x84.bbs import echo, getsession
     disp_msg(u'SEARChiNG')
+    getsession().flush()
     resp = requests.get(u'http://apple.accuweather.com'
                         + u'/adcbin/apple/Apple_find_city.asp',
                         params=(('location', search),))
@@ -21,8 +21,8 @@ __credits__ = [
 __license__ = 'ISC'
 
 # std
+import collections
 import logging
-import select
 import socket
 import time
 import sys
@@ -30,10 +30,17 @@ import sys
 # local
 __import__('encodings')  # provides alternate encodings
 from x84 import cmdline
-from x84.db import DBHandler
-from x84.terminal import get_terminals, kill_session, find_tty
+from x84.db import DBHandler, get_db_pool, close_db_pool
+from x84.framing import Pickled, send_event, recv_event
+from x84.poller import get_poller
+from x84.terminal import TERMINALS, get_terminals, kill_session, find_tty
+from x84.terminal import prefork_sessions, shutdown_workers
 from x84.fail2ban import get_fail2ban_function
 
+#: session-ids awaiting each lock by method ``'wait'``, in order requested,
+#: as ``(sid, stale)``, see :func:`handle_lock`.
+LOCK_WAITERS = collections.defaultdict(collections.deque)
+
 
 def main():
     """
@@ -90,6 +97,10 @@ def main():
             for key, client in server.clients.items()[:]:
                 kill_session(client, 'server shutdown')
                 del server.clients[key]
+    finally:
+        # idle session sub-processes would otherwise be awaited forever.
+        shutdown_workers()
+        close_db_pool()
     return 0
 
 
@@ -127,6 +138,32 @@ def get_servers(CFG):
     return servers
 
 
+def housekeeping(servers):
+    """
+    Kill sessions of inactive clients and forget completed threads.
+
+    Also replaces any idle session sub-processes claimed by new clients,
+    and periodically checkpoints databases and logs metrics of the database
+    worker pool.
+    """
+    for server in servers:
+        # bbs sessions that are no longer active on the socket
+        # level -- send them a 'kill signal'
+        for key, client in server.clients.items()[:]:
+            if not client.is_active():
+                # kill_session() also unregisters the client from the poller.
+                kill_session(client, 'socket shutdown')
+                del server.clients[key]
+        # on-connect negotiations that have completed or failed.
+        # delete their thread instance from further evaluation
+        for thread in [_thread for _thread in server.threads
+                       if _thread.stopped][:]:
+            server.threads.remove(thread)
+    prefork_sessions()
+    get_db_pool().schedule_checkpoints()
+    get_db_pool().log_metrics()
+
+
 def find_server(servers, fd):
     """ Find matching ``server.server_socket`` for given file descriptor. """
     for server in servers:
@@ -189,6 +226,7 @@ def accept(log, server, check_ban):
         # spawn on-connect negotiation thread.  When successful,
         # a new sub-process is spawned and registered as a session tty.
         server.clients[client.sock.fileno()] = client
+        get_poller().register(client.poll_fileno())
         thread = server.connect_factory(client, **connect_factory_kwargs)
         log.info('{client.kind} connection from {client.addrport} '
                  '(*{thread.name}).'.format(client=client, thread=thread))
@@ -199,34 +237,71 @@ def accept(log, server, check_ban):
         log.error('accept error {0}:{1}'.format(*err))
 
 
-def get_session_output_fds(servers):
-    """ Return file descriptors of all ``tty.master_read`` pipes. """
-    session_fds = []
+def find_client(servers, fd):
+    """
+    Find client polled by given file descriptor, or None.
+
+    A registered session tty is discovered by its index, otherwise
+    a client still negotiating its connection is discovered by the
+    socket file descriptor of any server.
+    """
+    tty = TERMINALS.by_client_fd(fd)
+    if tty is not None:
+        return tty.client
     for server in servers:
-        for client in server.clients.values():
-            tty = find_tty(client)
-            if tty is not None:
-                session_fds.append(tty.master_read.fileno())
-    return session_fds
+        client = server.clients.get(fd)
+        if client is not None:
+            return client
 
 
 def client_recv(servers, ready_fds, log):
     """
-    Test all clients for recv_ready().
+    Receive data of all clients matching ``ready_fds``.
 
     If any data is available, then ``client.socket_recv()`` is called,
     buffering the data for the session which is exhausted by
     :func:`session_send`.
+
+    :returns: list of clients that received data.
     """
     from x84.bbs.exception import Disconnected
-    for server in servers:
-        for client in server.clients_ready(ready_fds):
-            try:
-                client.socket_recv()
-            except Disconnected as err:
-                log.debug('{client.addrport}: disconnect on recv: {err}'
-                          .format(client=client, err=err))
-                kill_session(client, 'disconnected: {err}'.format(err=err))
+    received = list()
+    for fd in ready_fds:
+        client = find_client(servers, fd)
+        if client is None or not client.is_active():
+            continue
+        try:
+            client.socket_recv()
+        except Disconnected as err:
+            log.debug('{client.addrport}: disconnect on recv: {err}'
+                      .format(client=client, err=err))
+            kill_session(client, 'disconnected: {err}'.format(err=err))
+        else:
+            received.append(client)
+    return received
+
+
+def drain_output(tty, bounded=True):
+    """
+    Buffer output of session's shared memory ring for its client.
+
+    No more is drained than the size of the ring, less what remains
+    buffered by the client, so that a session is suspended when writing
+    to its full ring, rather than buffering without bounds in the engine.
+    When not ``bounded``, such as of a session that has exited, all output
+    of the ring is drained.
+
+    :returns: whether any output remains in the ring.
+    """
+    ring = tty.output_ring
+    if ring is None:
+        return False
+    room = ring.size - len(tty.client.send_buffer) if bounded else None
+    if room is None or room > 0:
+        data = ring.read(room)
+        if data:
+            tty.client.send_encoded(data)
+    return bool(ring.pending())
 
 
 def client_send(terminals, log):
@@ -234,11 +309,17 @@ def client_send(terminals, log):
     Test all clients for send_ready().
 
     If any data is available, then ``tty.client.send()`` is called.
-    This is data sent from the session to the tcp client.
+    This is data sent from the session to the tcp client, including
+    any drained from its shared memory ring by :func:`drain_output`.
+
+    :returns: set of tty whose client could not send all data buffered.
     """
     from x84.bbs.exception import Disconnected
+    pending = set()
     # nothing to send until tty is registered.
     for _, tty in terminals:
+        if drain_output(tty):
+            pending.add(tty)
         if tty.client.send_ready():
             try:
                 tty.client.send()
@@ -246,6 +327,10 @@ def client_send(terminals, log):
                 log.debug('{client.addrport}: disconnect on send: {err}'
                           .format(client=tty.client, err=err))
                 kill_session(tty.client, 'disconnected: {err}'.format(err=err))
+            else:
+                if tty.client.send_ready():
+                    pending.add(tty)
+    return pending
 
 
 def session_send(terminals):
@@ -259,7 +344,7 @@ def session_send(terminals):
     for _, tty in terminals:
         if tty.client.input_ready():
             try:
-                tty.master_write.send(('input', tty.client.get_input()))
+                send_event(tty.master_write, 'input', tty.client.get_input())
             except IOError:
                 # this may happen if a sub-process crashes, or more often,
                 # because the subprocess has logged off, but the user kept
@@ -273,27 +358,31 @@ def session_send(terminals):
 
 
 def handle_lock(locks, tty, event, data, tap_events, log):
-    """ handle locking event of ``(lock-key, (method, stale))``. """
+    """
+    handle locking event of ``(lock-key, (method, stale))``.
+
+    A lock that cannot be acquired is replied ``False`` of method
+    ``'acquire'``; of method ``'wait'``, the session is instead replied
+    ``True`` once the lock is released to it, see :func:`grant_lock`.
+    """
     # pylint: disable=R0913
     #         Too many arguments (6/5)
     method, stale = data
-    if method == 'acquire':
+    if method in ('acquire', 'wait'):
         # this lock is already held,
         if event in locks:
             # check if lock held by an active session,
             holder = locks[event][1]
-            for _sid, _ in get_terminals():
-                if _sid == holder and _sid != tty.sid:
-                    # acquire the lock from a now-deceased session.
-                    log.debug('[{tty.sid}] {event} not acquired, '
-                              'held by active session: {holder}'
-                              .format(tty=tty, event=event, holder=holder))
-                    break
-                elif _sid == holder and _sid == tty.sid:
-                    # acquire the lock from ourselves!  We'll allow it
-                    # (this is termed, "re-entrant locking").
-                    log.debug('{tty.sid}] {event} is re-acquired!'
-                              .format(tty=tty, event=event))
+            if holder != tty.sid and holder in TERMINALS:
+                log.debug('[{tty.sid}] {event} not acquired, '
+                          'held by active session: {holder}'
+                          .format(tty=tty, event=event, holder=holder))
+            elif holder == tty.sid:
+                # acquire the lock from ourselves!  We'll allow it
+                # (this is termed, "re-entrant locking").
+                log.debug('[{tty.sid}] {event} is re-acquired!'
+                          .format(tty=tty, event=event))
+                del locks[event]
             else:
                 # lock is held by a now-defunct session, re-acquired.
                 log.debug('[{tty.sid}] {event} re-acquiring stale lock, '
@@ -306,7 +395,7 @@ def handle_lock(locks, tty, event, data, tap_events, log):
         if event not in locks:
             # acknowledge its requirement,
             locks[event] = (time.time(), tty.sid)
-            tty.master_write.send((event, True,))
+            send_event(tty.master_write, event, True)
             if tap_events:
                 log.debug('[{tty.sid}] {event} granted lock.'
                           .format(tty=tty, event=event))
@@ -328,7 +417,14 @@ def handle_lock(locks, tty, event, data, tap_events, log):
                          '{elapsed}s elapsed (stale={stale})'
                          .format(tty=tty, event=event, holder=holder,
                                  elapsed=elapsed, stale=stale))
-                tty.master_write.send((event, True,))
+                send_event(tty.master_write, event, True)
+
+            # await release, replied by grant_lock()
+            elif method == 'wait':
+                log.debug('[{tty.sid}] {event} lock awaited; already held '
+                          'by active session {holder}'
+                          .format(tty=tty, event=event, holder=holder))
+                LOCK_WAITERS[event].append((tty.sid, stale))
 
             # signal busy with matching event, data=False
             else:
@@ -337,7 +433,7 @@ def handle_lock(locks, tty, event, data, tap_events, log):
                           '(stale={stale})'
                           .format(tty=tty, event=event, holder=holder,
                                   elapsed=elapsed, stale=stale))
-                tty.master_write.send((event, False,))
+                send_event(tty.master_write, event, False)
 
     elif method == 'release':
         if event not in locks:
@@ -348,29 +444,79 @@ def handle_lock(locks, tty, event, data, tap_events, log):
             if tap_events:
                 log.debug('[{tty.sid}] {event} released lock.'
                           .format(tty=tty, event=event))
+            grant_lock(locks, event, log)
+
+
+def grant_lock(locks, event, log):
+    """
+    Grant lock ``event``, if not held, to the first session awaiting it.
+
+    Sessions no longer active are skipped.  Also called by housekeeping
+    for locks held by sessions no longer active, or held longer than the
+    ``stale`` value of the first session awaiting it.
+    """
+    waiters = LOCK_WAITERS.get(event)
+    while waiters:
+        if event in locks:
+            holder, elapsed = locks[event][1], time.time() - locks[event][0]
+            stale = waiters[0][1]
+            if holder in TERMINALS and (stale is None or elapsed <= stale):
+                return
+            log.warn('{event} re-acquiring stale lock, previously held by '
+                     'session {holder} after {elapsed}s elapsed.'
+                     .format(event=event, holder=holder, elapsed=elapsed))
+            del locks[event]
+        sid, _ = waiters.popleft()
+        tty = TERMINALS.by_sid(sid)
+        if tty is None:
+            # session has since exited
+            continue
+        locks[event] = (time.time(), sid)
+        try:
+            send_event(tty.master_write, event, True)
+        except IOError:
+            del locks[event]
+            continue
+        log.debug('[{sid}] {event} granted awaited lock.'
+                  .format(sid=sid, event=event))
+    LOCK_WAITERS.pop(event, None)
 
 
 def session_recv(locks, terminals, log, tap_events):
     """
     Receive data waiting for terminal sessions.
 
-    All data received from subprocess is handled here.
+    All data received from subprocess is handled here.  Only the given
+    ``terminals`` are read from, though events may be routed or broadcast
+    to any registered terminal.
     """
+    from x84.bbs.exception import Disconnected
     for sid, tty in terminals:
+        if TERMINALS.by_sid(sid) is not tty:
+            # killed by an event of a previous terminal
+            continue
         while tty.master_read.poll():
             try:
-                event, data = tty.master_read.recv()
+                event, data = recv_event(tty.master_read)
             except (EOFError, IOError) as err:
                 # sub-process unexpectedly closed
                 log.exception('master_read pipe: {0}'.format(err))
                 kill_session(tty.client, 'master_read pipe: {0}'.format(err))
                 break
-            except TypeError as err:
-                log.exception('unpickling error: {0}'.format(err))
+            except ValueError as err:
+                log.exception('framing error: {0}'.format(err))
                 break
 
             # 'exit' event, unregisters client
             if event == 'exit':
+                # the session has written all of its output, deliver what
+                # the socket accepts before it is closed.
+                drain_output(tty, bounded=False)
+                if tty.client.send_ready():
+                    try:
+                        tty.client.send()
+                    except Disconnected:
+                        pass
                 kill_session(tty.client, 'client exit')
                 break
 
@@ -382,34 +528,51 @@ def session_recv(locks, terminals, log, tap_events):
 
             # 'output' event, buffer for tcp socket
             elif event == 'output':
-                tty.client.send_unicode(ucs=data[0], encoding=data[1])
+                # encoded by the session, see x84.framing.encode_event
+                tty.client.send_encoded(data)
+
+            # 'doorbell' event, output is written to shared memory ring
+            elif event == 'doorbell':
+                # drained by client_send, as this tty is ready.
+                pass
 
             # 'remote-disconnect' event, hunt and destroy
             elif event == 'remote-disconnect':
-                for _sid, _tty in terminals:
-                    # data[0] is 'send-to' address.
-                    if data[0] == _sid:
-                        kill_session(
-                            tty.client, 'remote-disconnect by {0}'.format(sid))
+                # data is the target session-id.
+                _tty = TERMINALS.by_sid(data)
+                if _tty is not None:
+                    kill_session(
+                        _tty.client, 'remote-disconnect by {0}'.format(sid))
+                    if _tty is tty:
                         break
 
             # 'route': message passing directly from one session to another
             elif event == 'route':
                 if tap_events:
                     log.debug('route {0!r}'.format(data))
-                tgt_sid, send_event, send_val = data[0], data[1], data[2:]
-                for _sid, _tty in terminals:
-                    if tgt_sid == _sid:
-                        _tty.master_write.send((send_event, send_val))
-                        break
+                # the routed value remains pickled, see x84.framing.
+                tgt_sid, tgt_event, tgt_val = data
+                _tty = TERMINALS.by_sid(tgt_sid)
+                if _tty is not None:
+                    send_event(_tty.master_write, tgt_event, tgt_val)
 
             # 'global': message broadcasting to all sessions
             elif event == 'global':
                 if tap_events:
                     log.debug('broadcast: {data!r}'.format(data=data))
-                for _sid, _tty in terminals:
+                for _sid, _tty in get_terminals():
                     if sid != _sid:
-                        _tty.master_write.send((event, data,))
+                        send_event(_tty.master_write, event, data)
+                # data of the frame remains pickled, forwarded as-is to
+                # sessions, see x84.framing.decode_event.
+                if isinstance(data, Pickled):
+                    data = data.loads()
+                if data[0] == 'reload':
+                    # new sessions are of the bbs .ini file read again;
+                    # idle sub-processes are replaced, see housekeeping.
+                    from x84.bbs.ini import reload_ini
+                    reload_ini()
+                    shutdown_workers()
 
             # 'set-timeout': set user-preferred timeout
             elif event == 'set-timeout':
@@ -418,9 +581,9 @@ def session_recv(locks, terminals, log, tap_events):
                               .format(tty=tty, data=data))
                 tty.timeout = data
 
-            # 'db*': access DBProxy API for shared sqlitedict
+            # 'db*': access DBProxy API for shared database
             elif event.startswith('db'):
-                DBHandler(tty.master_write, event, data).start()
+                get_db_pool().submit(DBHandler(tty.master_write, event, data))
 
             # 'lock': access fine-grained bbs-global locking
             elif event.startswith('lock'):
@@ -436,61 +599,60 @@ def _loop(servers):
     """ Main event loop. Never returns. """
     # pylint: disable=R0912,R0914,R0915
     #         Too many local variables (24/15)
-    from x84.bbs.ini import CFG
+    from x84.bbs.ini import get_snapshot
+
+    # polling time while output remains buffered for delivery, or for all
+    # passes when the session i/o pipes may not be polled (win32).
+    SELECT_POLL = 0.02
 
-    SELECT_POLL = 0.02  # polling time is 20ms
+    # otherwise, the loop blocks until a registered file descriptor is
+    # ready, waking at this interval only to disconnect idle or inactive
+    # clients.
+    HOUSEKEEPING_POLL = 1.0
 
-    # WIN32 has no session_fds (multiprocess queues are not polled using
-    # select), use a persistently empty set; for WIN32, sessions are always
-    # polled for data at every loop.
+    # WIN32 session pipes are not registered (multiprocess queues are not
+    # polled using select); for WIN32, sessions are always polled for data
+    # at every loop.
     WIN32 = sys.platform.lower().startswith('win32')
-    session_fds = set()
 
     log = logging.getLogger('x84.engine')
 
     if not len(servers):
         raise ValueError("No servers configured for event loop! (ssh, telnet)")
 
-    tap_events = CFG.getboolean('session', 'tap_events')
+    tap_events = get_snapshot().tap_events
     check_ban = get_fail2ban_function()
     locks = dict()
 
-    while True:
-        # shutdown, close & delete inactive clients,
-        for server in servers:
-            # bbs sessions that are no longer active on the socket
-            # level -- send them a 'kill signal'
-            for key, client in server.clients.items()[:]:
-                if not client.is_active():
-                    kill_session(client, 'socket shutdown')
-                    del server.clients[key]
-            # on-connect negotiations that have completed or failed.
-            # delete their thread instance from further evaluation
-            for thread in [_thread for _thread in server.threads
-                           if _thread.stopped][:]:
-                server.threads.remove(thread)
+    poller = get_poller()
+    for server in servers:
+        poller.register(server.server_socket.fileno())
+    log.debug('event loop using {0}'.format(poller.kind))
 
-        check_r = list()
-        for server in servers:
-            check_r.append(server.server_socket.fileno())
-            check_r.extend(server.client_fds())
-        if not WIN32:
-            # WIN32's IPC is not done using sockets, so it
-            # is not possible to use select.select() on them
-            session_fds = get_session_output_fds(servers)
-            check_r.extend(session_fds)
-
-        # We'd like to use timeout 'None', but the registration of
-        # a new client in terminal.start_process surprises us with new
-        # file descriptors for the session i/o.  Unless we loop for
-        # additional `session_fds', a connecting client would block.
-        try:
-            ready_r, _, _ = select.select(check_r, [], [], SELECT_POLL)
-        except select.error as err:
-            # more than likely EBADF (9, 'Bad file descriptor'), it would seem
-            # the socket we've just decided to poll has just gone bad.
-            log.debug('continue after select.error: {0}'.format(err))
-            continue
+    # terminals whose client has output remaining to be delivered
+    pending = set()
+    last_housekeeping = 0
+
+    while True:
+        # block until any server, client, or session is ready for reading,
+        # polling more often only while output could not yet be delivered.
+        timeout = HOUSEKEEPING_POLL
+        if WIN32 or pending:
+            timeout = SELECT_POLL
+        ready_r = poller.poll(timeout)
+
+        if time.time() - last_housekeeping >= HOUSEKEEPING_POLL:
+            housekeeping(servers)
+            # locks awaited of sessions that have exited, or gone stale.
+            for event in LOCK_WAITERS.keys():
+                grant_lock(locks, event, log)
+            # poll about and kick off idle users
+            session_send(get_terminals())
+            # and any output ring whose doorbell went unnoticed.
+            pending.update(tty for _, tty in get_terminals()
+                           if tty.output_ring is not None
+                           and tty.output_ring.pending())
+            last_housekeeping = time.time()
 
         for fd in ready_r:
             # see if any new tcp connections were made
@@ -498,23 +660,35 @@ def _loop(servers):
             if server is not None:
                 accept(log, server, check_ban)
 
-        # receive new data from tcp clients.
-        client_recv(servers, ready_r, log)
-        terms = get_terminals()
+        # receive new data from tcp clients, and that buffered during
+        # on-connect negotiation of any session registered since.
+        received = client_recv(servers, ready_r, log)
+        recv_terms = [(tty.sid, tty) for tty in map(find_tty, received)
+                      if tty is not None]
+        recv_terms.extend((tty.sid, tty) for tty in TERMINALS.registered())
 
         # receive new data from session terminals
-        if WIN32 or set(session_fds) & set(ready_r):
+        if WIN32:
+            ready_terms = get_terminals()
+        else:
+            ready_terms = [(tty.sid, tty) for tty in
+                           map(TERMINALS.by_master_fd, ready_r)
+                           if tty is not None]
+        if ready_terms:
             try:
-                session_recv(locks, terms, log, tap_events)
+                session_recv(locks, ready_terms, log, tap_events)
             except IOError as err:
                 # if the ipc closes while we poll, warn and continue
                 log.warn(err)
 
-        # send tcp data to clients
-        client_send(terms, log)
+        # send tcp data to clients, those that have received output from
+        # their session, replies of telnet negotiation, or remaining output.
+        send_terms = set(ready_terms) | set(recv_terms) | set(
+            (tty.sid, tty) for tty in pending)
+        pending = client_send(send_terms, log)
 
         # send session data, poll for user-timeout and disconnect them
-        session_send(terms)
+        session_send(recv_terms)
 
 
 if __name__ == '__main__':
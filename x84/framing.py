@@ -0,0 +1,197 @@
+"""
+Binary framing of events between the engine and session sub-processes.
+
+Events are sent as ``(event, data)`` pairs over ``multiprocessing.Pipe``
+connections.  Rather than pickling each pair, the most frequent events are
+packed into a compact, length-prefixed binary frame by :func:`encode_event`
+and sent using ``Connection.send_bytes``.  Any other event, or arbitrary
+data, is pickled as the data portion of a generic frame.
+
+Events that the engine only passes along to other sessions (``route`` and
+``global``), and the arguments of ``db`` events, remain pickled as
+:class:`Pickled` bytes when decoded; they are unpickled only by their
+final recipient, never in the engine's main loop.  Data that is already
+:class:`Pickled` is always sent by generic frame: this is how the engine
+forwards such events, and how replies to ``db`` events are distinguished
+from their requests of the same event name.
+"""
+# std imports
+import cPickle as pickle
+import struct
+
+#: generic frame: event name and pickled data
+F_PICKLE = '\x00'
+#: ``('output', (unicode, encoding))``, decoded as encoded bytes
+F_OUTPUT = '\x01'
+#: ``('input', bytes)``
+F_INPUT = '\x02'
+#: ``('route', (session-id, event, value, ...))``
+F_ROUTE = '\x03'
+#: ``('global', data)``
+F_GLOBAL = '\x04'
+#: ``('lock-<name>', (method, stale))``
+F_LOCK = '\x05'
+#: ``('lock-<name>', bool)``
+F_LOCK_REPLY = '\x06'
+#: ``('db-<schema>', (table, method, args))``, or ``'db=<schema>'``
+F_DB = '\x07'
+#: ``('doorbell', None)``, see :mod:`x84.ringbuf`
+F_DOORBELL = '\x08'
+
+_LOCK = struct.Struct('!Bd')
+
+_LOCK_METHODS = ('acquire', 'release', 'wait')
+
+
+class Pickled(str):
+
+    """ Bytes of a pickled value, not yet unpickled. """
+
+    def loads(self):
+        """ Return the unpickled value. """
+        return pickle.loads(self)
+
+
+def dumps(value):
+    """ Return ``value`` as :class:`Pickled` bytes. """
+    if isinstance(value, Pickled):
+        return value
+    return Pickled(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+
+
+def _pack_str(value):
+    """ Return length-prefixed bytes of name ``value``. """
+    if isinstance(value, unicode):
+        value = value.encode('utf8')
+    if len(value) > 255:
+        raise ValueError('name too long: {0!r}'.format(value))
+    return chr(len(value)) + value
+
+
+def _unpack_str(buf, offset):
+    """
+    Return name at ``offset`` of ``buf`` and offset of next field.
+
+    Names are returned as bytes; unicode names are utf-8 encoded.
+    """
+    end = offset + 1 + ord(buf[offset])
+    return buf[offset + 1:end], end
+
+
+def encode_event(event, data):
+    """
+    Return binary frame of given ``event`` and ``data``.
+
+    The unicode text of ``output`` events is encoded by the session, so
+    that the engine need only deliver the bytes of its frame to the client.
+    """
+    # pylint: disable=R0911
+    #         Too many return statements
+    if not isinstance(data, Pickled):
+        if event == 'output':
+            ucs, encoding = data
+            return F_OUTPUT + unicode(ucs).encode(encoding, 'replace')
+
+        elif event == 'input' and isinstance(data, str):
+            return F_INPUT + data
+
+        elif event == 'doorbell' and data is None:
+            return F_DOORBELL
+
+        elif event == 'route':
+            return (F_ROUTE + _pack_str(data[0]) + _pack_str(data[1]) +
+                    dumps(tuple(data[2:])))
+
+        elif event == 'global':
+            return F_GLOBAL + dumps(data)
+
+        elif event.startswith('lock-'):
+            if data is True or data is False:
+                return F_LOCK_REPLY + _pack_str(event) + chr(data)
+            method, stale = (data if isinstance(data, tuple)
+                             and len(data) == 2 else (None, None))
+            if method in _LOCK_METHODS:
+                return (F_LOCK + _pack_str(event) +
+                        _LOCK.pack(_LOCK_METHODS.index(method),
+                                   float('nan') if stale is None else stale))
+
+        elif event[:3] in ('db-', 'db=') and isinstance(data, tuple):
+            table, method, args = data
+            return (F_DB + _pack_str(event) + _pack_str(table) +
+                    _pack_str(method) + dumps(args))
+
+    return F_PICKLE + _pack_str(event) + dumps(data)
+
+
+def decode_event(buf):
+    """
+    Return ``(event, data)`` of binary frame ``buf``.
+
+    :raises ValueError: frame is malformed.
+    """
+    # pylint: disable=R0911
+    #         Too many return statements
+    tag = buf[:1]
+    try:
+        if tag == F_OUTPUT:
+            return 'output', buf[1:]
+
+        elif tag == F_INPUT:
+            return 'input', buf[1:]
+
+        elif tag == F_DOORBELL:
+            return 'doorbell', None
+
+        elif tag == F_ROUTE:
+            tgt_sid, offset = _unpack_str(buf, 1)
+            tgt_event, offset = _unpack_str(buf, offset)
+            return 'route', (tgt_sid, tgt_event, Pickled(buf[offset:]))
+
+        elif tag == F_GLOBAL:
+            return 'global', Pickled(buf[1:])
+
+        elif tag == F_LOCK:
+            event, offset = _unpack_str(buf, 1)
+            method, stale = _LOCK.unpack_from(buf, offset)
+            return event, (_LOCK_METHODS[method],
+                           None if stale != stale else stale)
+
+        elif tag == F_LOCK_REPLY:
+            event, offset = _unpack_str(buf, 1)
+            return event, buf[offset] == '\x01'
+
+        elif tag == F_DB:
+            # inlined _unpack_str(), this is the most frequent of frames
+            # carrying names.
+            end = 2 + ord(buf[1])
+            event = buf[2:end]
+            offset, end = end + 1, end + 1 + ord(buf[end])
+            table = buf[offset:end]
+            offset, end = end + 1, end + 1 + ord(buf[end])
+            return event, (table, buf[offset:end], Pickled(buf[end:]))
+
+        elif tag == F_PICKLE:
+            event, offset = _unpack_str(buf, 1)
+            return event, pickle.loads(buf[offset:])
+
+    # pylint: disable=W0703
+    #         Catching too general exception
+    except Exception as err:
+        # struct.error, IndexError, or any exception of unpickling.
+        raise ValueError('malformed frame: {0}'.format(err))
+    raise ValueError('unknown frame tag: {0!r}'.format(tag))
+
+
+def send_event(conn, event, data):
+    """ Send ``event`` and ``data`` over connection ``conn``. """
+    conn.send_bytes(encode_event(event, data))
+
+
+def recv_event(conn):
+    """
+    Receive and return ``(event, data)`` from connection ``conn``.
+
+    :raises EOFError: the connection is closed.
+    :raises ValueError: frame is malformed.
+    """
+    return decode_event(conn.recv_bytes())
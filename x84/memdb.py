@@ -0,0 +1,483 @@
+"""
+In-memory database backend of x/84, of an append-only journal.
+
+A :class:`MemoryDatabase` holds all tables of a schema in memory, as
+dictionaries of pickled values.  Each committed transaction is appended to
+the schema's journal file, ``<schema>.journal`` of ``datapath``, as one
+length-prefixed frame, so that a transaction torn by a crash is discarded
+whole when the journal is replayed.  The journal is periodically compacted
+into a snapshot file, ``<schema>.snapshot``, by :meth:`checkpoint`.
+
+Suited to small schemas of frequent writes, such as ``lastcalls``, whose
+every read and write is then only a dictionary lookup.  A database is
+owned by the single process that opens it, the engine: it is opened only
+once by each process, shared by all tables and threads, and is locked
+against any other process.  Chosen by ini option ``db_backend`` of section
+``[session]``, see :func:`x84.db.get_db_backend`.
+
+Journal writes are synced to disk as of ini option ``db_synchronous``:
+``off`` never, ``normal`` by each :meth:`MemoryDatabase.checkpoint`, and
+``full`` or ``extra`` by each commit.
+"""
+# std imports
+import cPickle as pickle
+import contextlib
+import threading
+import logging
+import struct
+import bisect
+import errno
+import os
+
+try:
+    import fcntl
+except ImportError:
+    # win32
+    fcntl = None
+
+# local
+from x84.db import Database, Table, get_db_option, get_db_pragmas
+
+#: open databases by filepath, see :meth:`MemoryDatabase.open`
+DATABASES = {}
+DATABASES_LOCK = threading.Lock()
+
+#: length prefix of each frame of the journal
+_FRAME = struct.Struct('!I')
+
+
+def _fsync_dir(path):
+    """ Sync directory ``path``, so that a file renamed within is durable. """
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        # such as win32, where directories may not be opened.
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class MemoryDatabase(Database):
+
+    """
+    Tables of a schema held in memory, of an append-only journal.
+
+    Tables are dictionaries of ``(seq, pickled value)`` by key, where
+    ``seq`` is the order in which each key was last set.  Changes of a
+    transaction are kept in an undo log until committed, and a transaction
+    is held by a single thread: any other thread waits upon it.
+    """
+
+    def __init__(self, filepath, autocheckpoint=True, readonly=False):
+        """
+        Class initializer, use :meth:`open`.
+
+        :param str filepath: filepath of database, its journal and snapshot
+                             are of the same basename.
+        :param bool autocheckpoint: whether the journal is compacted by
+                                    commits as it grows, otherwise only by
+                                    :meth:`checkpoint`.
+        :param bool readonly: not supported, sessions may not read the
+                              memory of the engine.
+        :raises IOError: database is open by another process.
+        """
+        assert not readonly, (
+            'memory databases may only be opened by the engine')
+        self.log = logging.getLogger(__name__)
+        self.filepath = filepath
+        self.schema = os.path.splitext(os.path.basename(filepath))[0]
+        basepath = os.path.splitext(filepath)[0]
+        self.journal_path = '{0}.journal'.format(basepath)
+        self.snapshot_path = '{0}.snapshot'.format(basepath)
+        self.autocheckpoint = autocheckpoint
+        self.synchronous = dict(get_db_pragmas(self.schema))['synchronous']
+        #: journal is compacted once greater than this size, in bytes.
+        self.compact_bytes = get_db_option(
+            'compact_bytes', self.schema, getter='getint', default=1 << 20)
+
+        #: lock of database, held by a thread throughout a transaction.
+        self.lock = threading.RLock()
+        self._owner = None
+        self._refs = 0
+        self._seq = 0
+        self._tables = dict()
+        self._handles = dict()
+        # sorted (seq, key) of each table, discarded as it is modified.
+        self._orders = dict()
+        # (table, key, previous entry) of each change of a transaction,
+        # and (table, key, entry) of each change to be journaled.
+        self._undo, self._redo = [], []
+        self._unsynced = False
+
+        self._journal = open(self.journal_path, 'ab')
+        if fcntl is not None:
+            try:
+                fcntl.flock(self._journal.fileno(),
+                            fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError as err:
+                self._journal.close()
+                if err.errno not in (errno.EAGAIN, errno.EACCES):
+                    raise
+                raise IOError(err.errno, '{0}: database is open by another '
+                              'process'.format(self.journal_path))
+        self._journal_size = self._load()
+
+    @classmethod
+    def open(cls, filepath, autocheckpoint=True, readonly=False):
+        """
+        Return database of ``filepath``, opened once by each process.
+
+        Each database returned must be closed by :meth:`close`.
+        """
+        with DATABASES_LOCK:
+            database = DATABASES.get(filepath)
+            if database is None:
+                database = cls(filepath, autocheckpoint=autocheckpoint,
+                               readonly=readonly)
+                DATABASES[filepath] = database
+            database._refs += 1
+        return database
+
+    @classmethod
+    def open_table(cls, filepath, table):
+        """ Return :class:`MemoryTable`, closing its database by close. """
+        return MemoryTable(cls.open(filepath), table, owned=True)
+
+    def _load(self):
+        """
+        Load snapshot and replay journal.
+
+        A frame torn by a crash is truncated from the journal.
+
+        :returns: size of journal.
+        :rtype: int
+        """
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, 'rb') as fin:
+                self._seq, self._tables = pickle.load(fin)
+        with open(self.journal_path, 'rb') as fin:
+            data = fin.read()
+        offset = 0
+        while offset + _FRAME.size <= len(data):
+            length, = _FRAME.unpack_from(data, offset)
+            end = offset + _FRAME.size + length
+            if end > len(data):
+                break
+            self._apply(pickle.loads(data[offset + _FRAME.size:end]))
+            offset = end
+        if offset < len(data):
+            self.log.warn('{0}: discarding {1} bytes of torn journal'
+                          .format(self.schema, len(data) - offset))
+            self._journal.truncate(offset)
+        return offset
+
+    def _apply(self, changes):
+        """ Apply journaled ``changes`` of a transaction. """
+        for table, key, entry in changes:
+            rows = self._tables.setdefault(table, dict())
+            if key is None:
+                # table created
+                continue
+            elif entry is None:
+                rows.pop(key, None)
+            else:
+                rows[key] = entry
+                self._seq = max(self._seq, entry[0])
+
+    @property
+    def in_transaction(self):
+        """ Whether a transaction is begun by the current thread. """
+        return self._owner is threading.current_thread()
+
+    def table(self, table):
+        """ Return :class:`MemoryTable` of ``table``, created if not found. """
+        with self.lock:
+            if table not in self._handles:
+                if table not in self._tables:
+                    with self.transaction():
+                        self.put(table, None, None)
+                self._handles[table] = MemoryTable(self, table)
+            return self._handles[table]
+
+    def rows(self, table):
+        """
+        Return dictionary of ``(seq, pickled value)`` by key of ``table``.
+
+        Must be called while holding :attr:`lock`, and must not be modified,
+        see :meth:`put`.
+        """
+        return self._tables.get(table, {})
+
+    def order(self, table):
+        """
+        Return sorted list of ``(seq, key)`` of ``table``.
+
+        Must be called while holding :attr:`lock`, and must not be modified.
+        """
+        if table not in self._orders:
+            self._orders[table] = sorted(
+                (seq, key) for key, (seq, _) in self.rows(table).iteritems())
+        return self._orders[table]
+
+    def put(self, table, key, blob):
+        """
+        Set pickled value ``blob`` of ``key`` of ``table`` in a transaction.
+
+        A ``blob`` of ``None`` deletes ``key``, and a ``key`` of ``None``
+        creates ``table``.
+        """
+        assert self.in_transaction, 'put outside of transaction'
+        if table not in self._tables:
+            self._undo.append((table, None, None))
+            self._redo.append((table, None, None))
+            self._tables[table] = dict()
+        if key is None:
+            return
+        rows = self._tables[table]
+        self._orders.pop(table, None)
+        self._undo.append((table, key, rows.get(key)))
+        if blob is None:
+            del rows[key]
+            self._redo.append((table, key, None))
+        else:
+            self._seq += 1
+            rows[key] = (self._seq, blob)
+            self._redo.append((table, key, rows[key]))
+
+    def _undo_to(self, mark):
+        """ Undo changes of the transaction, newest first, up to ``mark``. """
+        while len(self._undo) > mark:
+            table, key, entry = self._undo.pop()
+            self._orders.pop(table, None)
+            if key is None:
+                del self._tables[table]
+                self._handles.pop(table, None)
+            elif entry is None:
+                del self._tables[table][key]
+            else:
+                self._tables[table][key] = entry
+
+    def _end(self):
+        """ End transaction, releasing lock. """
+        self._undo, self._redo = [], []
+        self._owner = None
+        self.lock.release()
+
+    def begin(self):
+        self.lock.acquire()
+        self._owner = threading.current_thread()
+    begin.__doc__ = Database.begin.__doc__
+
+    def commit(self):
+        """ Commit transaction, appending its changes to the journal. """
+        # pylint: disable=W0702
+        #         No exception type(s) specified
+        try:
+            if self._redo:
+                self._append(self._redo)
+                if (self.autocheckpoint and
+                        self._journal_size >= self.compact_bytes):
+                    self.compact()
+        except:
+            # such as a full disk, nothing is committed.
+            self._undo_to(0)
+            self._end()
+            raise
+        self._end()
+
+    def rollback(self):
+        if not self.in_transaction:
+            # already rolled back, such as of a failed commit.
+            return
+        self._undo_to(0)
+        self._end()
+    rollback.__doc__ = Database.rollback.__doc__
+
+    @contextlib.contextmanager
+    def savepoint(self):
+        if not self.in_transaction:
+            yield
+            return
+        undo_mark, redo_mark = len(self._undo), len(self._redo)
+        # pylint: disable=W0702
+        #         No exception type(s) specified
+        try:
+            yield
+        except:
+            self._undo_to(undo_mark)
+            del self._redo[redo_mark:]
+            raise
+    savepoint.__doc__ = Database.savepoint.__doc__
+
+    def _append(self, changes):
+        """ Append ``changes`` of a transaction to the journal, as a frame. """
+        buf = pickle.dumps(changes, pickle.HIGHEST_PROTOCOL)
+        self._journal.write(_FRAME.pack(len(buf)) + buf)
+        self._journal.flush()
+        self._journal_size += _FRAME.size + len(buf)
+        if self.synchronous in ('full', 'extra'):
+            os.fsync(self._journal.fileno())
+        elif self.synchronous != 'off':
+            self._unsynced = True
+
+    def compact(self):
+        """
+        Write snapshot of all tables and truncate journal.
+
+        The snapshot is written to a temporary file, then renamed, so that
+        either the previous or the new snapshot remains after a crash: the
+        journal replayed upon either is the same database.
+        """
+        with self.lock:
+            tmp_path = '{0}.tmp'.format(self.snapshot_path)
+            with open(tmp_path, 'wb') as fout:
+                pickle.dump((self._seq, self._tables), fout,
+                            pickle.HIGHEST_PROTOCOL)
+                fout.flush()
+                os.fsync(fout.fileno())
+            os.rename(tmp_path, self.snapshot_path)
+            _fsync_dir(os.path.dirname(self.snapshot_path))
+            self._journal.truncate(0)
+            os.fsync(self._journal.fileno())
+            self._journal_size = 0
+            self._unsynced = False
+
+    def checkpoint(self):
+        """
+        Sync journal to disk, compacting it when greater than compact_bytes.
+
+        Called periodically by the engine, see ini options
+        ``db_checkpoint_interval`` and ``db_compact_bytes``.
+        """
+        with self.lock:
+            if self._journal_size >= self.compact_bytes:
+                self.compact()
+            elif self._unsynced:
+                os.fsync(self._journal.fileno())
+                self._unsynced = False
+
+    def close(self):
+        """ Close database once closed by all openers, compacting journal. """
+        # the journal is closed, and its lock released, before the database
+        # may be opened again.
+        with DATABASES_LOCK:
+            self._refs -= 1
+            if self._refs > 0:
+                return
+            del DATABASES[self.filepath]
+            with self.lock:
+                if self._journal_size:
+                    self.compact()
+                self._journal.close()
+
+
+class MemoryTable(Table):
+
+    """
+    Dictionary of pickled values, stored by a table of :class:`MemoryDatabase`.
+
+    Keys are stored as utf8-encoded strings, as they are by
+    :class:`x84.db.SqliteTable`.
+    """
+
+    def __init__(self, database, table, owned=False):
+        """
+        Class initializer.
+
+        :param MemoryDatabase database: database of table.
+        :param str table: name of table.
+        :param bool owned: whether :meth:`close` closes the database.
+        """
+        self.database, self.table = database, table
+        self.filepath = database.filepath
+        self._owned = owned
+        if owned:
+            # created if not found
+            database.table(table)
+
+    @staticmethod
+    def _key(key):
+        """ Return ``key`` as stored, as of sqlite column affinity TEXT. """
+        if isinstance(key, unicode):
+            return key.encode('utf8')
+        elif not isinstance(key, str):
+            return str(key)
+        return key
+
+    def _sorted(self):
+        """ Return list of ``(key, pickled value)`` of table, in order. """
+        with self.database.lock:
+            rows = self.database.rows(self.table)
+            return [(key, rows[key][1])
+                    for _, key in self.database.order(self.table)]
+
+    # pylint: disable=C0111
+    #         Missing docstring
+    def __len__(self):
+        with self.database.lock:
+            return len(self.database.rows(self.table))
+
+    def __contains__(self, key):
+        with self.database.lock:
+            return self._key(key) in self.database.rows(self.table)
+
+    def __getitem__(self, key):
+        with self.database.lock:
+            entry = self.database.rows(self.table).get(self._key(key))
+        if entry is None:
+            raise KeyError(key)
+        return pickle.loads(entry[1])
+
+    def __setitem__(self, key, value):
+        blob = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self.transaction():
+            self.database.put(self.table, self._key(key), blob)
+
+    def __delitem__(self, key):
+        with self.transaction():
+            if self._key(key) not in self.database.rows(self.table):
+                raise KeyError(key)
+            self.database.put(self.table, self._key(key), None)
+
+    def keys(self):
+        return [key for key, _ in self._sorted()]
+
+    def values(self):
+        return [pickle.loads(blob) for _, blob in self._sorted()]
+
+    def items(self):
+        return [(key, pickle.loads(blob)) for key, blob in self._sorted()]
+
+    def iter_chunk(self, method, position, count, max_bytes):
+        with self.database.lock:
+            rows = self.database.rows(self.table)
+            order = self.database.order(self.table)
+            start = bisect.bisect_left(order, ((position or 0) + 1,))
+            entries = [(seq, key, rows[key][1])
+                       for seq, key in order[start:start + count]]
+        rows, size = [], 0
+        for position, key, blob in entries:
+            fields = {'iterkeys': (key,),
+                      'itervalues': (blob,),
+                      'iteritems': (key, blob)}[method]
+            rows.append(fields if len(fields) > 1 else fields[0])
+            size += sum(map(len, fields))
+            if size >= max_bytes:
+                # more rows may remain
+                return rows, position
+        return rows, (position if len(rows) == count else None)
+    iter_chunk.__doc__ = Table.iter_chunk.__doc__
+
+    def update(self, *args, **kwargs):
+        items = [(self._key(key), pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+                 for key, value in dict(*args, **kwargs).items()]
+        with self.transaction():
+            for key, blob in items:
+                self.database.put(self.table, key, blob)
+
+    def close(self):
+        """ Close database, unless shared with other tables. """
+        if self._owned:
+            self.database.close()
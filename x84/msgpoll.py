@@ -262,7 +262,7 @@ def poll_network_for_messages(net):
 def publish_network_messages(net):
     """ Push messages to network, ``net``. """
     from x84.bbs import DBProxy
-    from x84.bbs.msgbase import format_origin_line, MSGDB
+    from x84.bbs.msgbase import format_origin_line, get_msg
 
     log = logging.getLogger(__name__)
 
@@ -270,19 +270,18 @@ def publish_network_messages(net):
 
     queuedb = DBProxy('{0}queues'.format(net['name']), use_session=False)
     transdb = DBProxy('{0}trans'.format(net['name']), use_session=False)
-    msgdb = DBProxy(MSGDB, use_session=False)
 
     # publish each message
     for msg_id in sorted(queuedb.keys(),
                          cmp=lambda x, y: cmp(int(x), int(y))):
-        if msg_id not in msgdb:
+        try:
+            msg = get_msg(msg_id)
+        except KeyError:
             log.warn('[{net[name]}] No such message (msg_id={msg_id})'
                      .format(net=net, msg_id=msg_id))
             del queuedb[msg_id]
             continue
 
-        msg = msgdb[msg_id]
-
         trans_parent = None
         if msg.parent is not None:
             matches = [key for key, data in transdb.items()
@@ -310,10 +309,10 @@ def publish_network_messages(net):
             continue
 
         # transform, and possibly duplicate(?) message ..
-        with transdb, msgdb, queuedb:
+        with transdb, queuedb:
             transdb[trans_id] = msg_id
             msg.body = u''.join((msg.body, format_origin_line()))
-            msgdb[msg_id] = msg
+            msg.save(send_net=False)
             del queuedb[msg_id]
         log.info('[{net[name]}] Published (msg_id={msg_id}) => {trans_id}'
                  .format(net=net, msg_id=msg_id, trans_id=trans_id))
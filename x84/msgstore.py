@@ -0,0 +1,1032 @@
+"""
+Relational message store of x/84.
+
+Messages of :mod:`x84.bbs.msgbase` are stored by table ``store`` of the
+``msgbase`` database schema, served by :class:`MsgStore`.  Rather than a
+pickled :class:`x84.bbs.msgbase.Msg` for each message, the envelope of a
+message is a row of table ``msg``, its body a row of ``msg_body``, and its
+tags rows of ``msg_tag``, indexed by ``(tag, idx)``: listing messages of a
+tag, or private messages of a user, is an indexed query, and saving a
+message writes only that message's rows.  Column ``body_length`` of
+``msg`` is the length of its body, so that headers of messages are listed
+without reading their bodies, see :meth:`MsgStore.list_msg_headers`.
+
+Messages are records, dictionaries of keys ``idx``, ``author``,
+``recipient``, ``ctime``, ``stime``, ``parent``, ``subject``, ``body``,
+``tags`` and ``extra``, a dictionary of any other attributes of a message;
+see :meth:`x84.bbs.msgbase.Msg.to_record`.  Records returned by
+:meth:`MsgStore.get_msg` also hold ``children``, the replies to a message,
+of index ``msg_parent``: saving a reply does not write its parent.
+
+Messages read by each user are recorded compactly, see
+:meth:`MsgStore.mark_read`: of each tag, a mark of the index of its messages
+read, all of those of lesser index also read, and ranges of indices read past
+those marks.  The number of messages of each tag, and of those read by each
+user, are counted as messages are saved, deleted, and read, see
+:meth:`MsgStore.count_msgs`.  Words of the subject and body of each message
+are indexed by table ``msg_word``, the position of each word of each message
+of rows ordered by ``(word, idx, pos)``, see :meth:`MsgStore.search_msgs`.
+Replies are threaded by table ``msg_thread``, of the root message of each
+thread and a path of indices from it, see :meth:`MsgStore.get_thread`.
+
+The store is a table of the sqlite backend only, see
+:func:`x84.db.get_table_class`.  Its methods are called by
+:class:`x84.bbs.dbproxy.DBProxy`, such as ``proxy_read('list_msgs', tags)``.
+"""
+# std imports
+import cPickle as pickle
+import collections
+import datetime
+import itertools
+import logging
+import re
+import sqlite3
+
+# local
+from x84.db import Table, SqliteDatabase, SqliteTable
+
+#: table of the pickled messages of former versions, see :meth:`migrate`
+LEGACY_TABLE = 'unnamed'
+
+#: columns of table ``msg`` of record keys of the same name
+COLUMNS = ('idx', 'author', 'recipient', 'ctime', 'stime', 'parent',
+           'subject')
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS msg ('
+    ' idx INTEGER PRIMARY KEY, author TEXT, recipient TEXT,'
+    ' ctime TEXT, stime TEXT, parent INTEGER, subject TEXT,'
+    ' private INTEGER NOT NULL DEFAULT 0, extra BLOB,'
+    ' body_length INTEGER NOT NULL DEFAULT 0)',
+    'CREATE INDEX IF NOT EXISTS msg_parent ON msg (parent)',
+    'CREATE INDEX IF NOT EXISTS msg_private ON msg (private, recipient)',
+    'CREATE TABLE IF NOT EXISTS msg_body ('
+    ' idx INTEGER PRIMARY KEY, body TEXT)',
+    'CREATE TABLE IF NOT EXISTS msg_tag ('
+    ' tag TEXT NOT NULL, idx INTEGER NOT NULL, PRIMARY KEY (tag, idx))'
+    ' WITHOUT ROWID',
+    'CREATE INDEX IF NOT EXISTS msg_tag_idx ON msg_tag (idx)',
+    'CREATE TABLE IF NOT EXISTS msg_sequence ('
+    ' name TEXT PRIMARY KEY, value INTEGER NOT NULL)',
+    'CREATE TABLE IF NOT EXISTS msg_pending (idx INTEGER PRIMARY KEY)',
+    'CREATE TABLE IF NOT EXISTS msg_read_mark ('
+    ' handle TEXT NOT NULL, tag TEXT NOT NULL, idx INTEGER NOT NULL,'
+    ' PRIMARY KEY (handle, tag)) WITHOUT ROWID',
+    'CREATE TABLE IF NOT EXISTS msg_read_range ('
+    ' handle TEXT NOT NULL, lo INTEGER NOT NULL, hi INTEGER NOT NULL,'
+    ' PRIMARY KEY (handle, lo)) WITHOUT ROWID',
+)
+
+#: column of table ``msg`` added to that of former versions
+BODY_LENGTH_SCHEMA = (
+    'ALTER TABLE msg ADD COLUMN body_length INTEGER NOT NULL DEFAULT 0',
+    'UPDATE msg SET body_length = COALESCE((SELECT LENGTH(body)'
+    ' FROM msg_body WHERE msg_body.idx = msg.idx), 0)',
+)
+
+#: query of headers of messages, see :meth:`MsgStore.list_msg_headers`,
+#: their tags joined by its first parameter, :data:`TAG_SEP`.
+HEADER_QUERY = (
+    'SELECT {0}, body_length, thread.root, thread.depth,'
+    ' (SELECT GROUP_CONCAT(tag, ?) FROM msg_tag WHERE msg_tag.idx = msg.idx)'
+    ' FROM msg LEFT JOIN msg_thread AS thread USING (idx)'
+    .format(', '.join(COLUMNS)))
+
+#: threads of messages, see :meth:`MsgStore.get_thread`, created separately
+#: so that messages of former versions are threaded.  Of each message, the
+#: root message of its thread, and a path of indices of :data:`THREAD_KEY`
+#: from it, joined by ``/``: of the order of replies of a thread.
+THREAD_SCHEMA = (
+    'CREATE TABLE msg_thread ('
+    ' idx INTEGER PRIMARY KEY, root INTEGER NOT NULL,'
+    ' depth INTEGER NOT NULL, path TEXT NOT NULL)',
+    'CREATE INDEX msg_thread_root ON msg_thread (root, path)',
+)
+
+#: index of message of column ``path`` of threads, of ordered width
+THREAD_KEY = '{0:010d}'
+
+#: counters of messages of each set of tags, see :meth:`MsgStore.count_msgs`,
+#: created separately so that messages of former versions are counted.
+COUNT_SCHEMA = (
+    'CREATE TABLE msg_count ('
+    ' tags TEXT NOT NULL, recipient TEXT NOT NULL, total INTEGER NOT NULL,'
+    ' latest INTEGER NOT NULL, PRIMARY KEY (tags, recipient)) WITHOUT ROWID',
+    'CREATE TABLE msg_read_count ('
+    ' handle TEXT NOT NULL, tags TEXT NOT NULL, recipient TEXT NOT NULL,'
+    ' total INTEGER NOT NULL, PRIMARY KEY (handle, tags, recipient))'
+    ' WITHOUT ROWID',
+)
+
+#: separator of tags of column ``tags`` of counters
+TAG_SEP = u'\x1f'
+
+#: index of words of messages, see :meth:`MsgStore.search_msgs`, created
+#: separately so that messages of former versions are indexed.
+SEARCH_SCHEMA = (
+    'CREATE TABLE msg_word ('
+    ' word TEXT NOT NULL, idx INTEGER NOT NULL, pos INTEGER NOT NULL,'
+    ' PRIMARY KEY (word, idx, pos)) WITHOUT ROWID',
+)
+
+#: terminal sequences of message text, not indexed
+RE_SEQUENCE = re.compile(r'\x1b(?:\[[0-9;?]*[ -/]*[@-~]|[@-Z\\-_])')
+
+#: pipe codes of message text, see :func:`x84.bbs.output.decode_pipe`
+RE_PIPE = re.compile(r'\|(\d{2,3}|\|)')
+
+#: words of message text and of search queries
+RE_WORD = re.compile(r'\w+', re.UNICODE)
+
+#: terms of search queries, "quoted phrases" or words
+RE_TERM = re.compile(r'"([^"]*)"?|(\S+)')
+
+#: expression of whether message ``{idx}`` is of a range read by ``{handle}``
+RANGE_READ = (
+    'COALESCE((SELECT hi FROM msg_read_range WHERE handle = {handle}'
+    ' AND lo <= {idx} ORDER BY lo DESC LIMIT 1), -2) >= {idx}')
+
+#: expression of whether message ``{idx}`` is beneath a mark of ``{handle}``
+MARK_READ = (
+    'EXISTS (SELECT 1 FROM msg_tag AS read_tag'
+    ' JOIN msg_read_mark AS read_mark USING (tag)'
+    ' WHERE read_tag.idx = {idx} AND read_mark.handle = {handle}'
+    ' AND read_mark.idx >= {idx})')
+
+#: expression of whether message ``{idx}`` is read by user ``{handle}``
+IS_READ = '({0} OR {1})'.format(RANGE_READ, MARK_READ)
+
+#: users of any messages read
+READERS = ('(SELECT handle FROM msg_read_mark'
+           ' UNION SELECT handle FROM msg_read_range) AS reader')
+
+#: row of table ``msg_sequence`` of the last index allocated to a message
+SEQUENCE = 'msg'
+
+
+def _text(value):
+    """ Return unicode of TEXT column ``value``. """
+    if isinstance(value, str):
+        return value.decode('utf8', 'replace')
+    return value
+
+
+def _datetime_text(value):
+    """ Return TEXT column of datetime ``value``. """
+    return value if value is None else value.isoformat(' ')
+
+
+def _text_datetime(value):
+    """ Return datetime of TEXT column ``value``. """
+    if value is None:
+        return None
+    # sliced rather than by strptime, several times slower, of each header.
+    value, _, micro = value.partition('.')
+    return datetime.datetime(
+        int(value[0:4]), int(value[5:7]), int(value[8:10]),
+        int(value[11:13]), int(value[14:16]), int(value[17:19]),
+        int(micro.ljust(6, '0')) if micro else 0)
+
+
+def split_words(text):
+    """
+    Return list of lowercase words of message ``text``.
+
+    Terminal sequences and pipe codes are removed, so that a word of
+    several colors is one word, an escaped pipe ``||`` separates words.
+    """
+    text = RE_SEQUENCE.sub(u'', _text(text) or u'')
+    text = RE_PIPE.sub(lambda match: u' ' if match.group(1) == u'|' else u'',
+                       text)
+    return RE_WORD.findall(text.lower())
+
+
+def parse_query(query):
+    """
+    Return list of phrases of search ``query``, each a tuple of words.
+
+    Words of double quotes are a phrase, and so are words of any other
+    term such as ``x/84``, of :func:`split_words`.
+    """
+    phrases = []
+    for quoted, term in RE_TERM.findall(_text(query) or u''):
+        words = tuple(split_words(quoted or term))
+        if words and words not in phrases:
+            phrases.append(words)
+    return phrases
+
+
+def _positions(subject, body):
+    """ Return list of ``(word, pos)`` of message ``subject`` and ``body``. """
+    words = split_words(subject)
+    # a position between subject and body, so no phrase is of both.
+    words.append(None)
+    words.extend(split_words(body))
+    return [(word, pos) for pos, word in enumerate(words) if word]
+
+
+class MsgStore(Table):
+
+    """
+    Messages of the msgbase, stored by sqlite tables of their columns.
+
+    Written only by :meth:`save_msg` and :meth:`delete_msg`, each in a
+    single transaction.
+    """
+
+    def __init__(self, filepath, table, database=None):
+        """
+        Class initializer.
+
+        :param str filepath: filepath of database.
+        :param str table: name of table, ``store``.
+        :param SqliteDatabase database: connection shared with other tables,
+                                        otherwise a connection is opened
+                                        and closed by :meth:`close`.
+        """
+        self.log = logging.getLogger(__name__)
+        self.filepath, self.table = filepath, table
+        self._owned = database is None
+        self.database = database or SqliteDatabase(filepath)
+        self._conn = self.database.conn
+        if not self.database.readonly:
+            with self.transaction():
+                for statement in SCHEMA:
+                    self._conn.execute(statement)
+                if 'body_length' not in [row[1] for row in self._select(
+                        'PRAGMA table_info(msg)')]:
+                    for statement in BODY_LENGTH_SCHEMA:
+                        self._conn.execute(statement)
+                if not self._select("SELECT 1 FROM sqlite_master WHERE "
+                                    "type='table' AND name='msg_count'"):
+                    for statement in COUNT_SCHEMA:
+                        self._conn.execute(statement)
+                    self.rebuild_counts()
+                if not self._select("SELECT 1 FROM sqlite_master WHERE "
+                                    "type='table' AND name='msg_word'"):
+                    for statement in SEARCH_SCHEMA:
+                        self._conn.execute(statement)
+                    self.rebuild_search()
+                if not self._select("SELECT 1 FROM sqlite_master WHERE "
+                                    "type='table' AND name='msg_thread'"):
+                    for statement in THREAD_SCHEMA:
+                        self._conn.execute(statement)
+                    self.rebuild_threads()
+                self.migrate()
+
+    def _select(self, query, args=()):
+        """ Return all rows of ``query``. """
+        return self._conn.execute(query, args).fetchall()
+
+    def migrate(self):
+        """
+        Copy pickled messages of former versions into the store, once.
+
+        Messages were pickled by table ``unnamed`` of the msgbase, their
+        tags by database ``tags``, and private messages of each recipient
+        by database ``privmsg``; tags and recipients are of the messages
+        themselves.  The former table is then renamed ``unnamed_migrated``.
+        """
+        if not self._select("SELECT 1 FROM sqlite_master WHERE type='table' "
+                            "AND name=?", (LEGACY_TABLE,)):
+            return
+        legacy = SqliteTable(self.filepath, LEGACY_TABLE,
+                             database=self.database)
+        num = 0
+        for key, msg in legacy.iteritems():
+            record = msg.to_record()
+            record['idx'] = int(key)
+            self.save_msg(record)
+            num += 1
+        self._conn.execute('ALTER TABLE "{0}" RENAME TO "{0}_migrated"'
+                           .format(LEGACY_TABLE))
+        self.log.info('msgbase: migrated {0} messages.'.format(num))
+
+    def next_idx(self):
+        """
+        Allocate and return index of a new message.
+
+        Indices are allocated in ascending order, and are never allocated
+        again, even of messages deleted, or of a caller that never saved
+        its message.  The index is recorded as pending until its message
+        is saved, so that no range or mark of messages read extends over
+        it, see :meth:`_add_range`.
+
+        :rtype: int
+        """
+        with self.transaction():
+            idx = self._next_idx()
+            self._conn.execute('INSERT OR IGNORE INTO msg_pending (idx) '
+                               'VALUES (?)', (idx,))
+        return idx
+
+    def _next_idx(self):
+        """ Allocate index of :meth:`next_idx`, of a message saved now. """
+        with self.transaction():
+            rows = self._select('SELECT value FROM msg_sequence '
+                                'WHERE name = ?', (SEQUENCE,))
+            if rows:
+                idx = rows[0][0] + 1
+            else:
+                # first allocation, following any messages of the store.
+                idx = self._select('SELECT COALESCE(MAX(idx), -1) + 1 '
+                                   'FROM msg')[0][0]
+            self._conn.execute('INSERT OR REPLACE INTO msg_sequence '
+                               '(name, value) VALUES (?, ?)', (SEQUENCE, idx))
+        return idx
+
+    def _advance(self, idx):
+        """ Advance sequence of :meth:`next_idx` to at least ``idx``. """
+        self._conn.execute('INSERT OR IGNORE INTO msg_sequence (name, value) '
+                           'SELECT ?, COALESCE(MAX(idx), -1) FROM msg',
+                           (SEQUENCE,))
+        self._conn.execute('UPDATE msg_sequence SET value = ? '
+                           'WHERE name = ? AND value < ?',
+                           (idx, SEQUENCE, idx))
+
+    def get_msg(self, idx):
+        """
+        Return record of message ``idx``.
+
+        :raises KeyError: no such message.
+        :rtype: dict
+        """
+        rows = self._select(
+            'SELECT {0}, extra, body FROM msg LEFT JOIN msg_body '
+            'USING (idx) WHERE idx = ?'.format(', '.join(COLUMNS)), (idx,))
+        if not rows:
+            raise KeyError(idx)
+        values = rows[0]
+        record = dict((column, _text(value))
+                      for column, value in zip(COLUMNS, values))
+        record['ctime'] = _text_datetime(values[3])
+        record['stime'] = _text_datetime(values[4])
+        record['extra'] = pickle.loads(str(values[-2]))
+        record['body'] = _text(values[-1]) or u''
+        record['tags'] = self._tags(idx)
+        record['children'] = [child for child, in self._select(
+            'SELECT idx FROM msg WHERE parent = ?', (idx,))]
+        return record
+
+    def _headers(self, where='', args=()):
+        """ Return list of header records of ``HEADER_QUERY`` ``where``. """
+        headers = []
+        for values in self._select(HEADER_QUERY + where, (TAG_SEP,) +
+                                   tuple(args)):
+            header = dict(zip(COLUMNS, values))
+            for column in ('author', 'recipient', 'subject'):
+                header[column] = _text(header[column])
+            header['ctime'] = _text_datetime(values[3])
+            header['stime'] = _text_datetime(values[4])
+            header['body_length'], header['root'], header['depth'] = (
+                values[-4:-1])
+            tags = _text(values[-1])
+            header['tags'] = tags.split(TAG_SEP) if tags else []
+            headers.append(header)
+        return headers
+
+    def get_msg_header(self, idx):
+        """
+        Return header record of message ``idx``, see :meth:`list_msg_headers`.
+
+        :raises KeyError: no such message.
+        :rtype: dict
+        """
+        headers = self._headers(' WHERE idx = ?', (idx,))
+        if not headers:
+            raise KeyError(idx)
+        return headers[0]
+
+    def list_msg_headers(self, tags=None, offset=0, limit=None, order='asc',
+                         after=None):
+        """
+        Return list of header records of messages of any ``tags``, or all.
+
+        Headers are records of :meth:`get_msg` without ``body``, ``extra``
+        or ``children``, but of ``body_length``, the length of its body,
+        and ``root`` and ``depth``, of its thread, see :meth:`get_thread`.
+        Only the rows of ``msg`` of those messages listed, and their tags,
+        are read.
+
+        :param int offset: number of messages skipped.
+        :param int limit: maximum number of messages, or all.
+        :param str order: ``'asc'`` or ``'desc'``, order of their indices.
+        :param int after: only messages following message of index
+                          ``after``, of ``order``, rather than ``offset``.
+        :rtype: list
+        """
+        if order not in ('asc', 'desc'):
+            raise ValueError('order must be asc or desc: {0!r}'.format(order))
+        where, args = [], []
+        if tags:
+            tags = list(tags)
+            where.append('idx IN (SELECT idx FROM msg_tag WHERE tag IN ({0}))'
+                         .format(', '.join('?' * len(tags))))
+            args.extend(tags)
+        if after is not None:
+            where.append('idx {0} ?'.format('>' if order == 'asc' else '<'))
+            args.append(after)
+        args.extend((-1 if limit is None else limit, offset))
+        return self._headers(
+            '{0} ORDER BY idx {1} LIMIT ? OFFSET ?'.format(
+                ' WHERE ' + ' AND '.join(where) if where else '', order),
+            args)
+
+    def _tags(self, idx):
+        """ Return list of tags of message ``idx``. """
+        return [_text(tag) for tag, in self._select(
+            'SELECT tag FROM msg_tag WHERE idx = ?', (idx,))]
+
+    def save_msg(self, record):
+        """
+        Store message ``record``, replacing any of the same ``idx``.
+
+        A record of ``idx`` None is stored as a new message, of index
+        allocated by :meth:`next_idx`.  Only tags added or removed since
+        the message was last saved are written.  Key ``children`` of
+        ``record`` is ignored, replies are of their own ``parent``.
+
+        :returns: index of message.
+        :rtype: int
+        """
+        with self.transaction():
+            values = [record[column] for column in COLUMNS]
+            tags, stored = set(record['tags']), set()
+            private = int(u'public' not in tags)
+            last = self._select('SELECT MAX(idx) FROM msg')[0][0]
+            if values[0] is None:
+                values[0] = self._next_idx()
+                previous = None
+            else:
+                self._advance(values[0])
+                previous = self._select(
+                    'SELECT private, recipient, subject, body, parent'
+                    ' FROM msg LEFT JOIN msg_body USING (idx) WHERE idx = ?',
+                    (values[0],))
+            if previous:
+                stored = set(self._tags(values[0]))
+                recount = (stored != tags or
+                           previous[0][:2] != (private, values[2]))
+                if recount:
+                    self._count(values[0], -1)
+                reindex = (_text(previous[0][2]), _text(previous[0][3])
+                           ) != (record['subject'], record['body'])
+                if reindex:
+                    self._unindex_words(values[0], *previous[0][2:4])
+            values[3] = _datetime_text(values[3])
+            values[4] = _datetime_text(values[4])
+            values.append(private)
+            values.append(sqlite3.Binary(
+                pickle.dumps(record['extra'], pickle.HIGHEST_PROTOCOL)))
+            values.append(len(record['body'] or u''))
+            idx = self._conn.execute(
+                'INSERT OR REPLACE INTO msg ({0}, private, extra, body_length)'
+                ' VALUES ({1})'.format(', '.join(COLUMNS),
+                                       ', '.join('?' * (len(COLUMNS) + 3))),
+                values).lastrowid
+            self._conn.execute('INSERT OR REPLACE INTO msg_body (idx, body) '
+                               'VALUES (?, ?)', (idx, record['body']))
+            self._conn.execute('DELETE FROM msg_pending WHERE idx = ?',
+                               (idx,))
+            if stored - tags:
+                self._conn.executemany(
+                    'DELETE FROM msg_tag WHERE tag = ? AND idx = ?',
+                    [(tag, idx) for tag in stored - tags])
+            if tags - stored:
+                self._conn.executemany(
+                    'INSERT INTO msg_tag (tag, idx) VALUES (?, ?)',
+                    [(tag, idx) for tag in tags - stored])
+            if not previous or reindex:
+                self._index_words(idx, record['subject'], record['body'])
+            if not previous or previous[0][4] != record['parent']:
+                self._thread(idx, record['parent'])
+            if not previous or recount:
+                # a message of index greater than any other is read by no
+                # user, see _add_range.
+                self._count(idx, 1, readers=bool(
+                    previous or (last is not None and idx < last)))
+            if record['parent'] is not None and not self._select(
+                    'SELECT 1 FROM msg WHERE idx = ?', (record['parent'],)):
+                self.log.warn('Child message {0}.parent = {1}: parent does '
+                              'not exist!'.format(idx, record['parent']))
+        return idx
+
+    def delete_msg(self, idx):
+        """
+        Delete message ``idx``.
+
+        :raises KeyError: no such message.
+        """
+        with self.transaction():
+            rows = self._select('SELECT subject, body FROM msg LEFT JOIN'
+                                ' msg_body USING (idx) WHERE idx = ?', (idx,))
+            if not rows:
+                raise KeyError(idx)
+            self._count(idx, -1)
+            self._unindex_words(idx, *rows[0])
+            self._conn.execute('DELETE FROM msg WHERE idx = ?', (idx,))
+            self._conn.execute('DELETE FROM msg_body WHERE idx = ?', (idx,))
+            self._conn.execute('DELETE FROM msg_tag WHERE idx = ?', (idx,))
+            # replies are then each the root of their own thread.
+            self._conn.execute('DELETE FROM msg_thread WHERE idx = ?', (idx,))
+            for child, in self._select('SELECT idx FROM msg WHERE parent = ?',
+                                       (idx,)):
+                self._thread(child, idx)
+
+    def _thread(self, idx, parent):
+        """
+        Thread message ``idx`` as a reply to ``parent``, and its replies.
+
+        A message of no parent, of a parent that does not exist, or that
+        is itself a reply of this message, is the root of its own thread.
+        Replies threaded of a former path of this message are moved with
+        it, and replies saved before this message are threaded of it.
+        """
+        key = THREAD_KEY.format(idx)
+        rows = self._select('SELECT root, path FROM msg_thread WHERE idx = ?',
+                            (parent,)) if parent is not None else []
+        if rows and key not in rows[0][1].split('/'):
+            root, path = rows[0][0], u'/'.join((rows[0][1], key))
+        else:
+            root, path = idx, key
+        former = self._select('SELECT root, path FROM msg_thread'
+                              ' WHERE idx = ?', (idx,))
+        if former and (former[0][0], former[0][1]) == (root, path):
+            return
+        self._conn.execute('INSERT OR REPLACE INTO msg_thread (idx, root,'
+                           ' depth, path) VALUES (?, ?, ?, ?)',
+                           (idx, root, path.count('/'), path))
+        if former:
+            # replies of paths of prefix of its former path, ordered
+            # before the next path of its depth, '/' preceding '0'.
+            root_was, path_was = former[0]
+            self._conn.execute(
+                'UPDATE msg_thread SET root = ?, depth = depth + ?,'
+                ' path = ? || SUBSTR(path, ?) WHERE root = ?'
+                ' AND path > ? AND path < ?',
+                (root, path.count('/') - path_was.count('/'), path,
+                 len(path_was) + 1, root_was, path_was + '/',
+                 path_was + '0'))
+        for child, in self._select(
+                'SELECT idx FROM msg JOIN msg_thread USING (idx)'
+                ' WHERE parent = ? AND root = idx AND idx != ?', (idx, idx)):
+            self._thread(child, idx)
+
+    def rebuild_threads(self):
+        """ Thread all messages again, see :meth:`get_thread`. """
+        parents, paths = dict(self._select('SELECT idx, parent FROM msg')), {}
+        for idx in parents:
+            # ancestors not yet threaded, until a root: of no parent, of a
+            # parent that does not exist, or of a reply of itself.
+            chain, ancestor = [], idx
+            while (ancestor in parents and ancestor not in paths and
+                   ancestor not in chain):
+                chain.append(ancestor)
+                ancestor = parents[ancestor]
+            path = paths.get(ancestor) if ancestor not in chain else None
+            for reply in reversed(chain):
+                key = THREAD_KEY.format(reply)
+                path = key if path is None else u'/'.join((path, key))
+                paths[reply] = path
+        with self.transaction():
+            self._conn.execute('DELETE FROM msg_thread')
+            self._conn.executemany(
+                'INSERT INTO msg_thread (idx, root, depth, path)'
+                ' VALUES (?, ?, ?, ?)',
+                [(msg_idx, int(msg_path.partition('/')[0]),
+                  msg_path.count('/'), msg_path)
+                 for msg_idx, msg_path in paths.items()])
+
+    def get_thread(self, idx):
+        """
+        Return header records of the thread of message ``idx``.
+
+        Of the root message of its thread, and all replies of it, each
+        following its parent and any replies of lesser index, of keys
+        ``root`` and ``depth`` of :meth:`list_msg_headers`.  Of one query
+        of the index of threads, and not of each reply.
+
+        :raises KeyError: no such message.
+        :rtype: list
+        """
+        rows = self._select('SELECT root FROM msg_thread WHERE idx = ?',
+                            (idx,))
+        if not rows:
+            raise KeyError(idx)
+        return self._headers(' WHERE thread.root = ? ORDER BY thread.path',
+                             (rows[0][0],))
+
+    def _index_words(self, idx, subject, body):
+        """ Index words of ``subject`` and ``body`` of message ``idx``. """
+        self._conn.executemany(
+            'INSERT INTO msg_word (word, idx, pos) VALUES (?, ?, ?)',
+            [(word, idx, pos) for word, pos in _positions(subject, body)])
+
+    def _unindex_words(self, idx, subject, body):
+        """ Forget words of ``subject`` and ``body`` of message ``idx``. """
+        self._conn.executemany(
+            'DELETE FROM msg_word WHERE word = ? AND idx = ?',
+            [(word, idx) for word in set(
+                word for word, _ in _positions(subject, body))])
+
+    def rebuild_search(self):
+        """ Index words of all messages again, see :meth:`search_msgs`. """
+        with self.transaction():
+            self._conn.execute('DELETE FROM msg_word')
+            for idx, subject, body in self._conn.execute(
+                    'SELECT idx, subject, body FROM msg LEFT JOIN msg_body'
+                    ' USING (idx)').fetchall():
+                self._index_words(idx, subject, body)
+
+    def _frequency(self, word):
+        """ Return number of positions of ``word``, of at most 1000. """
+        return self._select('SELECT COUNT(*) FROM (SELECT 1 FROM msg_word'
+                            ' WHERE word = ? LIMIT 1000)', (word,))[0][0]
+
+    def _phrase(self, words):
+        """
+        Return ``(frequency, N, query, args)`` of phrase ``words``.
+
+        Of rows of alias ``word{N}`` of the position of its least frequent
+        word ``N``, each other word joined at its position relative to it.
+        """
+        frequency, first = min((self._frequency(word), pos)
+                               for pos, word in enumerate(words))
+        joins = ['JOIN msg_word AS word{0} ON word{0}.word = ?'
+                 ' AND word{0}.idx = word{1}.idx'
+                 ' AND word{0}.pos = word{1}.pos + ({2})'
+                 .format(pos, first, pos - first)
+                 for pos in range(len(words)) if pos != first]
+        return (frequency, first,
+                'msg_word AS word{0} {1} WHERE word{0}.word = ?'
+                .format(first, ' '.join(joins)),
+                [word for pos, word in enumerate(words) if pos != first] +
+                [words[first]])
+
+    def search_msgs(self, query, tags=None, author=None, handle=None):
+        """
+        Return sorted list of indices of messages of search ``query``.
+
+        Messages of every word and "quoted phrase" of ``query``, of any
+        words of their subject or body, of :func:`parse_query`.  Messages
+        of the least frequent phrase are found by the index of words, and
+        each is then looked up of every other phrase, by the positions of
+        its words: of the number of messages of that phrase, and not of
+        the number of messages.
+
+        :param tags: only messages of any ``tags``.
+        :param str author: only messages of ``author``.
+        :param str handle: also private messages to or from ``handle``,
+                           otherwise only public messages.
+        :rtype: list
+        """
+        phrases = sorted(self._phrase(words) for words in parse_query(query))
+        if not phrases:
+            return []
+        _, first, found, args = phrases[0]
+        query = ('SELECT found.idx FROM (SELECT DISTINCT word{0}.idx FROM'
+                 ' {1}) AS found CROSS JOIN msg ON msg.idx = found.idx'
+                 ' WHERE (private = 0'.format(first, found))
+        if handle:
+            query += ' OR recipient = ? OR author = ?'
+            args.extend((handle, handle))
+        query += ')'
+        for _, first, phrase, phrase_args in phrases[1:]:
+            query += (' AND EXISTS (SELECT 1 FROM {0} AND word{1}.idx ='
+                      ' found.idx)'.format(phrase, first))
+            args.extend(phrase_args)
+        if author:
+            query += ' AND author = ?'
+            args.append(author)
+        if tags:
+            tags = list(tags)
+            query += (' AND EXISTS (SELECT 1 FROM msg_tag WHERE'
+                      ' msg_tag.idx = msg.idx AND tag IN ({0}))'
+                      .format(', '.join('?' * len(tags))))
+            args.extend(tags)
+        return [idx for idx, in self._select(
+            query + ' ORDER BY found.idx', args)]
+
+    def list_msgs(self, tags=None):
+        """ Return set of indices of messages of any ``tags``, or all. """
+        if tags:
+            tags = list(tags)
+            return set(idx for idx, in self._select(
+                'SELECT idx FROM msg_tag WHERE tag IN ({0})'
+                .format(', '.join('?' * len(tags))), tags))
+        return set(idx for idx, in self._select('SELECT idx FROM msg'))
+
+    def list_privmsgs(self, handle=None):
+        """ Return set of private messages to ``handle``, or all. """
+        if handle:
+            return set(idx for idx, in self._select(
+                'SELECT idx FROM msg WHERE private = 1 AND recipient = ?',
+                (handle,)))
+        return set(idx for idx, in self._select(
+            'SELECT idx FROM msg WHERE private = 1'))
+
+    def list_tags(self):
+        """ Return list of tags of any message. """
+        return self.get_tag_counts().keys()
+
+    def _count_key(self, idx):
+        """
+        Return key ``(tags, recipient)`` of counters of message ``idx``.
+
+        Messages are counted of their set of tags, and of their recipient,
+        or of recipient ``''`` of public messages.  Private messages of no
+        recipient are not counted, None is returned.
+        """
+        rows = self._select('SELECT private, recipient FROM msg WHERE idx = ?',
+                            (idx,))
+        if not rows or rows[0][0] and not rows[0][1]:
+            return None
+        return (TAG_SEP.join(sorted(self._tags(idx))),
+                _text(rows[0][1]) if rows[0][0] else u'')
+
+    def _count(self, idx, sign, readers=True):
+        """
+        Count message ``idx`` of counters of :meth:`count_msgs`.
+
+        :param int sign: 1 to count message, -1 to no longer count it.
+        :param bool readers: whether to count it as read by its readers.
+        """
+        key = self._count_key(idx)
+        if key is None:
+            return
+        self._conn.execute('INSERT OR IGNORE INTO msg_count (tags, recipient,'
+                           ' total, latest) VALUES (?, ?, 0, -1)', key)
+        self._conn.execute('UPDATE msg_count SET total = total + ?,'
+                           ' latest = MAX(latest, ?) WHERE tags = ?'
+                           ' AND recipient = ?', (sign, idx) + key)
+        self._conn.execute('DELETE FROM msg_count WHERE tags = ?'
+                           ' AND recipient = ? AND total <= 0', key)
+        if not readers:
+            return
+        if key[1]:
+            handles = [key[1]] if self._select(
+                'SELECT {0}'.format(IS_READ.format(idx=':idx',
+                                                   handle=':handle')),
+                {'idx': idx, 'handle': key[1]})[0][0] else []
+        else:
+            handles = [handle for handle, in self._select(
+                'SELECT handle FROM {0} WHERE {1}'.format(
+                    READERS, IS_READ.format(idx=':idx',
+                                            handle='reader.handle')),
+                {'idx': idx})]
+        for handle in handles:
+            self._count_read(handle, key, sign)
+
+    def _count_read(self, handle, key, num):
+        """ Add ``num`` to counter of messages of ``key`` read by user. """
+        args = (handle,) + key
+        self._conn.execute('INSERT OR IGNORE INTO msg_read_count (handle,'
+                           ' tags, recipient, total) VALUES (?, ?, ?, 0)',
+                           args)
+        self._conn.execute('UPDATE msg_read_count SET total = total + ?'
+                           ' WHERE handle = ? AND tags = ? AND recipient = ?',
+                           (num,) + args)
+        self._conn.execute('DELETE FROM msg_read_count WHERE handle = ?'
+                           ' AND tags = ? AND recipient = ? AND total <= 0',
+                           args)
+
+    def rebuild_counts(self):
+        """ Count all messages, and all messages read by each user, again. """
+        keys, totals = {}, collections.defaultdict(lambda: [0, -1])
+        rows = self._select(
+            'SELECT msg.idx, private, recipient, tag FROM msg LEFT JOIN'
+            ' msg_tag USING (idx) ORDER BY msg.idx, tag')
+        for idx, group in itertools.groupby(rows, lambda row: row[0]):
+            group = list(group)
+            private, recipient = group[0][1], _text(group[0][2])
+            if private and not recipient:
+                continue
+            keys[idx] = key = (
+                TAG_SEP.join(_text(row[3]) for row in group if row[3]),
+                recipient if private else u'')
+            totals[key][0] += 1
+            totals[key][1] = idx
+        read = collections.defaultdict(int)
+        for handle, in self._select('SELECT handle FROM {0}'.format(READERS)):
+            for idx, in self._select(
+                    'SELECT idx FROM msg WHERE {0}'.format(
+                        IS_READ.format(idx='msg.idx', handle=':handle')),
+                    {'handle': handle}):
+                if idx in keys and keys[idx][1] in (u'', handle):
+                    read[(handle,) + keys[idx]] += 1
+        with self.transaction():
+            self._conn.execute('DELETE FROM msg_count')
+            self._conn.execute('DELETE FROM msg_read_count')
+            self._conn.executemany(
+                'INSERT INTO msg_count (tags, recipient, total, latest)'
+                ' VALUES (?, ?, ?, ?)',
+                [tagset + tuple(count) for tagset, count in totals.items()])
+            self._conn.executemany(
+                'INSERT INTO msg_read_count (handle, tags, recipient, total)'
+                ' VALUES (?, ?, ?, ?)',
+                [reader + (count,) for reader, count in read.items()])
+
+    def count_msgs(self, handle, tags=None, private=False):
+        """
+        Return number of messages, of those not read, and latest message.
+
+        Of public messages of any ``tags``, or of all tags by default; or
+        when ``private`` is set, of messages private to ``handle``.  They
+        are of counters of each set of tags of messages, maintained as
+        messages are saved, deleted and read: of the number of distinct
+        sets of tags, and not of the number of messages.
+
+        :param str handle: user handle.
+        :returns: tuple of ``(total, unread, latest)``, latest is the
+                  greatest index of messages counted, or None.
+        :rtype: tuple
+        """
+        recipient = handle if private else u''
+        tags = None if private or not tags else set(tags)
+
+        def matches(tagset):
+            """ Whether counter of ``tagset`` is of any ``tags``. """
+            return tags is None or not tags.isdisjoint(tagset.split(TAG_SEP))
+
+        total, latest = 0, None
+        for tagset, num, idx in self._select(
+                'SELECT tags, total, latest FROM msg_count'
+                ' WHERE recipient = ?', (recipient,)):
+            if matches(tagset):
+                total, latest = total + num, max(latest, idx)
+        unread = total - sum(num for tagset, num in self._select(
+            'SELECT tags, total FROM msg_read_count WHERE handle = ?'
+            ' AND recipient = ?', (handle, recipient)) if matches(tagset))
+        return total, unread, latest
+
+    def get_tag_counts(self):
+        """ Return dictionary of tags and their number of messages. """
+        counts = collections.defaultdict(int)
+        for tagset, num in self._select('SELECT tags, total FROM msg_count'):
+            for tag in filter(None, tagset.split(TAG_SEP)):
+                counts[tag] += num
+        return dict(counts)
+
+    def mark_read(self, handle, indices):
+        """
+        Mark messages ``indices`` read by user ``handle``.
+
+        Indices are recorded as ranges, merged with any adjoining range, or
+        of only deleted messages between them.  The mark of each tag of the
+        messages is then advanced past all of its messages read, and ranges
+        of only messages of lesser index than the mark of any of their tags
+        are forgotten: the size of the record of a user that reads messages
+        in the order received remains of the number of tags.
+        """
+        indices = sorted(set(int(idx) for idx in indices))
+        if not indices:
+            return
+        with self.transaction():
+            unread = []
+            for num in range(0, len(indices), 500):
+                args = dict(('idx{0}'.format(pos), idx) for pos, idx
+                            in enumerate(indices[num:num + 500]))
+                args['handle'] = handle
+                unread.extend(idx for idx, in self._select(
+                    'SELECT idx FROM msg WHERE idx IN ({0}) AND NOT {1}'
+                    .format(', '.join(':' + key for key in args
+                                      if key != 'handle'),
+                            IS_READ.format(idx='msg.idx', handle=':handle')),
+                    args))
+            start = 0
+            for num, idx in enumerate(indices):
+                if num + 1 == len(indices) or indices[num + 1] != idx + 1:
+                    self._add_range(handle, indices[start], idx)
+                    start = num + 1
+            tags = set()
+            for num in range(0, len(indices), 500):
+                chunk = indices[num:num + 500]
+                tags.update(tag for tag, in self._select(
+                    'SELECT DISTINCT tag FROM msg_tag WHERE idx IN ({0})'
+                    .format(', '.join('?' * len(chunk))), chunk))
+            for tag in tags:
+                self._advance_mark(handle, tag)
+            self._conn.execute(
+                'DELETE FROM msg_read_range WHERE handle = :handle'
+                ' AND lo <= (SELECT MAX(idx) FROM msg_read_mark'
+                '  WHERE handle = :handle)'
+                ' AND NOT EXISTS (SELECT 1 FROM msg WHERE msg.idx'
+                '  BETWEEN msg_read_range.lo AND msg_read_range.hi'
+                '  AND NOT {0})'.format(MARK_READ.format(idx='msg.idx',
+                                                         handle=':handle')),
+                {'handle': handle})
+            counts = collections.defaultdict(int)
+            for idx in unread:
+                key = self._count_key(idx)
+                if key is not None and key[1] in (u'', handle):
+                    counts[key] += 1
+            for key, num in counts.items():
+                self._count_read(handle, key, num)
+
+    def _add_range(self, handle, low, high):
+        """ Record messages ``low`` to ``high`` read by ``handle``. """
+        # extend range over indices of no message, of messages deleted or
+        # never saved, so that it may join a range of messages read before.
+        # A range never extends over an index allocated but not yet saved,
+        # see next_idx, nor past the last message, so that messages saved
+        # later are not read.
+        prev_idx, next_idx, last, prev_pending, next_pending = self._select(
+            'SELECT (SELECT MAX(idx) FROM msg WHERE idx < :low),'
+            ' (SELECT MIN(idx) FROM msg WHERE idx > :high),'
+            ' (SELECT MAX(idx) FROM msg),'
+            ' (SELECT MAX(idx) FROM msg_pending WHERE idx < :low),'
+            ' (SELECT MIN(idx) FROM msg_pending WHERE idx > :high)',
+            {'low': low, 'high': high})[0]
+        low = -1 if prev_idx is None else prev_idx + 1
+        high = min(high, last) if next_idx is None else next_idx - 1
+        if prev_pending is not None:
+            low = max(low, prev_pending + 1)
+        if next_pending is not None:
+            high = min(high, next_pending - 1)
+        if last is None or high < low:
+            return
+        merged = self._select(
+            'SELECT MIN(lo), MAX(hi) FROM msg_read_range WHERE handle = ?'
+            ' AND lo <= ? AND hi >= ?', (handle, high + 1, low - 1))[0]
+        if merged[0] is not None:
+            low, high = min(low, merged[0]), max(high, merged[1])
+            self._conn.execute(
+                'DELETE FROM msg_read_range WHERE handle = ?'
+                ' AND lo >= ? AND lo <= ?', (handle, low, high))
+        self._conn.execute('INSERT INTO msg_read_range (handle, lo, hi) '
+                           'VALUES (?, ?, ?)', (handle, low, high))
+
+    def _advance_mark(self, handle, tag):
+        """ Advance mark of ``tag`` of ``handle`` past its messages read. """
+        rows = self._select('SELECT idx FROM msg_read_mark WHERE handle = ?'
+                            ' AND tag = ?', (handle, tag))
+        mark = stored = rows[0][0] if rows else -1
+        # the mark never passes an index allocated but not yet saved, of a
+        # message that may yet be of this tag.
+        pending = self._select('SELECT MIN(idx) FROM msg_pending'
+                               ' WHERE idx > ?', (mark,))[0][0]
+        while True:
+            # next message of tag; if it is within a range read, then so
+            # are all messages of tag of that range.
+            rows = self._select(
+                'SELECT idx, (SELECT hi FROM msg_read_range'
+                '  WHERE handle = ? AND lo <= idx ORDER BY lo DESC LIMIT 1)'
+                ' FROM msg_tag WHERE tag = ? AND idx > ?'
+                ' ORDER BY idx LIMIT 1', (handle, tag, mark))
+            if not rows or rows[0][1] is None or rows[0][1] < rows[0][0]:
+                break
+            high = rows[0][1]
+            if pending is not None:
+                if rows[0][0] > pending:
+                    break
+                high = min(high, pending - 1)
+            mark = self._select('SELECT MAX(idx) FROM msg_tag WHERE tag = ?'
+                                ' AND idx <= ?', (tag, high))[0][0]
+        if mark != stored:
+            self._conn.execute('INSERT OR REPLACE INTO msg_read_mark '
+                               '(handle, tag, idx) VALUES (?, ?, ?)',
+                               (handle, tag, mark))
+
+    def list_unread(self, handle, tags=None, private=False):
+        """
+        Return set of indices of messages not read by user ``handle``.
+
+        :param str handle: user handle.
+        :param tags: messages of any tags, or of all tags by default,
+                     excluding private messages of other users.
+        :param bool private: messages private to ``handle`` instead.
+        :rtype: set
+        """
+        if private:
+            return set(idx for idx, in self._select(
+                'SELECT idx FROM msg WHERE private = 1 AND recipient = :handle'
+                ' AND NOT {0}'.format(IS_READ.format(idx='msg.idx',
+                                                     handle=':handle')),
+                {'handle': handle}))
+        return self._list_unread(handle, tags or self.list_tags(),
+                                 '(private = 0 OR recipient = :handle)')
+
+    def _list_unread(self, handle, tags, visible):
+        """ Return unread messages of ``tags`` of condition ``visible``. """
+        args = {'handle': handle}
+        unread = set()
+        for tag in tags:
+            rows = self._select('SELECT idx FROM msg_read_mark WHERE'
+                                ' handle = ? AND tag = ?', (handle, tag))
+            args.update(tag=tag, mark=rows[0][0] if rows else -1)
+            unread.update(idx for idx, in self._select(
+                'SELECT msg.idx FROM msg_tag AS tagged JOIN msg USING (idx)'
+                ' WHERE tagged.tag = :tag AND tagged.idx > :mark'
+                ' AND {0} AND NOT {1}'.format(
+                    visible, IS_READ.format(idx='tagged.idx',
+                                            handle=':handle')), args))
+        return unread
+
+    def count_unread(self, handle, tags=None, private=False):
+        """ Return number of messages of :meth:`list_unread`. """
+        return len(self.list_unread(handle, tags, private))
+
+    def close(self):
+        """ Close database connection, unless shared with other tables. """
+        if self._owned:
+            self.database.close()
@@ -0,0 +1,168 @@
+""" File descriptor readiness registry for the x/84 engine loop. """
+# std imports
+import threading
+import logging
+import select
+import errno
+import os
+
+try:
+    import fcntl
+except ImportError:
+    # win32, where select() may only be used with sockets; a self-pipe
+    # is not possible, and the engine loop never blocks for long.
+    fcntl = None
+
+#: singleton :class:`Poller` instance of the engine process
+POLLER = None
+
+
+def get_poller():
+    """ Return :class:`Poller` instance of the engine process. """
+    # pylint: disable=W0603
+    #         Using the global statement
+    global POLLER
+    if POLLER is None:
+        POLLER = Poller()
+    return POLLER
+
+
+class Poller(object):
+
+    """
+    Persistent registry of file descriptors polled for read-readiness.
+
+    Server sockets, client sockets and the ``master_read`` pipe of each
+    session are registered as they come and go, rather than rebuilding
+    the complete list of file descriptors on each pass of the event loop.
+
+    ``select.epoll`` is preferred where available, falling back to
+    ``select.poll``, and finally ``select.select``.  The event loop may
+    therefore block until something is ready; other threads (such as the
+    on-connect negotiation threads) may interrupt a blocking :meth:`poll`
+    by calling :meth:`wakeup`, which is done implicitly by :meth:`register`.
+    """
+
+    def __init__(self):
+        """ Class initializer. """
+        self.log = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._fds = set()
+        if hasattr(select, 'epoll'):
+            self.kind = 'epoll'
+            self._impl = select.epoll()
+        elif hasattr(select, 'poll'):
+            self.kind = 'poll'
+            self._impl = select.poll()
+        else:
+            self.kind = 'select'
+            self._impl = None
+
+        # self-pipe, written to by wakeup() to interrupt a blocking poll().
+        self._wake_r = self._wake_w = None
+        if fcntl is not None:
+            self._wake_r, self._wake_w = os.pipe()
+            for fd in (self._wake_r, self._wake_w):
+                flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+                fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+            self._impl_register(self._wake_r)
+
+    def __len__(self):
+        return len(self._fds)
+
+    def __contains__(self, fd):
+        return fd in self._fds
+
+    def register(self, fd):
+        """
+        Register file descriptor ``fd`` for read-readiness.
+
+        Registering an already registered file descriptor is permitted,
+        as file descriptor numbers are re-used by the operating system.
+        """
+        if fd is None or fd < 0:
+            return
+        with self._lock:
+            if fd in self._fds:
+                self._impl_unregister(fd)
+            self._impl_register(fd)
+            self._fds.add(fd)
+        self.wakeup()
+
+    def unregister(self, fd):
+        """ Unregister file descriptor ``fd``, if registered. """
+        if fd is None:
+            return
+        with self._lock:
+            if fd in self._fds:
+                self._fds.discard(fd)
+                self._impl_unregister(fd)
+
+    def wakeup(self):
+        """ Interrupt a blocking call to :meth:`poll`. """
+        if self._wake_w is None:
+            return
+        try:
+            os.write(self._wake_w, b'\x00')
+        except OSError as err:
+            # pipe is full: a wakeup is already pending.
+            if err.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+
+    def poll(self, timeout=None):
+        """
+        Return list of file descriptors ready for reading.
+
+        :param float timeout: seconds to block, ``None`` blocks indefinitely.
+        :rtype: list
+        """
+        try:
+            if self.kind == 'epoll':
+                ready = [fd for fd, _ in self._impl.poll(
+                    -1 if timeout is None else timeout)]
+            elif self.kind == 'poll':
+                ready = [fd for fd, _ in self._impl.poll(
+                    None if timeout is None else int(timeout * 1000))]
+            else:
+                with self._lock:
+                    check_r = list(self._fds)
+                if self._wake_r is not None:
+                    check_r.append(self._wake_r)
+                ready, _, _ = select.select(check_r, [], [], timeout)
+        except (select.error, IOError, OSError) as err:
+            # interrupted system call, or, more than likely EBADF:
+            # a file descriptor we have just decided to poll has gone bad.
+            if err.args[0] != errno.EINTR:
+                self.log.debug('poll: {0}'.format(err))
+            return []
+
+        if self._wake_r is not None and self._wake_r in ready:
+            self._drain_wakeup()
+            ready = [fd for fd in ready if fd != self._wake_r]
+        return ready
+
+    def _drain_wakeup(self):
+        """ Exhaust bytes written to self-pipe by :meth:`wakeup`. """
+        try:
+            while os.read(self._wake_r, 512):
+                pass
+        except OSError as err:
+            if err.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+
+    def _impl_register(self, fd):
+        """ Register ``fd`` with the underlying polling implementation. """
+        if self.kind == 'epoll':
+            self._impl.register(fd, select.EPOLLIN | select.EPOLLPRI)
+        elif self.kind == 'poll':
+            self._impl.register(fd, select.POLLIN | select.POLLPRI)
+
+    def _impl_unregister(self, fd):
+        """ Unregister ``fd`` from the underlying polling implementation. """
+        if self.kind not in ('epoll', 'poll'):
+            return
+        try:
+            self._impl.unregister(fd)
+        except (IOError, OSError, KeyError, ValueError):
+            # epoll silently drops file descriptors once closed.
+            pass
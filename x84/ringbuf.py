@@ -0,0 +1,122 @@
+"""
+Shared-memory ring buffers of session output.
+
+An :class:`OutputRing` is created by the engine for each session before
+its sub-process is started, and is inherited by it.  The session writes
+output, already encoded for the client, directly into the ring, and the
+engine drains it into the client's send buffer, so that bulk output (such
+as art files or door programs) is not copied through the IPC pipe.  The
+pipe is used only to ring a ``'doorbell'`` event when the engine may not
+otherwise know there is output to drain.
+
+There is exactly one writer (the session) and one reader (the engine) of
+each ring.  The writer alone advances ``head``, and the reader alone
+advances ``tail``, each an ever-increasing count of bytes.  When the ring
+is full, the writer must wait for the reader: this is the back-pressure
+that suspends a session producing output faster than its client receives.
+"""
+# std imports
+import ctypes
+import mmap
+import sys
+
+# offsets of header fields, each on its own cache line.
+_HEAD, _TAIL, _CLOSED = 0, 64, 128
+
+#: size of ring header, output begins at this offset.
+HEADER_SIZE = 192
+
+
+def ring_supported():
+    """
+    Whether output rings may be shared with session sub-processes.
+
+    An anonymous memory map is inherited only by ``fork()``; on win32,
+    ``multiprocessing`` must pickle the arguments of a sub-process.
+    """
+    return not sys.platform.lower().startswith('win32')
+
+
+class OutputRing(object):
+
+    """ Single-writer, single-reader ring buffer of shared memory. """
+
+    def __init__(self, size):
+        """
+        Class initializer.
+
+        :param int size: capacity of ring, in bytes.
+        """
+        self.size = size
+        self._mmap = mmap.mmap(-1, HEADER_SIZE + size)
+        # header fields are aligned 64-bit integers, each written by only
+        # one of either process.
+        self._head = ctypes.c_uint64.from_buffer(self._mmap, _HEAD)
+        self._tail = ctypes.c_uint64.from_buffer(self._mmap, _TAIL)
+        self._closed = ctypes.c_uint64.from_buffer(self._mmap, _CLOSED)
+
+    @property
+    def head(self):
+        """ Total number of bytes ever written. """
+        return self._head.value
+
+    @property
+    def tail(self):
+        """ Total number of bytes ever read. """
+        return self._tail.value
+
+    @property
+    def closed(self):
+        """ Whether the reader has closed the ring. """
+        return bool(self._closed.value)
+
+    def pending(self):
+        """ Number of bytes written that are not yet read. """
+        return self._head.value - self._tail.value
+
+    def close(self):
+        """ Close ring, writes are then discarded by :meth:`write`. """
+        self._closed.value = 1
+
+    def write(self, data, offset=0):
+        """
+        Write bytes of ``data`` from ``offset``, as many as will fit.
+
+        :returns: number of bytes written, 0 when the ring is full.
+        :rtype: int
+        """
+        head = self._head.value
+        length = min(len(data) - offset,
+                     self.size - (head - self._tail.value))
+        if length <= 0:
+            return 0
+        pos = head % self.size
+        first = min(length, self.size - pos)
+        self._mmap.seek(HEADER_SIZE + pos)
+        self._mmap.write(buffer(data, offset, first))
+        if first < length:
+            self._mmap.seek(HEADER_SIZE)
+            self._mmap.write(buffer(data, offset + first, length - first))
+        # publish only after the bytes themselves are written.
+        self._head.value = head + length
+        return length
+
+    def read(self, limit=None):
+        """
+        Read and return bytes written, at most ``limit``.
+
+        :rtype: str
+        """
+        tail = self._tail.value
+        length = self._head.value - tail
+        if limit is not None:
+            length = min(length, limit)
+        if length <= 0:
+            return ''
+        pos = tail % self.size
+        first = min(length, self.size - pos)
+        data = self._mmap[HEADER_SIZE + pos:HEADER_SIZE + pos + first]
+        if first < length:
+            data += self._mmap[HEADER_SIZE:HEADER_SIZE + length - first]
+        self._tail.value = tail + length
+        return data
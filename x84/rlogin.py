@@ -313,10 +313,3 @@ class RLoginServer(BaseServer):
 
         self.log.info('rlogin listening on {self.addr}:{self.port}/tcp'
                       .format(self=self))
-
-    def client_fds(self):
-        """ Return list of rlogin client file descriptors. """
-        fds = [client.fileno() for client in self.clients.values()]
-        # pylint: disable=bad-builtin
-        #         You're drunk, pylint
-        return filter(None, fds)
@@ -65,22 +65,3 @@ class BaseServer(object):
         """ Return list of connected clients. """
         return self.clients.values()
 
-    def client_fds(self):
-        """ Return list of client file descriptors.  """
-        return [client.fileno() for client in self.clients.values()]
-
-    def clients_ready(self, ready_fds=None):
-        """
-        Return list of clients with data ready to be receive.
-
-        :param list ready_fds: file descriptors already known to be ready
-        """
-        if ready_fds is None:
-            # given no file descriptors, we must iterate them all by hand.
-            return [client for client in self.clients.values()
-                    if client.recv_ready()]
-
-        # given a list of ready_fds pairs, we return only clients with
-        # matching file descriptors.
-        return [client for client in self.clients.values()
-                if client.fileno() in ready_fds]
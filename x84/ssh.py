@@ -23,6 +23,7 @@ from x84.bbs.userbase import (
 
 from x84.terminal import spawn_client_session, on_naws
 from x84.client import BaseClient, BaseConnect
+from x84.poller import get_poller
 from x84.server import BaseServer
 from x84.sftp import X84SFTPServer
 
@@ -56,6 +57,10 @@ class SshClient(BaseClient):
         """
         self.active = False
         if self.channel is not None:
+            # the channel's fd may have been registered for polling before
+            # the session kind was transposed to 'sftp'; poll_fileno() then
+            # no longer returns it, forget it here before it is closed.
+            get_poller().unregister(self.channel.fileno())
             try:
                 # """ only close the pipe when the user explicitly closes the
                 # channel. otherwise they will get unpleasant surprises. (and
@@ -124,7 +129,7 @@ class SshClient(BaseClient):
             self.log.warn('send() called on empty buffer')
             return 0
 
-        ready_bytes = bytes(''.join(self.send_buffer))
+        ready_bytes = self.send_buffer.tostring()
         self.send_buffer = array.array('c')
 
         sent = self._send(ready_bytes)
@@ -133,6 +138,18 @@ class SshClient(BaseClient):
             self.send_buffer.fromstring(ready_bytes[sent:])
         return sent
 
+    def poll_fileno(self):
+        """
+        File descriptor of the ssh channel, polled for read-readiness.
+
+        The socket itself is serviced by paramiko's transport thread,
+        and is never polled by the engine.
+        """
+        if self.channel is None or self.kind == 'sftp':
+            # see comment of recv_ready(), below.
+            return None
+        return self.channel.fileno()
+
     def recv_ready(self):
         """ Whether data is awaiting on the ssh channel.  """
         if self.channel is None or self.kind == 'sftp':
@@ -491,17 +508,3 @@ class SshServer(BaseServer):
             fp.write("{0} {1}".format(pub.get_name(), pub.get_base64()))
         self.log.debug('{filename}.pub saved.'.format(filename=filename))
         return priv_key
-
-    def client_fds(self):
-        """ Return list of client file descriptors to poll for read/write. """
-        return [_client.channel.fileno() for _client in self.clients.values()
-                if _client.channel is not None]
-
-    def clients_ready(self, ready_fds=None):
-        """
-        Return a list of clients with data ready to be receive.
-
-        The ``ready_fds`` parameter is ignored by the SSH Server.
-        """
-        return [client for client in self.clients.values()
-                if client.recv_ready()]
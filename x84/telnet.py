@@ -303,10 +303,10 @@ class TelnetClient(BaseClient):
             self._iac_sniffer(byte)
         return recv
 
-    def send_unicode(self, ucs, encoding='utf8'):
-        """ Buffer unicode string, encoded for client as 'encoding'. """
+    def send_encoded(self, bstr):
+        """ Buffer bytestring of session output, already encoded. """
         # Must be escaped 255 (IAC + IAC) to avoid IAC interpretation.
-        self.send_str(ucs.encode(encoding, 'replace').replace(IAC, 2 * IAC))
+        self.send_str(bstr.replace(IAC, 2 * IAC))
 
     def _recv_byte(self, byte):
         """
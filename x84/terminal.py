@@ -1,11 +1,100 @@
 """ Terminal handler for x/84 """
 import contextlib
+import threading
 import logging
 import codecs
 import sys
 from blessed import Terminal as BlessedTerminal
 
-TERMINALS = dict()
+
+class TerminalRegistry(object):
+
+    """
+    Registry of :class:`TerminalProcess` instances.
+
+    Terminals are indexed by session-id, by client instance, by the file
+    descriptor polled for the client (:meth:`x84.client.BaseClient.poll_fileno`)
+    and by file descriptor of the ``master_read`` pipe, so that the engine
+    may discover the terminal of a ready file descriptor without scanning
+    every session.
+
+    The file descriptors are recorded at the time of registration, as they
+    are no longer available from their socket or pipe once closed.
+    """
+
+    def __init__(self):
+        """ Class initializer. """
+        self._by_sid = dict()
+        self._by_client = dict()
+        self._by_client_fd = dict()
+        self._by_master_fd = dict()
+        self._fds = dict()
+        self._registered = list()
+
+    def __len__(self):
+        return len(self._by_sid)
+
+    def __contains__(self, sid):
+        return sid in self._by_sid
+
+    def add(self, tty):
+        """ Add :class:`TerminalProcess` instance ``tty`` to registry. """
+        client_fd = tty.client.poll_fileno()
+        master_fd = tty.master_read.fileno()
+        self._by_client[tty.client] = tty
+        if client_fd is not None:
+            self._by_client_fd[client_fd] = tty
+        self._by_master_fd[master_fd] = tty
+        self._fds[tty.sid] = (client_fd, master_fd)
+        self._by_sid[tty.sid] = tty
+        self._registered.append(tty)
+
+    def remove(self, tty):
+        """ Remove :class:`TerminalProcess` instance ``tty`` from registry. """
+        client_fd, master_fd = self._fds.pop(tty.sid, (None, None))
+        for index, key in ((self._by_client_fd, client_fd),
+                           (self._by_master_fd, master_fd),
+                           (self._by_client, tty.client)):
+            if index.get(key) is tty:
+                del index[key]
+        if self._by_sid.get(tty.sid) is tty:
+            del self._by_sid[tty.sid]
+
+    def items(self):
+        """ Return list of all terminals as tuples (session-id, tty). """
+        return self._by_sid.items()
+
+    def registered(self):
+        """
+        Return list of terminals added since last called, not yet removed.
+
+        Terminals are added by on-connect negotiation threads, of which the
+        engine is woken by :func:`register_tty`, to send any input of the
+        client already buffered.
+        """
+        registered, self._registered = self._registered, list()
+        return [tty for tty in registered
+                if self._by_sid.get(tty.sid) is tty]
+
+    def by_sid(self, sid):
+        """ Return terminal of session-id ``sid``, or None. """
+        return self._by_sid.get(sid)
+
+    def by_client(self, client):
+        """ Return terminal of ``client`` instance, or None. """
+        return self._by_client.get(client)
+
+    def by_client_fd(self, fd):
+        """ Return terminal of client polled by file descriptor ``fd``. """
+        return self._by_client_fd.get(fd)
+
+    def by_master_fd(self, fd):
+        """ Return terminal of ``master_read`` file descriptor ``fd``. """
+        return self._by_master_fd.get(fd)
+
+
+#: registry of all terminals of the engine process
+TERMINALS = TerminalRegistry()
 
 
 class Terminal(BlessedTerminal):
@@ -148,14 +237,15 @@ def determine_encoding(env):
     return env.get('encoding', fallback_encoding)
 
 
-def init_term(writer, env):
+def init_term(writer, env, output_ring=None):
     """
     Determine the final TERM and encoding and return a Terminal.
 
     curses is initialized using the value of 'TERM' of dictionary env,
     as well as a starting window size of 'LINES' and 'COLUMNS'. If the
     terminal-type is of 'ansi' or 'ansi-bbs', then the cp437 encoding
-    is assumed; otherwise 'utf8'.
+    is assumed; otherwise 'utf8'.  Output is written to ``output_ring``,
+    when given.
 
     A blessed-abstracted curses terminal is returned.
     """
@@ -165,7 +255,8 @@ def init_term(writer, env):
     env['TERM'] = translate_ttype(env.get('TERM', 'unknown'))
     env['encoding'] = determine_encoding(env)
     term = Terminal(kind=env['TERM'],
-                    stream=IPCStream(writer=writer),
+                    stream=IPCStream(writer=writer,
+                                     output_ring=output_ring),
                     rows=int(env.get('LINES', '24')),
                     columns=int(env.get('COLUMNS', '80')))
 
@@ -176,7 +267,8 @@ def init_term(writer, env):
         log.debug('terminal-type {0} failed, using {1} instead.'
                   .format(env['TERM'], termcap_unknown))
         term = Terminal(kind=termcap_unknown,
-                        stream=IPCStream(writer=writer),
+                        stream=IPCStream(writer=writer,
+                                         output_ring=output_ring),
                         rows=int(env.get('LINES', '24')),
                         columns=int(env.get('COLUMNS', '80')))
 
@@ -200,14 +292,18 @@ class TerminalProcess(object):
     An instance of this class is stored using :func:`register_tty`
     and removed by :func:`unregister_tty`, and discovered using
     :func:`get_terminals`.
+
+    Session output is received by ``master_read`` or, when the session
+    shares a :class:`x84.ringbuf.OutputRing`, from ``output_ring``.
     """
 
-    def __init__(self, client, sid, master_pipes):
+    def __init__(self, client, sid, master_pipes, output_ring=None):
         """ Class constructor. """
         from x84.bbs import get_ini
         self.client = client
         self.sid = sid
         (self.master_write, self.master_read) = master_pipes
+        self.output_ring = output_ring
         self.timeout = get_ini('system', 'timeout') or 0
 
 
@@ -218,36 +314,56 @@ def flush_queue(queue):
     Seeks any remaining events in queue, used before closing
     to prevent zombie processes with IPC waiting to be picked up.
     """
+    from x84.framing import recv_event
     log = logging.getLogger(__name__)
     try:
         while queue.poll():
-            event, data = queue.recv()
+            event, data = recv_event(queue)
             if event == 'logger':
                 log.handle(data)
-    except (EOFError, IOError) as err:
+    except (EOFError, IOError, ValueError) as err:
         log.debug(err)
 
 
 def register_tty(tty):
-    """ Register a :class:`TerminalProcess` instance. """
+    """
+    Register a :class:`TerminalProcess` instance.
+
+    The ``master_read`` pipe of the session and the client socket are
+    registered with :func:`x84.poller.get_poller` for the engine loop, which
+    is woken to send input of the client buffered during negotiation, see
+    :meth:`TerminalRegistry.registered`.
+    """
+    from x84.poller import get_poller
     log = logging.getLogger(__name__)
     log.debug('[{tty.sid}] registered tty'.format(tty=tty))
-    TERMINALS[tty.sid] = tty
+    TERMINALS.add(tty)
+    poller = get_poller()
+    if not sys.platform.lower().startswith('win32'):
+        # WIN32's IPC is not done using sockets, so it is not
+        # possible to poll them, sessions are polled at every loop.
+        poller.register(tty.master_read.fileno())
+    poller.register(tty.client.poll_fileno())
 
 
 def unregister_tty(tty):
     """ Unregister a :class:`TerminalProcess` instance. """
+    from x84.poller import get_poller
     try:
+        get_poller().unregister(tty.master_read.fileno())
         flush_queue(tty.master_read)
         tty.master_read.close()
         tty.master_write.close()
+        if tty.output_ring is not None:
+            # a session waiting for room in its ring may now exit.
+            tty.output_ring.close()
     except (EOFError, IOError) as err:
         log = logging.getLogger(__name__)
         log.exception(err)
     if tty.client.active:
         # signal tcp socket to close
         tty.client.deactivate()
-    del TERMINALS[tty.sid]
+    TERMINALS.remove(tty)
 
 
 def get_terminals():
@@ -257,22 +373,22 @@ def get_terminals():
 
 def find_tty(client):
     """ Given a client, return a matching tty, or None if not registered. """
-    try:
-        return next(tty for _, tty in get_terminals() if client == tty.client)
-    except StopIteration:
-        pass
+    return TERMINALS.by_client(client)
 
 
 def kill_session(client, reason='killed'):
     """ Given a client, shutdown its socket and signal subprocess exit. """
     from x84.bbs.exception import Disconnected
+    from x84.framing import send_event
+    from x84.poller import get_poller
+    get_poller().unregister(client.poll_fileno())
     client.shutdown()
 
     log = logging.getLogger(__name__)
     tty = find_tty(client)
     if tty is not None:
         try:
-            tty.master_write.send(('exception', Disconnected(reason),))
+            send_event(tty.master_write, 'exception', Disconnected(reason))
         except (EOFError, IOError):
             pass
         log.info('[{tty.sid}] goodbye: {reason}'
@@ -281,7 +397,7 @@ def kill_session(client, reason='killed'):
 
 
 def start_process(sid, env, CFG, child_pipes, kind, addrport,
-                  matrix_args=None, matrix_kwargs=None):
+                  matrix_args=None, matrix_kwargs=None, output_ring=None):
     """
     A ``multiprocessing.Process`` target.
 
@@ -297,13 +413,16 @@ def start_process(sid, env, CFG, child_pipes, kind, addrport,
                               script.
     :param dict matrix_kwargs: optional keyward arguments to pass to matrix
                                script.
+    :param x84.ringbuf.OutputRing output_ring: optional shared memory ring
+                                               for session output.
     """
     # pylint: disable=R0913,R0914
-    #         Too many arguments (8/5)
+    #         Too many arguments (9/5)
     #         Too many local variables (16/15)
     import x84.bbs.ini
     from x84.bbs.ipc import make_root_logger
     from x84.bbs.session import Session
+    from x84.framing import send_event
 
     # CFG must be pickled and sent to child process; on windows systems,
     # fork() does not duplicate that it has been initialized, and requires
@@ -319,7 +438,7 @@ def start_process(sid, env, CFG, child_pipes, kind, addrport,
     # instantiate and create a new terminal instance given the value
     # of env[TERM], negotiated by protocol. May modify the value of
     # env[TERM] by function translate_ttype
-    terminal = init_term(writer=writer, env=env)
+    terminal = init_term(writer=writer, env=env, output_ring=output_ring)
 
     try:
         # instantiate and run session
@@ -337,7 +456,7 @@ def start_process(sid, env, CFG, child_pipes, kind, addrport,
     finally:
         # signal exit to engine
         try:
-            writer.send(('exit', None))
+            send_event(writer, 'exit', None)
         except IOError as err:
             # ignore [Errno 232] The pipe is being closed,
             # only occurs on win32 platform after early exit
@@ -345,34 +464,235 @@ def start_process(sid, env, CFG, child_pipes, kind, addrport,
                 raise
 
 
+def make_output_ring():
+    """ Return new output ring of configured size, or None if disabled. """
+    from x84.ringbuf import OutputRing, ring_supported
+    from x84.bbs import get_ini
+    ring_size = get_ini('session', 'output_ring', getter='getint')
+    if ring_size and ring_supported():
+        return OutputRing(size=ring_size)
+    return None
+
+
+def warm_session(kind=None):
+    """
+    Prepare a session in advance of any client.
+
+    This is done by idle :class:`SessionWorker` sub-processes, importing
+    the modules used by every session and, when ``kind`` is given, loading
+    the capabilities of that terminal type.  As curses may be initialized
+    only once per process, such a worker may only serve a client of the
+    same terminal type.
+    """
+    import imp
+    import os
+    # pylint: disable=W0611
+    #         Unused import
+    import x84.bbs
+    import x84.bbs.session
+    from x84.bbs.ipc import IPCStream
+    from x84.bbs import get_ini
+    if kind is not None:
+        # compiled patterns of terminal sequences remain cached by 're'.
+        Terminal(kind=kind, stream=IPCStream(writer=None),
+                 rows=24, columns=80)
+    script_path = get_ini('system', 'scriptpath')
+    if not os.path.isdir(script_path):
+        return
+    if script_path not in sys.path:
+        sys.path.insert(0, script_path)
+    try:
+        # as Session.script_module, which finds its dependencies imported.
+        lookup = imp.find_module('__init__', [script_path])
+        imp.load_module(os.path.basename(script_path), *lookup)
+    # pylint: disable=W0703
+    #         Catching too general exception
+    except Exception:
+        # any error is raised again, and logged, by the session.
+        pass
+
+
+def worker_process(CFG, child_pipes, kind=None, output_ring=None):
+    """
+    A ``multiprocessing.Process`` target of :class:`SessionWorker`.
+
+    The session is prepared by :func:`warm_session`, then the ``'start'``
+    event is awaited from the engine, whose data is the remaining keyword
+    arguments of :func:`start_process`.
+
+    :param ConfigParser.ConfigParser CFG: bbs configuration
+    :param tuple child_pipes: tuple of ``(writer, reader)`` for engine IPC.
+    :param str kind: terminal type of clients served, if known.
+    :param x84.ringbuf.OutputRing output_ring: optional shared memory ring
+                                               for session output.
+    """
+    import x84.bbs.ini
+    from x84.framing import recv_event
+    x84.bbs.ini.CFG = CFG
+    warm_session(kind)
+
+    (_, reader) = child_pipes
+    try:
+        event, data = recv_event(reader)
+    except (EOFError, IOError, ValueError):
+        # engine has shutdown.
+        return
+    if event == 'start':
+        start_process(CFG=CFG, child_pipes=child_pipes,
+                      output_ring=output_ring, **data)
+
+
+class SessionWorker(object):
+
+    """
+    An idle, pre-forked session sub-process, awaiting a client.
+
+    Instances are created by :func:`prefork_sessions` and claimed by
+    :func:`spawn_client_session`, which sends the ``'start'`` event.
+    A worker serves only a single session, and is not re-used.  When
+    ``kind`` is given, it serves only clients of that terminal type.
+    """
+
+    def __init__(self, kind=None):
+        """ Class constructor, starts sub-process. """
+        from multiprocessing import Process, Pipe
+        import x84.bbs.ini
+        self.kind = kind
+        child_read, self.master_write = Pipe(duplex=False)
+        self.master_read, child_write = Pipe(duplex=False)
+        self.output_ring = make_output_ring()
+        self.process = Process(target=worker_process, kwargs={
+            'CFG': x84.bbs.ini.CFG,
+            'child_pipes': (child_write, child_read),
+            'kind': kind,
+            'output_ring': self.output_ring,
+        })
+        self.process.start()
+
+    def start(self, **kwargs):
+        """ Begin session of given :func:`start_process` arguments. """
+        from x84.framing import send_event
+        send_event(self.master_write, 'start', kwargs)
+
+    def close(self):
+        """ Signal idle sub-process to exit. """
+        from x84.framing import send_event
+        try:
+            # explicitly, as other sub-processes inherit our end of the pipe.
+            send_event(self.master_write, 'exit', None)
+        except IOError:
+            pass
+        self.master_write.close()
+        self.master_read.close()
+
+
+#: idle session sub-processes, see :func:`prefork_sessions`
+WORKERS = list()
+
+#: lock of :data:`WORKERS`, claimed by on-connect threads.
+WORKERS_LOCK = threading.Lock()
+
+
+def prefork_sessions():
+    """
+    Start idle session sub-processes, as many as configured.
+
+    Called by the engine at start, and periodically thereafter, to replace
+    those claimed by connecting clients.  The number of idle workers for
+    each terminal type of ``prefork_terminals`` is configured by value
+    ``prefork`` of section ``[session]``, 0 disables.  When no terminal
+    types are configured, workers serve clients of any terminal type.
+    """
+    from x84.bbs import get_ini
+    count = get_ini('session', 'prefork', getter='getint') or 0
+    kinds = [kind for kind in get_ini('session', 'prefork_terminals',
+                                      split=True) if kind] or [None]
+    with WORKERS_LOCK:
+        for worker in [_worker for _worker in WORKERS
+                       if not _worker.process.is_alive()]:
+            WORKERS.remove(worker)
+            worker.close()
+        for kind in kinds:
+            idle = len([worker for worker in WORKERS if worker.kind == kind])
+            for _ in range(count - idle):
+                WORKERS.append(SessionWorker(kind=kind))
+
+
+def shutdown_workers():
+    """ Signal all idle session sub-processes to exit. """
+    with WORKERS_LOCK:
+        while WORKERS:
+            WORKERS.pop().close()
+
+
+def claim_worker(kind):
+    """
+    Return an idle :class:`SessionWorker` for terminal type ``kind``.
+
+    A worker prepared for the same terminal type is preferred, otherwise
+    any worker not prepared for a terminal type, or None.
+    """
+    with WORKERS_LOCK:
+        for match in (kind, None):
+            for worker in WORKERS:
+                if worker.kind == match and worker.process.is_alive():
+                    WORKERS.remove(worker)
+                    return worker
+    return None
+
+
 def spawn_client_session(client, matrix_kwargs=None):
     """ Spawn sub-process for connecting client.
 
-    Optional
+    An idle, pre-forked :class:`SessionWorker` is used when available,
+    otherwise a new sub-process is started.
     """
     from multiprocessing import Process, Pipe
     import x84.bbs.ini
 
-    child_read, master_write = Pipe(duplex=False)
-    master_read, child_write = Pipe(duplex=False)
     session_id = '{client.kind}-{client.addrport}'.format(client=client)
-
-    # start sub-process, which will initialize the terminal and
-    # begins the 'session' for the connecting client.
-    Process(target=start_process, kwargs={
+    kwargs = {
         'sid': session_id,
         'env': client.env,
-        'CFG': x84.bbs.ini.CFG,
-        'child_pipes': (child_write, child_read),
         'kind': client.kind,
         'addrport': client.addrport,
         'matrix_kwargs': matrix_kwargs,
-    }).start()
+    }
+
+    worker = claim_worker(translate_ttype(client.env.get('TERM', 'unknown')))
+    if worker is not None:
+        try:
+            # begin session by idle sub-process.
+            worker.start(**kwargs)
+        except IOError:
+            # sub-process exited since claimed.
+            worker.close()
+            worker = None
+        else:
+            master_pipes = (worker.master_write, worker.master_read)
+            output_ring = worker.output_ring
+    if worker is None:
+        child_read, master_write = Pipe(duplex=False)
+        master_read, child_write = Pipe(duplex=False)
+        master_pipes = (master_write, master_read)
+
+        # shared memory ring for session output, unless disabled (0).
+        output_ring = make_output_ring()
+
+        # start sub-process, which will initialize the terminal and
+        # begins the 'session' for the connecting client.
+        kwargs.update({
+            'CFG': x84.bbs.ini.CFG,
+            'child_pipes': (child_write, child_read),
+            'output_ring': output_ring,
+        })
+        Process(target=start_process, kwargs=kwargs).start()
 
     # and register its tty and master-side pipes for polling by x84.engine
     register_tty(TerminalProcess(client=client,
                                  sid=session_id,
-                                 master_pipes=(master_write, master_read)))
+                                 master_pipes=master_pipes,
+                                 output_ring=output_ring))
 
 
 def on_naws(client):
@@ -384,10 +704,10 @@ def on_naws(client):
 
     This is ultimately handled by :meth:`x84.bbs.session.Session.buffer_event`.
     """
-    for _, tty in get_terminals():
-        if client == tty.client:
-            columns = int(client.env['COLUMNS'])
-            rows = int(client.env['LINES'])
-            tty.master_write.send(('refresh', ('resize', (columns, rows),)))
-            break
+    from x84.framing import send_event
+    tty = find_tty(client)
+    if tty is not None:
+        columns = int(client.env['COLUMNS'])
+        rows = int(client.env['LINES'])
+        send_event(tty.master_write, 'refresh', ('resize', (columns, rows),))
     return True
@@ -166,12 +166,8 @@ def serve_messages_for(board_id, request_data, db_source):
     """ Reply-to api client request to receive new messages. """
     # pylint: disable=R0914
     #         Too many local variables (16/15)
-    from x84.bbs import DBProxy, msgbase
-    from x84.bbs.msgbase import to_utctime
+    from x84.bbs.msgbase import to_utctime, get_msg, list_msg_headers
     log = logging.getLogger(__name__)
-    # log.error(msg)
-    db_tags = DBProxy(msgbase.TAGDB, use_session=False)
-    db_messages = DBProxy(msgbase.MSGDB, use_session=False)
 
     def message_owned_by(msg_id, board_id):
         """ Whether given message is owned by specified board. """
@@ -182,14 +178,14 @@ def serve_messages_for(board_id, request_data, db_source):
         """
         Generator of network messages following index ``idx```.
 
-        If ``idx`` is None, all messages are returned.
+        If ``idx`` is None, all messages are returned.  Messages are
+        selected by their headers, only those returned are read in full.
         """
-        for msg_id in db_tags.get(request_data['network'], []):
-            if idx is None:
-                yield db_messages[idx]
-            elif (int(msg_id) > int(idx) and
-                  not message_owned_by(msg_id, board_id)):
-                yield db_messages[msg_id]
+        after = None if idx is None else int(idx)
+        for header in list_msg_headers(tags=(request_data['network'],),
+                                       after=after):
+            if idx is None or not message_owned_by(header.idx, board_id):
+                yield get_msg(header.idx)
 
     last_seen = request_data.get('last', None)
     pending_messages = msgs_after(last_seen)
@@ -224,7 +220,7 @@ def serve_messages_for(board_id, request_data, db_source):
 def receive_message_from(board_id, request_data,
                          db_source, db_transactions):
     """ Reply-to api client request to post a new message. """
-    from x84.bbs.msgbase import to_localtime, Msg
+    from x84.bbs.msgbase import to_localtime, next_msg_idx, Msg
     log = logging.getLogger(__name__)
 
     if 'message' not in request_data:
@@ -254,10 +250,13 @@ def receive_message_from(board_id, request_data,
     # ?? is this removing millesconds, or ?
     _ctime = to_localtime(pullmsg['ctime'].split('.', 1)[0])
 
-    msg.save(send_net=False, ctime=_ctime)
+    # record the source of its index before the message is saved, so that
+    # it is never served back to the board that sent it.
+    msg.idx = next_msg_idx()
     with db_source, db_transactions:
         db_source[msg.idx] = board_id
         db_transactions[msg.idx] = msg.idx
+    msg.save(send_net=False, ctime=_ctime)
 
     web.ctx.status = '201 Created'
     return {u'response': True, u'id': msg.idx}